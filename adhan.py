@@ -1,50 +1,91 @@
 # -*- coding: utf-8 -*-
 """
 Adhan app — كامل: auto-update (GitHub version.txt), mapping (lat/lon/tz/method),
-offline fallback, GUI عربي مودرن (Light), system tray, startup on Windows,
-robust single-instance check (psutil PID check + socket fallback), play adhan 10s,
-update prayer times every 30m.
+offline astronomical prayer-time calculation (Aladhan API as optional cross-check), GUI عربي مودرن (Light), system tray, startup on Windows,
+single-instance lock (a second launch restores the running window), play adhan 10s,
+event-driven refresh (timings recomputed at midnight and on config edits / network recovery,
+asset sync and update check every ~6h, persisted across restarts), headless daemon (--headless)
+and CLI (times / next).
 By SMRH
 """
 
 import os
 import sys
 import json
+import math
+import hashlib
 import time
+import heapq
+import struct
+import mmap
+import glob
+import random
 import threading
-import requests
-import socket
-from datetime import datetime
-from pathlib import Path
+import importlib
+import unicodedata
+from bisect import bisect_left
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import Mapping, MutableMapping
+from datetime import date, datetime, timedelta
+from urllib.parse import urlsplit
 
-# GUI & audio
 try:
-    import pygame
-except Exception:
-    pygame = None
+    from zoneinfo import ZoneInfo
+except Exception:  # Python < 3.9 or no tz database: use the machine offset
+    ZoneInfo = None
 
-try:
-    import pystray
-    from PIL import Image, ImageDraw
-except Exception:
-    pystray = None
-    Image = None
-    ImageDraw = None
+_PROCESS_START = time.perf_counter()   # startup timing report starts here
 
-try:
-    import ttkbootstrap as tb
-    from ttkbootstrap.constants import *
-except Exception:
-    tb = None
+# ------------------ تحميل المكتبات الثقيلة عند الحاجة فقط ------------------
+class _LazyModule:
+    """
+    Module proxy imported on first attribute access. Optional modules that fail to import
+    are falsy (same as the old `x = None` fallbacks), so `if pygame:` keeps working.
+    """
+    def __init__(self, name, required=False):
+        self._name = name
+        self._required = required
+        self._mod = None
+        self._failed = False
+        self._lock = threading.Lock()
 
-import tkinter as tk
-import tkinter.messagebox as messagebox
+    def _load(self):
+        if self._mod is None and not self._failed:
+            with self._lock:
+                if self._mod is None and not self._failed:
+                    try:
+                        self._mod = importlib.import_module(self._name)
+                    except Exception:
+                        self._failed = True
+                        if self._required:
+                            raise
+        return self._mod
 
-# optional better single-instance detection
-try:
-    import psutil
-except Exception:
-    psutil = None
+    def __getattr__(self, attr):
+        mod = self._load()
+        if mod is None:
+            raise AttributeError(f"{self._name} is not available")
+        return getattr(mod, attr)
+
+    def __bool__(self):
+        return self._load() is not None
+
+    @property
+    def loaded(self):
+        return self._mod is not None
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")   # no pygame banner
+
+requests = _LazyModule("requests", required=True)
+
+# GUI & audio
+pygame = _LazyModule("pygame")
+pystray = _LazyModule("pystray")
+Image = _LazyModule("PIL.Image")
+ImageDraw = _LazyModule("PIL.ImageDraw")
+tb = _LazyModule("ttkbootstrap")
+tk = _LazyModule("tkinter", required=True)
 
 # Windows registry helper
 try:
@@ -68,25 +109,116 @@ FILES_TO_UPDATE = {
 
 LOCAL_VERSION_FILE = "version.txt"
 
+# sha256/size لكل ملف — يُنشر بجانب version.txt (python adhan.py --build-manifest)
+REMOTE_MANIFEST_URL = "https://raw.githubusercontent.com/SameerHegazy/adhanapp/refs/heads/main/manifest.json"
+LOCAL_MANIFEST = "manifest.json"
+LOCAL_SYNC_STATE = "sync_state.json"   # ETag / Last-Modified / hashes المحلية
+UPDATE_STAGING_DIR = "update_staging"  # ملفات الإصدار الجديد تتحمل هنا وتتفحص قبل ما تستبدل الحالية
+
 # ------------------ ثوابت البرنامج ------------------
 ALADHAN_API = "http://api.aladhan.com/v1/timings"
-UPDATE_INTERVAL = 1800   # 30 دقيقة
-CHECK_INTERVAL = 5       # فحص كل 5 ثواني (التحقق من مواعيد)
+ALADHAN_CALENDAR_API = "http://api.aladhan.com/v1/calendar"   # /{year}/{month}: شهر كامل في طلب واحد
+BULK_WORKERS = 8         # طلبات متوازية في الجلب الجماعي
+BULK_RATE = 10           # أقصى عدد طلبات في الثانية لكل host
+UPDATE_CHECK_INTERVAL = 6 * 3600   # فحص وجود إصدار جديد كل ~6 ساعات
+ASSET_SYNC_INTERVAL = 6 * 3600     # مزامنة cities/theme/adhan.mp3 كل ~6 ساعات
+REFRESH_JITTER = 0.2               # ±20% عشان أجهزة الموقع ما تطلبش في نفس اللحظة
+REFRESH_RETRY_MIN = 60             # بعد فشل: إعادة المحاولة بعد دقيقة وتتضاعف
+REFRESH_RETRY_MAX = 3600
+REFRESH_MAX_SLEEP = 3600           # أقصى نوم لمخطط التحديثات (لملاحظة تغيير الساعة)
+REFRESH_DEBOUNCE = 2               # تجميع تغييرات الإعدادات المتتالية في تحديث واحد
+REFRESH_STATE = "refresh_state.json"   # آخر تشغيل لكل مهمة (يبقى بعد إعادة التشغيل)
+REFRESH_CONFIG_KEYS = ("city_country", "zones", "reminder_minutes", "audio_library", "audio_device",
+                       "prefetch_days", "api_cross_check")
+SCHEDULER_MAX_SLEEP = 60     # أقصى نوم للمجدول (لاكتشاف السكون/تغيير الساعة)
+SCHEDULER_GRACE = 5          # تأخير مقبول قبل اعتبار الموعد "فائت"
+CLOCK_JUMP_THRESHOLD = 5     # فرق ساعة الحائط عن الساعة الرتيبة (ثواني)
+CATCH_UP_POLICY = "latest"   # skip | latest | all
+CATCH_UP_WINDOW = 600        # تشغيل الأذان الفائت لو التأخير أقل من 10 دقائق
 ADHAN_DURATION = 10      # مدة الأذان بالثواني
+ADHAN_FADE_MS = 2000     # خفوت الصوت تدريجيًا في آخر ثانيتين
+AUDIO_PREPARE_LEAD = 30  # فتح جهاز الصوت قبل موعد الأذان بـ 30 ثانية
+AUDIO_IDLE_RELEASE = 120 # إغلاقه لو لم يُستخدم خلال دقيقتين
+REMINDER_DURATION = 10   # مدة التذكير قبل الصلاة بالثواني
+RESTART_QUIET_WINDOW = 600   # تأجيل إعادة التشغيل (بعد تحديث adhan.py) لو فيه صلاة خلال 10 دقائق
+RESTART_POLL = 30
 
 CONFIG_FILE = "config.json"           # ملف محلي لكل جهاز (لا ترفعه!)
+CONFIG_FLUSH_DELAY = 1.0      # حفظ الإعدادات بعد ثانية من آخر تغيير (بدل كل حركة للـ slider)
+CONFIG_FLUSH_MAX_DELAY = 5.0  # ولا يتأخر الحفظ أكثر من 5 ثواني مهما استمر التغيير
 DEFAULT_CONFIG = {
     "city_country": ["القاهرة", "Egypt"],  # [cityName, countryKeyFromCitiesJson]
     "volume": 80,
     "adhan_enabled": True,
-    "auto_start": True
+    "auto_start": True,
+    "api_cross_check": False,  # compare local calculation with Aladhan (needs network)
+    "prefetch_days": 30,       # عدد الأيام المحسوبة مسبقًا للمدينة الحالية
+    "missed_adhan_policy": "latest",  # skip | latest | all (بعد السكون أو تغيير الساعة)
+    "missed_adhan_window": 600,
+    "audio_streaming": True,   # False = فك ترميز الملف كاملًا في الذاكرة (السلوك القديم)
+    "audio_cache_mb": 64,      # حد الذاكرة للأصوات المفكوكة (لما audio_streaming = False)
+    "audio_library": {},       # {"Fajr": "fajr.mp3", "<city>/Maghrib": "...", "Fajr_reminder": "..."}
+    "reminder_minutes": 0,     # >0: تشغيل التذكير (لو له ملف في audio_library) قبل الصلاة بكام دقيقة
+    "audio_device": None,      # اسم جهاز الصوت (None = الافتراضي)
+    "zones": [],               # مواقع إضافية: [{"name", "city_country", "method", "offsets": {"Fajr": 2}, "volume", "device"}]
+    "cache_max_entries": 2000, # يرفعها adhan.py prefetch تلقائيًا لتتسع لما جهّزه مسبقًا
+    "gps_position": None,      # [lat, lon] — لو موجود نختار أقرب مدينة تلقائيًا
+    "metrics_port": 0,         # >0: مقاييس على http://127.0.0.1:<port>/metrics (Prometheus) و /metrics.json
+    "site_server_port": 0,     # >0: الجهاز ده يخدم المواقيت والملفات لباقي أجهزة الشبكة المحلية
+    "site_server_bind": None,  # عنوان الجهاز على الشبكة (مثلاً "192.168.1.10")؛ الافتراضي 127.0.0.1 فقط
+    "site_server": None        # "http://192.168.1.10:8765": المواقيت من خادم الموقع أولًا، والملفات نسخة منه
 }
 
 LOCAL_CITIES = "cities.json"
+LOCAL_CITY_INDEX = "cities.kdtree"   # فهرس مكاني مبني من cities.json (يُعاد بناؤه لو اتغير)
 LOCAL_THEME  = "theme.json"
 LOCAL_PRAYER_CACHE = "prayer_times_cache.json"
+STARTUP_REPORT = "startup_report.json"   # زمن كل مرحلة في بدء التشغيل (آخر 20 تشغيل)
+STARTUP_REPORT_KEEP = 20
+METRICS_SNAPSHOT = "metrics.json"       # نسخة JSON من المقاييس تتحدث كل دقيقة
+METRICS_SNAPSHOT_INTERVAL = 60
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)   # ثواني
+CACHE_MAX_ENTRIES = DEFAULT_CONFIG["cache_max_entries"]   # حد أقصى لعدد الأيام المخزنة (كل المدن)
+CACHE_MAX_AGE_DAYS = 2     # حذف الأيام الأقدم من كده
+PREFETCH_DAYS = DEFAULT_CONFIG["prefetch_days"]
+
+# HTTP: (connect, read) timeouts per host, retries with jittered backoff
+HTTP_TIMEOUTS = {
+    "api.aladhan.com": (4, 10),
+    "raw.githubusercontent.com": (4, 20),
+    "github.com": (4, 20),
+}
+HTTP_DEFAULT_TIMEOUT = (4, 15)
+HTTP_RETRIES = 2
+HTTP_BACKOFF = 0.5            # ثواني (تتضاعف مع كل محاولة)
+HTTP_MAX_RETRY_AFTER = 30
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+HTTP_POOL_HOSTS = 4
+HTTP_POOL_SIZE = 8
+CONNECTIVITY_TTL = 300        # نعتبر الجهاز offline لمدة 5 دقائق بعد فشل اتصال حقيقي
+BREAKER_FAILURES = 3          # فشل متتالي يفتح الـ circuit للـ host
+BREAKER_BACKOFF = 60          # ثواني قبل أول محاولة تجريبية (تتضاعف مع كل فشل)
+BREAKER_MAX_BACKOFF = 3600
+
+SEARCH_PAGE_SIZE = 8    # أقصى عدد نتائج يعرضها مربع البحث عن الدولة/المدينة
+UI_DRAIN_MS = 100       # كل قد إيه الواجهة تنفذ التحديثات القادمة من الـ threads
+UI_BATCH_MAX = 200      # أقصى عدد تحديثات في الدفعة الواحدة
+LOG_MAX_LINES = 500     # سجل الواجهة يحتفظ بآخر 500 سطر فقط
+
+SITE_SERVER = None             # يتضبط من config["site_server"] (وضع العميل)
+SITE_TIMEOUT = (1, 10)         # (connect, read) لخادم الموقع على الشبكة المحلية
+SITE_BIND = "127.0.0.1"         # الشبكة المحلية تحتاج عنوان صريح في config["site_server_bind"]
+SITE_NEVER_MIRROR = ("adhan.py",)   # الكود ورقم الإصدار والـ manifest من GitHub (HTTPS) فقط
+SITE_MAX_DAYS = 62             # أقصى أيام في طلب /v1/schedule واحد
+
+INSTANCE_NAME = "adhanapp"       # اسم ملف القفل/قناة IPC لكل مستخدم (نسخة واحدة فقط)
+INSTANCE_NOTIFY_TIMEOUT = 2.0    # انتظار النسخة الأولى لو لسه بتبدأ
+INSTANCE_MAX_MESSAGE = 1024
 
-SINGLETON_PORT = 65432  # منفذ محلي لمنع تشغيل أكثر من نسخة (fallback if psutil not present)
+DIAGNOSTICS_DIR = "diagnostics"  # تقارير التحليل عند الطلب (profile / memory / stacks)
+DIAG_TOP_N = 25                  # عدد السطور في كل جدول من التقرير
+DIAG_TRACE_FRAMES = 10           # عمق الـ traceback المحفوظ لكل allocation (tracemalloc)
+DIAG_SIGNALS = {"SIGUSR1": "profile", "SIGUSR2": "dump"}   # kill -USR1 <pid> (غير متاح على Windows)
 
 # ------------------ دوال مساعدة ------------------
 def resource_path(p):
@@ -98,257 +230,3632 @@ def resource_path(p):
     return os.path.join(base, p)
 
 def is_online(timeout=4):
+    """Connectivity as seen by the last real request (no extra probe traffic)."""
+    return HTTP.is_online()
+
+def safe_load_json(path):
     try:
-        requests.head("https://www.google.com", timeout=timeout)
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except:
+        return None
+
+def safe_write_json(path, obj):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+# ------------------ مقاييس الأداء (metrics) ------------------
+class Metrics:
+    """
+    In-process counters and histograms using the Prometheus data model, with no dependency.
+    Series are keyed by (name, sorted labels). Export with prometheus() for a scrape
+    endpoint, or snapshot() for JSON. Every method is thread-safe.
+    """
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.started = time.time()
+        self._counters = {}
+        self._hists = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = [[0] * len(self.buckets), 0.0, 0]
+            i = bisect_left(self.buckets, value)   # first bucket with le >= value
+            if i < len(self.buckets):
+                h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    def _copy(self):
+        with self._lock:
+            return dict(self._counters), {k: (list(v[0]), v[1], v[2]) for k, v in self._hists.items()}
+
+    def snapshot(self):
+        counters, hists = self._copy()
+        out = {"time": time.time(), "uptime": time.time() - self.started, "counters": [], "histograms": []}
+        for (name, labels), value in sorted(counters.items()):
+            out["counters"].append({"name": name, "labels": dict(labels), "value": value})
+        for (name, labels), (counts, total, n) in sorted(hists.items()):
+            cum, buckets = 0, {}
+            for le, c in zip(self.buckets, counts):
+                cum += c
+                buckets[str(le)] = cum
+            out["histograms"].append({"name": name, "labels": dict(labels), "buckets": buckets,
+                                      "sum": total, "count": n})
+        return out
+
+    def prometheus(self):
+        def fmt(labels, **extra):
+            items = list(labels) + list(extra.items())
+            if not items:
+                return ""
+            esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+        counters, hists = self._copy()
+        lines, typed = [], set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{fmt(labels)} {value}")
+        for (name, labels), (counts, total, n) in sorted(hists.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cum = 0
+            for le, c in zip(self.buckets, counts):
+                cum += c
+                lines.append(f"{name}_bucket{fmt(labels, le=le)} {cum}")
+            lines.append(f"{name}_bucket{fmt(labels, le='+Inf')} {n}")
+            lines.append(f"{name}_sum{fmt(labels)} {total}")
+            lines.append(f"{name}_count{fmt(labels)} {n}")
+        lines.append(f"adhan_uptime_seconds {time.time() - self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+
+def serve_metrics(port, host="127.0.0.1", registry=None):
+    """Serve /metrics (Prometheus text) and /metrics.json on a daemon thread; returns the server."""
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    registry = registry or METRICS
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == "/metrics":
+                body, ctype = registry.prometheus().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+            elif path == "/metrics.json":
+                body, ctype = json.dumps(registry.snapshot(), ensure_ascii=False).encode("utf-8"), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+# ------------------ طبقة HTTP مشتركة (keep-alive + retry) ------------------
+class CircuitOpenError(ConnectionError):
+    """Raised without touching the network while a host's circuit is open."""
+
+class CircuitBreaker:
+    """
+    Per-host breaker. After `failures` consecutive failed requests the circuit opens
+    and requests fail fast for a backoff window that doubles on every failed probe
+    (backoff .. max_backoff, jittered). When the window ends a single probe is let
+    through (half-open): success closes the circuit, failure re-opens it.
+    """
+    def __init__(self, failures=BREAKER_FAILURES, backoff=BREAKER_BACKOFF, max_backoff=BREAKER_MAX_BACKOFF):
+        self.threshold = failures
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.window = 0
+        self.open_until = 0.0
+        self.probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.failures < self.threshold:
+                return "closed"
+            return "open" if self.probing or time.monotonic() < self.open_until else "half-open"
+
+    def allow(self):
+        with self._lock:
+            if self.failures < self.threshold:
+                return True
+            if self.probing or time.monotonic() < self.open_until:
+                return False
+            self.probing = True
+            return True
+
+    def record(self, ok):
+        with self._lock:
+            self.probing = False
+            if ok:
+                self.failures = 0
+                self.window = 0
+                return
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.window = min(self.max_backoff, self.window * 2 if self.window else self.backoff)
+                self.open_until = time.monotonic() + self.window * random.uniform(0.9, 1.1)
+
+    def retry_in(self):
+        """Seconds until the next probe is allowed (0 while closed)."""
+        with self._lock:
+            if self.failures < self.threshold:
+                return 0.0
+            return max(0.0, self.open_until - time.monotonic())
+
+class HttpClient:
+    """
+    One pooled requests.Session shared by every thread (cookies disabled, so it carries
+    no per-request state). Connect errors and RETRY_STATUSES are retried with jittered
+    exponential backoff; timeouts come from HTTP_TIMEOUTS by host.
+    Every outcome updates the connectivity state that is_online() reports, and each
+    host has a CircuitBreaker so a failing endpoint is skipped instead of re-tried.
+    """
+    def __init__(self, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF, timeouts=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.timeouts = dict(HTTP_TIMEOUTS if timeouts is None else timeouts)
+        self._lock = threading.Lock()
+        self._session = None
+        self.online = None          # None = unknown (no request yet)
+        self.checked_at = 0.0
+        self._breakers = {}
+        self.on_recovery = []       # called (no args) on the first success after a connect failure
+
+    def breaker(self, url_or_host):
+        host = urlsplit(url_or_host).hostname if "://" in url_or_host else url_or_host
+        with self._lock:
+            b = self._breakers.get(host or "")
+            if b is None:
+                b = self._breakers[host or ""] = CircuitBreaker()
+            return b
+
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                s = requests.Session()
+                s.cookies.set_policy(importlib.import_module("http.cookiejar").DefaultCookiePolicy(allowed_domains=[]))
+                adapter = importlib.import_module("requests.adapters").HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE)
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                s.headers["User-Agent"] = f"adhanapp/{get_local_version()}"
+                self._session = s
+            return self._session
+
+    def timeout_for(self, url):
+        return self.timeouts.get(urlsplit(url).hostname or "", HTTP_DEFAULT_TIMEOUT)
+
+    def _record(self, ok):
+        with self._lock:
+            recovered = ok and self.online is False
+            self.online = ok
+            self.checked_at = time.monotonic()
+        if recovered:
+            for fn in list(self.on_recovery):
+                try:
+                    fn()
+                except Exception as e:
+                    print("on_recovery error:", e)
+
+    def _backoff(self, attempt, retry_after=None):
+        delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+        try:
+            delay = max(delay, min(float(retry_after), HTTP_MAX_RETRY_AFTER))
+        except (TypeError, ValueError):
+            pass
+        time.sleep(delay)
+
+    def request(self, method, url, retries=None, **kw):
+        kw.setdefault("timeout", self.timeout_for(url))
+        retries = self.retries if retries is None else retries
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            METRICS.inc("adhan_http_short_circuits_total", host=urlsplit(url).hostname or "")
+            raise CircuitOpenError(f"{urlsplit(url).hostname}: circuit open, next try in {breaker.retry_in():.0f}s")
+        session = self.session()
+        attempt = 0
+        ok = False
+        try:
+            while True:
+                try:
+                    r = session.request(method, url, **kw)
+                except requests.ConnectionError:
+                    self._record(False)
+                    if attempt >= retries:
+                        raise
+                    self._backoff(attempt)
+                    attempt += 1
+                    continue
+                self._record(True)
+                if r.status_code in RETRY_STATUSES and attempt < retries:
+                    retry_after = r.headers.get("Retry-After")
+                    r.close()
+                    self._backoff(attempt, retry_after)
+                    attempt += 1
+                    continue
+                ok = r.status_code not in RETRY_STATUSES
+                return r
+        finally:
+            # timeouts, connect errors and exhausted 429/5xx retries all count against the host
+            breaker.record(ok)
+
+    def get(self, url, **kw):
+        return self.request("GET", url, **kw)
+
+    def head(self, url, **kw):
+        return self.request("HEAD", url, **kw)
+
+    def is_online(self):
+        """False only while the last request failed to connect, for CONNECTIVITY_TTL seconds."""
+        with self._lock:
+            if self.online is False and time.monotonic() - self.checked_at < CONNECTIVITY_TTL:
+                return False
+            return True
+
+HTTP = HttpClient()
+
+# ------------------ فحص نسخة واحدة قيد التشغيل (قفل ملف + IPC) ------------------
+def _private_dir(base, name):
+    """`base`/`name` as a directory only this user can enter (0700, owned by us, not a symlink)."""
+    import stat
+    path = os.path.join(base, name)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError(f"{path}: not a directory owned by this user")
+    if st.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+def _instance_paths(name=INSTANCE_NAME):
+    """
+    Per-user lockfile and IPC address (Unix socket next to it, or a named pipe on Windows).
+    On Unix both live in a private directory ($XDG_RUNTIME_DIR/<name>, else ~/.cache/<name>),
+    never at a guessable name in a shared /tmp.
+    """
+    user = "".join(ch for ch in (os.environ.get("USERNAME") or os.environ.get("USER") or
+                                 str(getattr(os, "getuid", lambda: 0)())) if ch.isalnum()) or "user"
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        return os.path.join(base, f"{name}-{user}.lock"), rf"\\.\pipe\{name}-{user}", "AF_PIPE"
+    base = _private_dir(os.environ.get("XDG_RUNTIME_DIR") or os.path.join(os.path.expanduser("~"), ".cache"), name)
+    return os.path.join(base, f"{name}-{user}.lock"), os.path.join(base, f"{name}-{user}.sock"), "AF_UNIX"
+
+class InstanceLock:
+    """
+    Single instance per user in O(1): an OS lock on a per-user lockfile (released by the
+    OS if the process dies, so never stale) plus a local IPC listener through which a
+    second launch forwards a command ("show") to the running instance.
+    """
+    def __init__(self, name=INSTANCE_NAME):
+        self.lock_path, self.address, self.family = _instance_paths(name)
+        self._fd = None
+        self._listener = None
+
+    def acquire(self):
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0), 0o600)
+        if os.name != "nt" and os.fstat(fd).st_uid != os.getuid():
+            os.close(fd)
+            raise PermissionError(f"{self.lock_path}: owned by another user")
+        try:
+            if os.name == "nt":
+                import msvcrt
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
         return True
+
+    def serve(self, on_message):
+        """Accept commands from later launches on a daemon thread; on_message(str) runs there."""
+        from multiprocessing.connection import Listener
+        if self.family == "AF_UNIX" and os.path.exists(self.address):
+            os.remove(self.address)   # left by a crashed owner; we hold the lock now
+        self._listener = Listener(self.address, family=self.family)
+        if self.family == "AF_UNIX":
+            os.chmod(self.address, 0o600)
+
+        def loop():
+            while self._listener is not None:
+                try:
+                    with self._listener.accept() as conn:
+                        msg = conn.recv_bytes(INSTANCE_MAX_MESSAGE).decode("utf-8", "replace")
+                except Exception:
+                    if self._listener is None:
+                        break
+                    continue
+                try:
+                    on_message(msg)
+                except Exception as e:
+                    print("instance message error:", e)
+        threading.Thread(target=loop, name="instance-ipc", daemon=True).start()
+
+    def notify(self, message="show", timeout=INSTANCE_NOTIFY_TIMEOUT):
+        """Send `message` to the instance holding the lock; retries while it is still starting up."""
+        from multiprocessing.connection import Client
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with Client(self.address, family=self.family) as conn:
+                    conn.send_bytes(message.encode("utf-8"))
+                return True
+            except OSError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.1)
+
+    def release(self):
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            try:
+                listener.close()
+            except Exception:
+                pass
+        if self._fd is not None:
+            try:
+                os.close(self._fd)   # drops the lock
+            except OSError:
+                pass
+            self._fd = None
+
+def check_single_instance(message="show"):
+    """
+    Return a tuple (status, payload)
+    - No other instance -> ("lock", InstanceLock); keep it (and call serve()) until exit
+    - Another instance holds the lock -> ("exists", delivered): `message` was forwarded to it
+    """
+    lock = InstanceLock()
+    if lock.acquire():
+        return ("lock", lock)
+    return ("exists", lock.notify(message))
+
+# ------------------ إدارة config محلي ------------------
+def load_config():
+    cfg = DEFAULT_CONFIG.copy()
+    doc = safe_load_json(CONFIG_FILE)
+    if isinstance(doc, dict):
+        cfg.update(doc)
+    # ensure keys
+    if "city_country" not in cfg:
+        cfg["city_country"] = DEFAULT_CONFIG["city_country"]
+    if "volume" not in cfg:
+        cfg["volume"] = DEFAULT_CONFIG["volume"]
+    if "adhan_enabled" not in cfg:
+        cfg["adhan_enabled"] = DEFAULT_CONFIG["adhan_enabled"]
+    return cfg
+
+class ConfigStore(MutableMapping):
+    """
+    config.json as a thread-safe mapping with write-behind: a change applies in memory
+    at once and a background thread writes the file after CONFIG_FLUSH_DELAY seconds of
+    quiet (at most CONFIG_FLUSH_MAX_DELAY after the first unsaved change), so dragging
+    the volume slider costs one write instead of one per motion event. Call flush()
+    before exiting or restarting.
+    """
+    def __init__(self, path=CONFIG_FILE, data=None, delay=CONFIG_FLUSH_DELAY, max_delay=CONFIG_FLUSH_MAX_DELAY):
+        self.path = path
+        self.delay = delay
+        self.max_delay = max_delay
+        self.writes = 0
+        self._data = dict(load_config() if data is None else data)
+        self._cond = threading.Condition(threading.RLock())
+        self._io_lock = threading.Lock()
+        self._dirty_since = None
+        self._deadline = 0.0
+        self._thread = None
+        self.listeners = []   # fn(key), called after a value actually changed
+
+    def _changed(self, key):
+        for fn in list(self.listeners):
+            try:
+                fn(key)
+            except Exception as e:
+                print("config listener error:", e)
+
+    def __getitem__(self, key):
+        with self._cond:
+            return self._data[key]
+
+    def __setitem__(self, key, value):
+        with self._cond:
+            if key in self._data and self._data[key] == value:
+                return
+            self._data[key] = value
+            self._schedule()
+        self._changed(key)
+
+    def __delitem__(self, key):
+        with self._cond:
+            del self._data[key]
+            self._schedule()
+        self._changed(key)
+
+    def __iter__(self):
+        with self._cond:
+            return iter(list(self._data))
+
+    def __len__(self):
+        with self._cond:
+            return len(self._data)
+
+    def snapshot(self):
+        with self._cond:
+            return dict(self._data)
+
+    @property
+    def dirty(self):
+        return self._dirty_since is not None
+
+    def _schedule(self):
+        now = time.monotonic()
+        if self._dirty_since is None:
+            self._dirty_since = now
+        self._deadline = min(now + self.delay, self._dirty_since + self.max_delay)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="config-flush", daemon=True)
+            self._thread.start()
+        self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._dirty_since is None or time.monotonic() < self._deadline:
+                    self._cond.wait(None if self._dirty_since is None else self._deadline - time.monotonic())
+            self.flush()
+
+    def flush(self):
+        """Write pending changes now; returns True if the file was written."""
+        with self._io_lock:
+            with self._cond:
+                if self._dirty_since is None:
+                    return False
+                doc = dict(self._data)
+                self._dirty_since = None
+            try:
+                safe_write_json(self.path, doc)
+            except Exception as e:
+                print("config flush error:", e)
+                with self._cond:
+                    self._schedule()   # retry later
+                return False
+            self.writes += 1
+            return True
+
+# ------------------ التحديث التلقائي من GitHub ------------------
+def set_site_server(url):
+    """
+    Client mode: ask the LAN site server at `url` for timings first and use it as a mirror
+    for assets listed in the GitHub manifest (None turns it off). It is never trusted for
+    version.txt, the manifest or adhan.py.
+    """
+    global SITE_SERVER
+    SITE_SERVER = url.rstrip("/") if url else None
+    if SITE_SERVER:
+        HTTP.timeouts[urlsplit(SITE_SERVER).hostname or ""] = SITE_TIMEOUT
+
+def _with_site(name, url, expected=None):
+    """
+    URLs to try for a published file: the site server's copy first (client mode), then `url`.
+    The mirror is only used when `expected` (the GitHub manifest entry) will check what it sends.
+    """
+    mirror = SITE_SERVER and expected and name not in SITE_NEVER_MIRROR
+    return ([f"{SITE_SERVER}/v1/files/{name}"] if mirror else []) + [url]
+
+def get_remote_version():
+    try:
+        r = HTTP.get(REMOTE_VERSION_URL)
+        if r.status_code == 200:
+            return r.text.strip()
+    except:
+        pass
+    return None
+
+def get_local_version():
+    try:
+        with open(LOCAL_VERSION_FILE, "r", encoding="utf-8") as f:
+            return f.read().strip()
     except:
+        return "0"
+
+# ------------------ مزامنة الملفات (manifest + ETag + استكمال التحميل) ------------------
+_SYNC_LOCK = threading.Lock()
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _local_digest(path, info):
+    """sha256 of a local file, reusing the hash stored in `info` while size/mtime are unchanged."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if info.get("size") == st.st_size and info.get("mtime") == st.st_mtime and info.get("sha256"):
+        return info["sha256"]
+    digest = file_sha256(path)
+    info.update({"sha256": digest, "size": st.st_size, "mtime": st.st_mtime})
+    return digest
+
+def build_manifest(names=None, version=None, path=LOCAL_MANIFEST):
+    """Write manifest.json (sha256 + size per asset) — run before publishing a release."""
+    names = names or [n for n in FILES_TO_UPDATE if n != "adhan.py"]
+    files = {}
+    for name in names:
+        if os.path.exists(name):
+            files[name] = {"sha256": file_sha256(name), "size": os.path.getsize(name)}
+    doc = {"version": version or get_local_version(), "files": files}
+    safe_write_json(path, doc)
+    return doc
+
+def get_remote_manifest(state):
+    """Conditional GET of the remote manifest; the last copy is kept in `state`."""
+    cached = state.get("_manifest", {})
+    headers = {}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+    try:
+        r = HTTP.get(REMOTE_MANIFEST_URL, headers=headers)
+        if r.status_code == 304 and cached.get("doc"):
+            return cached["doc"]
+        r.raise_for_status()
+        doc = r.json()
+        if isinstance(doc, dict) and isinstance(doc.get("files"), dict):
+            state["_manifest"] = {"etag": r.headers.get("ETag"),
+                                  "last_modified": r.headers.get("Last-Modified"), "doc": doc}
+            return doc
+    except Exception as e:
+        print("get_remote_manifest error:", e)
+    return None
+
+def sync_file(name, url, state, expected=None, dest=None):
+    """
+    Bring one asset up to date. Returns "unchanged", "updated" or "failed".
+    expected: manifest entry {"sha256", "size"}; when the local hash matches nothing is requested.
+    Otherwise a conditional (ETag / If-Modified-Since) request is sent, and the download
+    goes to UPDATE_STAGING_DIR/<name>.part (resumed with an HTTP Range request if it was
+    interrupted). It replaces `dest` only after the manifest check and verify_update_file().
+    """
+    dest = dest or os.path.abspath(name)
+    info = state.setdefault(name, {})
+    local_hash = _local_digest(dest, info)
+    if expected and local_hash and local_hash == expected.get("sha256"):
+        return "unchanged"
+
+    os.makedirs(UPDATE_STAGING_DIR, exist_ok=True)
+    part = os.path.join(UPDATE_STAGING_DIR, name + ".part")
+    headers = {}
+    if local_hash and not expected:
+        if info.get("etag"):
+            headers["If-None-Match"] = info["etag"]
+        if info.get("last_modified"):
+            headers["If-Modified-Since"] = info["last_modified"]
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    if offset and info.get("part_etag"):
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = info["part_etag"]
+    else:
+        offset = 0
+    try:
+        r = HTTP.get(url, headers=headers, stream=True)
+        if r.status_code == 304:
+            r.close()
+            return "unchanged"
+        if r.status_code == 416 and offset:
+            r.close()
+            if not expected:
+                # nothing to check the leftover .part against: drop it and fetch the whole file
+                os.remove(part)
+                info.pop("part_etag", None)
+                return sync_file(name, url, state, expected, dest)
+            r = None   # .part already complete (or stale) — verified against the manifest below
+        else:
+            r.raise_for_status()
+        if r is not None:
+            mode = "ab" if (offset and r.status_code == 206) else "wb"
+            info["part_etag"] = r.headers.get("ETag") or r.headers.get("Last-Modified")
+            t0, size = time.perf_counter(), 0
+            try:
+                with open(part, mode) as fw:
+                    for chunk in r.iter_content(1 << 16):
+                        if chunk:
+                            fw.write(chunk)
+                            size += len(chunk)
+            finally:
+                METRICS.inc("adhan_download_bytes_total", size, file=name)
+                METRICS.observe("adhan_download_seconds", time.perf_counter() - t0, file=name,
+                                result="partial" if r.status_code == 206 else "full")
+            info["etag"] = r.headers.get("ETag")
+            info["last_modified"] = r.headers.get("Last-Modified")
+        if expected:
+            if (expected.get("size") is not None and os.path.getsize(part) != expected["size"]) \
+                    or file_sha256(part) != expected.get("sha256"):
+                os.remove(part)
+                info.pop("part_etag", None)
+                print(f"sync_file {name}: checksum mismatch, discarded")
+                return "failed"
+        if not verify_update_file(name, part):
+            os.remove(part)
+            info.pop("part_etag", None)
+            print(f"sync_file {name}: not a valid {os.path.splitext(name)[1]} file, discarded")
+            return "failed"
+        os.replace(part, dest)
+        info.pop("part_etag", None)
+        _local_digest(dest, info)
+        return "updated"
+    except Exception as e:
+        print(f"sync_file error {url} -> {e}")
+        return "failed"
+
+def sync_assets(names=None, include_code=False):
+    """Sync FILES_TO_UPDATE against the remote manifest; returns {name: result}."""
+    with _SYNC_LOCK:
+        state = safe_load_json(LOCAL_SYNC_STATE) or {}
+        manifest = get_remote_manifest(state)
+        files = (manifest or {}).get("files", {})
+        results = {}
+        for name, url in FILES_TO_UPDATE.items():
+            if names is not None and name not in names:
+                continue
+            if name == "adhan.py" and not include_code:
+                continue
+            for src in _with_site(name, url, files.get(name)):
+                results[name] = sync_file(name, src, state, expected=files.get(name))
+                if results[name] != "failed":
+                    break
+        try:
+            safe_write_json(LOCAL_SYNC_STATE, state)
+        except Exception as e:
+            print("sync_assets state write error:", e)
+        return results
+
+def verify_update_file(name, path):
+    """Sanity check of a staged file before it may replace the live copy."""
+    try:
+        if name.endswith(".json"):
+            with open(path, "r", encoding="utf-8") as f:
+                doc = json.load(f)
+            return isinstance(doc, dict) and bool(doc)
+        if name.endswith(".py"):
+            with open(path, "rb") as f:
+                compile(f.read(), name, "exec")
+            return True
+        with open(path, "rb") as f:
+            head = f.read(3)
+        if name.endswith(".mp3"):
+            return head == b"ID3" or (len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0)
+        return bool(head)
+    except Exception as e:
+        print(f"verify_update_file {name}: {e}")
         return False
 
-def safe_load_json(path):
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except:
-        return None
+def stage_update():
+    """
+    Download every FILES_TO_UPDATE entry that differs from the live copy into
+    UPDATE_STAGING_DIR (resumable, checked against the manifest) and verify it.
+    Returns {name: staged path}, or None if any file failed; live files are not touched.
+    """
+    with _SYNC_LOCK:
+        state = safe_load_json(LOCAL_SYNC_STATE) or {}
+        manifest = get_remote_manifest(state)
+        files = (manifest or {}).get("files", {})
+        staging = state.setdefault("_staging", {})
+        os.makedirs(UPDATE_STAGING_DIR, exist_ok=True)
+        staged, ok = {}, True
+        for name, url in FILES_TO_UPDATE.items():
+            expected = files.get(name)
+            live_hash = _local_digest(os.path.abspath(name), state.setdefault(name, {}))
+            if expected and live_hash == expected.get("sha256"):
+                continue
+            path = os.path.join(UPDATE_STAGING_DIR, name)
+            if all(sync_file(name, src, staging, expected=expected, dest=path) == "failed"
+                   for src in _with_site(name, url, expected)) or not verify_update_file(name, path):
+                ok = False
+                continue
+            if _local_digest(path, staging[name]) != live_hash:   # adhan.py has no manifest entry
+                staged[name] = path
+        try:
+            safe_write_json(LOCAL_SYNC_STATE, state)
+        except Exception as e:
+            print("stage_update state write error:", e)
+        return staged if ok else None
+
+def install_staged(staged, version=None):
+    """
+    Move staged files over the live ones (os.replace — each swap is atomic), then write
+    version.txt last, so an interrupted install is simply staged again on the next check.
+    Returns the installed names.
+    """
+    with _SYNC_LOCK:
+        state = safe_load_json(LOCAL_SYNC_STATE) or {}
+        staging = state.setdefault("_staging", {})
+        installed = []
+        for name, path in staged.items():
+            live = os.path.abspath(name)
+            os.replace(path, live)
+            info = staging.pop(name, {})
+            info.pop("part_etag", None)
+            state[name] = info
+            _local_digest(live, info)
+            installed.append(name)
+        if version:
+            tmp = LOCAL_VERSION_FILE + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(version)
+            os.replace(tmp, LOCAL_VERSION_FILE)
+        safe_write_json(LOCAL_SYNC_STATE, state)
+        return installed
+
+def perform_silent_update_if_needed(busy=None):
+    """
+    If remote version higher than local: stage and verify the changed files, then swap
+    them in. Returns the installed names — the caller applies data/asset changes in-process
+    and restarts only when adhan.py is among them. While busy() is true the swap waits
+    (staged files are kept, so the next check does not download them again).
+    Silent: does not show dialogs (user asked no visible 'updating' message).
+    """
+    try:
+        remote = get_remote_version()
+        local = get_local_version()
+        if not remote or remote == local:
+            METRICS.inc("adhan_update_checks_total", result="current" if remote else "unreachable")
+            return []
+        staged = stage_update()
+        if staged is None:
+            METRICS.inc("adhan_update_checks_total", result="failed")
+            return []
+        if busy and busy():
+            METRICS.inc("adhan_update_checks_total", result="deferred")
+            return []
+        METRICS.inc("adhan_update_checks_total", result="updating")
+        return install_staged(staged, remote)
+    except Exception as e:
+        print("perform_silent_update_if_needed error:", e)
+        METRICS.inc("adhan_update_checks_total", result="error")
+        return []
+
+def ensure_local_data_once():
+    """Bring cities/theme/adhan.mp3 up to date if online; returns {name: result}."""
+    if not is_online():
+        return {}
+    try:
+        return sync_assets()
+    except Exception as e:
+        print("ensure_local_data_once error:", e)
+        return {}
+
+# ------------------ حساب مواقيت الصلاة محليًا (فلكيًا) ------------------
+# Same algorithm family as Aladhan (PrayTimes.org). Method ids match the
+# Aladhan "method" parameter so the `method` field in cities.json keeps its meaning.
+# Angles are degrees below the horizon; "isha_min" means minutes after Maghrib.
+CALC_METHODS = {
+    0:  {"name": "Jafari",              "fajr": 16,   "isha": 14,   "maghrib": 4,   "midnight": "jafari"},
+    1:  {"name": "Karachi",             "fajr": 18,   "isha": 18},
+    2:  {"name": "ISNA",                "fajr": 15,   "isha": 15},
+    3:  {"name": "MWL",                 "fajr": 18,   "isha": 17},
+    4:  {"name": "Makkah",              "fajr": 18.5, "isha_min": 90, "isha_min_ramadan": 120},
+    5:  {"name": "Egypt",               "fajr": 19.5, "isha": 17.5},
+    7:  {"name": "Tehran",              "fajr": 17.7, "isha": 14,   "maghrib": 4.5, "midnight": "jafari"},
+    8:  {"name": "Gulf",                "fajr": 19.5, "isha_min": 90},
+    9:  {"name": "Kuwait",              "fajr": 18,   "isha": 17.5},
+    10: {"name": "Qatar",               "fajr": 18,   "isha_min": 90},
+    11: {"name": "Singapore",           "fajr": 20,   "isha": 18},
+    12: {"name": "France",              "fajr": 12,   "isha": 12},
+    13: {"name": "Turkey",              "fajr": 18,   "isha": 17},
+    14: {"name": "Russia",              "fajr": 16,   "isha": 15},
+    15: {"name": "Moonsighting",        "fajr": 18,   "isha": 18},
+    16: {"name": "Dubai",               "fajr": 18.2, "isha": 18.2},
+    17: {"name": "JAKIM",               "fajr": 20,   "isha": 18},
+    18: {"name": "Tunisia",             "fajr": 18,   "isha": 18},
+    19: {"name": "Algeria",             "fajr": 18,   "isha": 17},
+    20: {"name": "KEMENAG",             "fajr": 20,   "isha": 18},
+    21: {"name": "Morocco",             "fajr": 19,   "isha": 17},
+    22: {"name": "Portugal",            "fajr": 18,   "isha_min": 77},
+    23: {"name": "Jordan",              "fajr": 18,   "isha": 18},
+}
+DEFAULT_METHOD = 2
+
+# Aladhan latitudeAdjustmentMethod: 1 = middle of night, 2 = one seventh, 3 = angle based (default)
+HIGH_LAT_NONE, HIGH_LAT_MIDDLE, HIGH_LAT_SEVENTH, HIGH_LAT_ANGLE = 0, 1, 2, 3
+DEFAULT_HIGH_LAT = HIGH_LAT_ANGLE
+
+IMSAK_MINUTES = 10
+TIMING_KEYS = ["Fajr", "Sunrise", "Dhuhr", "Asr", "Sunset", "Maghrib", "Isha",
+               "Imsak", "Midnight", "Firstthird", "Lastthird"]
+
+def _dsin(d): return math.sin(math.radians(d))
+def _dcos(d): return math.cos(math.radians(d))
+def _dtan(d): return math.tan(math.radians(d))
+def _darcsin(x): return math.degrees(math.asin(x))
+def _darccos(x): return math.degrees(math.acos(x))
+def _darctan2(y, x): return math.degrees(math.atan2(y, x))
+def _darccot(x): return math.degrees(math.atan(1.0 / x))
+
+def _fix(a, b):
+    if math.isnan(a):
+        return a
+    a = a - b * math.floor(a / b)
+    return a + b if a < 0 else a
+
+def _julian_day(year, month, day):
+    if month <= 2:
+        year -= 1
+        month += 12
+    a = math.floor(year / 100)
+    b = 2 - a + math.floor(a / 4)
+    return math.floor(365.25 * (year + 4716)) + math.floor(30.6001 * (month + 1)) + day + b - 1524.5
+
+def _sun_position(jd):
+    """Return (declination, equation_of_time) for a julian day."""
+    d = jd - 2451545.0
+    g = _fix(357.529 + 0.98560028 * d, 360)
+    q = _fix(280.459 + 0.98564736 * d, 360)
+    L = _fix(q + 1.915 * _dsin(g) + 0.020 * _dsin(2 * g), 360)
+    e = 23.439 - 0.00000036 * d
+    ra = _darctan2(_dcos(e) * _dsin(L), _dcos(L)) / 15.0
+    eqt = q / 15.0 - _fix(ra, 24)
+    decl = _darcsin(_dsin(e) * _dsin(L))
+    return decl, eqt
+
+def _is_ramadan(d):
+    """Tabular (arithmetic) Hijri calendar check — good enough for Umm al-Qura Isha."""
+    jd = int(_julian_day(d.year, d.month, d.day) + 0.5)
+    l = jd - 1948440 + 10632
+    n = (l - 1) // 10631
+    l = l - 10631 * n + 354
+    j = ((10985 - l) // 5316) * ((50 * l) // 17719) + (l // 5670) * ((43 * l) // 15238)
+    l = l - ((30 - j) // 15) * ((17719 * j) // 50) - (j // 16) * ((15238 * j) // 43) + 29
+    month = (24 * l) // 709
+    return month == 9
+
+def _tz_offset_hours(tz, d):
+    """UTC offset (hours) of `tz` at local noon of date `d`; machine offset if tz unknown."""
+    noon = datetime(d.year, d.month, d.day, 12)
+    try:
+        if tz:
+            return ZoneInfo(tz).utcoffset(noon).total_seconds() / 3600.0
+    except Exception:
+        pass
+    return noon.astimezone().utcoffset().total_seconds() / 3600.0
+
+def compute_prayer_times(lat, lon, tz="", d=None, method=DEFAULT_METHOD, school=0,
+                         high_lat=DEFAULT_HIGH_LAT, elevation=0):
+    """
+    Compute the Aladhan-style `timings` dict ("HH:MM", local time of `tz`) offline.
+    school: 0 = Shafi/standard (shadow factor 1), 1 = Hanafi (factor 2).
+    """
+    d = d or datetime.now().date()
+    params = CALC_METHODS.get(int(method), CALC_METHODS[DEFAULT_METHOD])
+    asr_factor = 2 if int(school) == 1 else 1
+    tz_hours = _tz_offset_hours(tz, d)
+    jdate = _julian_day(d.year, d.month, d.day) - lon / (15.0 * 24.0)
+    rise_angle = 0.833 + 0.0347 * math.sqrt(max(0.0, elevation))
+
+    def mid_day(t):
+        _, eqt = _sun_position(jdate + t)
+        return _fix(12 - eqt, 24)
+
+    def sun_angle_time(angle, t, ccw=False):
+        decl, _ = _sun_position(jdate + t)
+        noon = mid_day(t)
+        x = (-_dsin(angle) - _dsin(decl) * _dsin(lat)) / (_dcos(decl) * _dcos(lat))
+        if x < -1 or x > 1:
+            return float("nan")  # sun never reaches this angle (high latitudes)
+        h = _darccos(x) / 15.0
+        return noon - h if ccw else noon + h
+
+    def asr_time(t):
+        decl, _ = _sun_position(jdate + t)
+        angle = -_darccot(asr_factor + _dtan(abs(lat - decl)))
+        return sun_angle_time(angle, t)
+
+    # one refinement pass starting from rough guesses, as in PrayTimes
+    guess = {"Fajr": 5, "Sunrise": 6, "Dhuhr": 12, "Asr": 13, "Sunset": 18, "Maghrib": 18, "Isha": 18}
+    p = {k: v / 24.0 for k, v in guess.items()}
+    t = {
+        "Fajr": sun_angle_time(params["fajr"], p["Fajr"], ccw=True),
+        "Sunrise": sun_angle_time(rise_angle, p["Sunrise"], ccw=True),
+        "Dhuhr": mid_day(p["Dhuhr"]),
+        "Asr": asr_time(p["Asr"]),
+        "Sunset": sun_angle_time(rise_angle, p["Sunset"]),
+        "Maghrib": sun_angle_time(params.get("maghrib", rise_angle), p["Maghrib"]),
+        "Isha": sun_angle_time(params["isha"], p["Isha"]) if "isha" in params else float("nan"),
+    }
+
+    for k in t:
+        t[k] += tz_hours - lon / 15.0
+
+    if "maghrib" not in params:
+        t["Maghrib"] = t["Sunset"]
+    if "isha_min" in params:
+        minutes = params["isha_min"]
+        if "isha_min_ramadan" in params and _is_ramadan(d):
+            minutes = params["isha_min_ramadan"]
+        t["Isha"] = t["Maghrib"] + minutes / 60.0
+
+    # high latitude safety: cap the night portion used for Fajr / Isha / Maghrib
+    if high_lat != HIGH_LAT_NONE:
+        night = _fix(t["Sunrise"] - t["Sunset"], 24)
+
+        def portion(angle):
+            if high_lat == HIGH_LAT_ANGLE:
+                return angle / 60.0 * night
+            if high_lat == HIGH_LAT_SEVENTH:
+                return night / 7.0
+            return night / 2.0
+
+        def adjust(value, base, angle, ccw):
+            limit = portion(angle)
+            if math.isnan(value):
+                return base - limit if ccw else base + limit
+            diff = _fix(base - value, 24) if ccw else _fix(value - base, 24)
+            if diff > limit:
+                return base - limit if ccw else base + limit
+            return value
+
+        t["Fajr"] = adjust(t["Fajr"], t["Sunrise"], params["fajr"], True)
+        if "isha" in params:
+            t["Isha"] = adjust(t["Isha"], t["Sunset"], params["isha"], False)
+        if "maghrib" in params:
+            t["Maghrib"] = adjust(t["Maghrib"], t["Sunset"], params["maghrib"], False)
+
+    t["Imsak"] = t["Fajr"] - IMSAK_MINUTES / 60.0
+    night_end = t["Fajr"] if params.get("midnight") == "jafari" else t["Sunrise"]
+    night = _fix(night_end - t["Sunset"], 24)
+    t["Midnight"] = t["Sunset"] + night / 2.0
+    t["Firstthird"] = t["Sunset"] + night / 3.0
+    t["Lastthird"] = t["Sunset"] + 2.0 * night / 3.0
+
+    return {k: _format_hours(t[k]) for k in TIMING_KEYS}
+
+def _format_hours(h):
+    if math.isnan(h):
+        return "--:--"
+    h = _fix(h + 0.5 / 60.0, 24)  # round to nearest minute
+    hours = int(h)
+    minutes = int((h - hours) * 60)
+    return f"{hours:02d}:{minutes:02d}"
+
+# ------------------ كاش المواقيت (عدة أيام وعدة مدن) ------------------
+class PrayerCache:
+    """
+    Timings store keyed by (city, country, method, date), persisted to LOCAL_PRAYER_CACHE.
+    Least-recently-used entries are evicted above `max_entries`, days older than
+    `max_age_days` are dropped, and changes are only written on flush() (atomically).
+    """
+    def __init__(self, path=LOCAL_PRAYER_CACHE, max_entries=CACHE_MAX_ENTRIES, max_age_days=CACHE_MAX_AGE_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @staticmethod
+    def key(city, country, method, d):
+        return f"{country}|{city}|{int(method)}|{d.isoformat()}"
+
+    def _load(self):
+        doc = safe_load_json(self.path)
+        if not isinstance(doc, dict):
+            return
+        if "entries" in doc:
+            for k, v in doc.get("entries", []):
+                self._entries[k] = v
+        elif "timings" in doc and "city" in doc:
+            # old single-entry format: keep it for the day it was fetched
+            try:
+                d = datetime.fromisoformat(doc["fetched_at"]).date()
+                k = self.key(doc["city"], doc["country"], DEFAULT_METHOD, d)
+                self._entries[k] = {"timings": doc["timings"], "fetched_at": doc["fetched_at"], "source": "api"}
+                self._dirty = True
+            except Exception:
+                pass
+        self.evict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, city, country, method, d):
+        k = self.key(city, country, method, d)
+        with self._lock:
+            item = self._entries.get(k)
+            if item is None:
+                self.misses += 1
+                METRICS.inc("adhan_cache_requests_total", result="miss")
+                return None
+            self._entries.move_to_end(k)
+            self.hits += 1
+            METRICS.inc("adhan_cache_requests_total", result="hit")
+            return item.get("timings")
+
+    def info(self, city, country, method, d):
+        """Metadata of a cached day (source, fetched_at, verified_at, api_diff...) or None; no LRU/metrics side effects."""
+        with self._lock:
+            item = self._entries.get(self.key(city, country, method, d))
+            return {k: v for k, v in item.items() if k != "timings"} if item else None
+
+    def annotate(self, city, country, method, d, **fields):
+        """Attach extra metadata to a cached day (e.g. the result of a background revalidation)."""
+        with self._lock:
+            item = self._entries.get(self.key(city, country, method, d))
+            if item is not None:
+                item.update(fields)
+                self._dirty = True
+            return item is not None
+
+    def put(self, city, country, method, d, timings, source="local"):
+        self.put_many([(city, country, method, d, timings)], source=source)
+
+    def put_many(self, items, source="local"):
+        """items: iterable of (city, country, method, date, timings)."""
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            for city, country, method, d, timings in items:
+                k = self.key(city, country, method, d)
+                self._entries[k] = {"timings": timings, "fetched_at": now, "source": source}
+                self._entries.move_to_end(k)
+            self._dirty = True
+            self.evict()
+
+    def clear(self):
+        with self._lock:
+            if self._entries:
+                self._entries.clear()
+                self._dirty = True
+
+    def evict(self):
+        """Drop days older than max_age_days, then least-recently-used entries over the cap."""
+        oldest = (datetime.now().date() - timedelta(days=self.max_age_days)).isoformat()
+        with self._lock:
+            stale = [k for k in self._entries if k.rsplit("|", 1)[-1] < oldest]
+            for k in stale:
+                del self._entries[k]
+            over = max(0, len(self._entries) - self.max_entries)
+            for _ in range(over):
+                self._entries.popitem(last=False)
+            if stale or over:
+                self._dirty = True
+
+    def prefetch(self, city, country, mapping, days=PREFETCH_DAYS, start=None):
+        """Fill the next `days` days for a city (local calculation); returns how many were added."""
+        entry = mapping.get(country, {}).get(city)
+        if not entry:
+            return 0
+        start = start or _city_date(entry.get("tz", ""))
+        method = _entry_method(entry)
+        items = []
+        with self._lock:
+            for i in range(days):
+                d = start + timedelta(days=i)
+                if self.key(city, country, method, d) in self._entries:
+                    continue
+                try:
+                    items.append((city, country, method, d, compute_prayer_times_for_entry(entry, d)))
+                except Exception as e:
+                    print("PrayerCache.prefetch error:", e)
+                    break
+            if items:
+                self.put_many(items)
+        return len(items)
+
+    def flush(self):
+        """Write all pending changes in one atomic replace."""
+        with self._lock:
+            if not self._dirty:
+                return False
+            doc = {"version": 2, "entries": [[k, v] for k, v in self._entries.items()]}
+            self._dirty = False
+        try:
+            safe_write_json(self.path, doc)
+            return True
+        except Exception as e:
+            print("PrayerCache.flush error:", e)
+            with self._lock:
+                self._dirty = True
+            return False
+
+# ------------------ قاعدة بيانات المدن المضغوطة (mmap) ------------------
+class CityDB(Mapping):
+    """
+    cities.json compiled to a columnar binary file and opened with mmap, so startup is
+    O(1) whatever the gazetteer size and lookups decode only what they touch.
+    Reads like the JSON ({country: {city: {lat, lon, tz, ...}}}, original order kept);
+    city lookups bisect a per-country sorted index over an interned UTF-8 string table.
+    File name: cities.<sha256[:12]>.v<VERSION>.cdb — a changed cities.json (or format) gets a
+    new file, so a mapped (and on Windows, locked) old file is never overwritten.
+    """
+    MAGIC = b"ADHNCDB1"
+    HEADER = struct.Struct("<8sI32sqqIII")   # magic, version, sha256, src size, src mtime_ns, countries, cities, strings
+    SECTIONS = [("str_offs", "I"), ("str_blob", "B"),
+                ("c_name", "I"), ("c_first", "I"), ("c_count", "I"),
+                ("lat", "d"), ("lon", "d"), ("name", "I"), ("tz", "I"),
+                ("method", "h"), ("school", "b"), ("high_lat", "b"), ("elevation", "f"),
+                ("aliases", "I"), ("sorted", "I")]
+    SECTION_TABLE = struct.Struct("<" + "QQ" * len(SECTIONS))
+    VERSION = 2
+    ALIAS_SEP = "\x1f"
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, sha, self.src_size, self.src_mtime_ns, self.n_countries, self.n_cities, self.n_strings = \
+            self.HEADER.unpack_from(self._mm, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            self._mm.close()
+            raise ValueError(f"{path}: not a city database")
+        self.source_sha256 = sha.hex()
+        table = self.SECTION_TABLE.unpack_from(self._mm, self.HEADER.size)
+        buf = memoryview(self._mm)
+        for i, (name, code) in enumerate(self.SECTIONS):
+            off, length = table[2 * i], table[2 * i + 1]
+            view = buf[off:off + length]
+            setattr(self, "_" + name, view if code == "B" else view.cast(code))
+        self._country_ids = None
+
+    @classmethod
+    def read_header(cls, path):
+        with open(path, "rb") as f:
+            raw = f.read(cls.HEADER.size)
+        magic, version, sha, size, mtime_ns, *_ = cls.HEADER.unpack(raw)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("bad header")
+        return {"sha256": sha.hex(), "size": size, "mtime_ns": mtime_ns}
+
+    # ---- build ----
+    @classmethod
+    def build(cls, mapping, path, sha256_hex, src_size=0, src_mtime_ns=0):
+        strings, blob, offs = {}, bytearray(), array("I", [0])
+
+        def intern(text):
+            if text not in strings:
+                strings[text] = len(offs) - 1
+                blob.extend(text.encode("utf-8"))
+                offs.append(len(blob))
+            return strings[text]
+
+        cols = {name: array(code) for name, code in cls.SECTIONS}
+        for country, cities in mapping.items():
+            first = len(cols["lat"])
+            names = []
+            for city, entry in cities.items():
+                try:
+                    lat, lon = float(entry["lat"]), float(entry["lon"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                cols["lat"].append(lat)
+                cols["lon"].append(lon)
+                cols["name"].append(intern(city))
+                cols["tz"].append(intern(entry.get("tz", "")))
+                cols["method"].append(int(entry.get("method", -1)))
+                cols["school"].append(int(entry.get("school", -1)))
+                cols["high_lat"].append(int(entry.get("latitude_adjustment", -1)))
+                cols["elevation"].append(float(entry.get("elevation", float("nan"))))
+                cols["aliases"].append(intern(cls.ALIAS_SEP.join(entry.get("aliases", ()))))
+                names.append(city)
+            cols["c_name"].append(intern(country))
+            cols["c_first"].append(first)
+            cols["c_count"].append(len(names))
+            cols["sorted"].extend(first + i for i in sorted(range(len(names)), key=names.__getitem__))
+        cols["str_offs"] = offs
+        cols["str_blob"] = array("B", bytes(blob))
+
+        pos = cls.HEADER.size + cls.SECTION_TABLE.size
+        table, chunks = [], []
+        for name, _ in cls.SECTIONS:
+            pos += -pos % 8   # keep every column 8-byte aligned
+            data = cols[name].tobytes()
+            table += [pos, len(data)]
+            chunks.append((pos, data))
+            pos += len(data)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, bytes.fromhex(sha256_hex), src_size, src_mtime_ns,
+                                    len(cols["c_name"]), len(cols["lat"]), len(offs) - 1))
+            f.write(cls.SECTION_TABLE.pack(*table))
+            for off, data in chunks:
+                f.write(b"\0" * (off - f.tell()))
+                f.write(data)
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def open_for(cls, source=None):
+        """Open the compiled DB for `source` (cities.json), building it if the JSON changed."""
+        source = source or LOCAL_CITIES
+        st = os.stat(source)
+        stem = os.path.splitext(source)[0]
+        candidates = glob.glob(glob.escape(stem) + ".*.cdb")
+        headers = {}
+        for c in candidates:
+            try:
+                headers[c] = cls.read_header(c)
+            except Exception:
+                continue
+            if headers[c]["size"] == st.st_size and headers[c]["mtime_ns"] == st.st_mtime_ns:
+                return cls(c)
+        digest = file_sha256(source)
+        for c, h in headers.items():
+            if h["sha256"] == digest:
+                return cls(c)
+        mapping = safe_load_json(source)
+        if not isinstance(mapping, dict):
+            return None
+        path = cls.build(mapping, f"{stem}.{digest[:12]}.v{cls.VERSION}.cdb", digest, st.st_size, st.st_mtime_ns)
+        for c in candidates:
+            if c != path:
+                try:
+                    os.remove(c)
+                except OSError:
+                    pass   # still mapped by another process
+        return cls(path)
+
+    # ---- read ----
+    def string(self, i):
+        return bytes(self._str_blob[self._str_offs[i]:self._str_offs[i + 1]]).decode("utf-8")
+
+    def entry(self, i):
+        e = {"lat": self._lat[i], "lon": self._lon[i], "tz": self.string(self._tz[i])}
+        if self._method[i] >= 0:
+            e["method"] = self._method[i]
+        if self._school[i] >= 0:
+            e["school"] = self._school[i]
+        if self._high_lat[i] >= 0:
+            e["latitude_adjustment"] = self._high_lat[i]
+        if not math.isnan(self._elevation[i]):
+            e["elevation"] = self._elevation[i]
+        aliases = self.string(self._aliases[i])
+        if aliases:
+            e["aliases"] = aliases.split(self.ALIAS_SEP)
+        return e
+
+    def _country_index(self, country):
+        if self._country_ids is None:
+            self._country_ids = {self.string(self._c_name[c]): c for c in range(self.n_countries)}
+        return self._country_ids.get(country)
+
+    def __getitem__(self, country):
+        c = self._country_index(country)
+        if c is None:
+            raise KeyError(country)
+        return _CityDBCountry(self, self._c_first[c], self._c_count[c])
+
+    def __iter__(self):
+        return (self.string(self._c_name[c]) for c in range(self.n_countries))
+
+    def __len__(self):
+        return self.n_countries
+
+    def close(self):
+        try:
+            self._mm.close()
+        except Exception:
+            pass
+
+class _CityDBCountry(Mapping):
+    """{city: entry} view of one country's slice of a CityDB."""
+    def __init__(self, db, first, count):
+        self._db, self._first, self._count = db, first, count
+
+    def _find(self, city):
+        db, lo, hi = self._db, self._first, self._first + self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            name = db.string(db._name[db._sorted[mid]])
+            if name < city:
+                lo = mid + 1
+            elif name > city:
+                hi = mid
+            else:
+                return db._sorted[mid]
+        return None
+
+    def __getitem__(self, city):
+        i = self._find(city) if isinstance(city, str) else None
+        if i is None:
+            raise KeyError(city)
+        return self._db.entry(i)
+
+    def __contains__(self, city):
+        return isinstance(city, str) and self._find(city) is not None
+
+    def __iter__(self):
+        db = self._db
+        return (db.string(db._name[i]) for i in range(self._first, self._first + self._count))
+
+    def items(self):
+        # in file order, without the per-name bisect that Mapping.items() would do
+        db = self._db
+        return ((db.string(db._name[i]), db.entry(i)) for i in range(self._first, self._first + self._count))
+
+    def __len__(self):
+        return self._count
+
+# ------------------ البحث في أسماء الدول والمدن (عربي + لاتيني) ------------------
+# أسماء الدول في cities.json إنجليزي؛ دي الأسماء العربية عشان البحث يلاقيها بالعربي كمان
+COUNTRY_ALIASES = {
+    "Egypt": ["مصر"],
+    "Saudi Arabia": ["السعودية", "المملكة العربية السعودية", "KSA"],
+}
+
+_AR_FOLD = str.maketrans({"ٱ": "ا", "ى": "ي", "ة": "ه", "ء": None, "ـ": None})
+_AR_TRANSLIT = str.maketrans({
+    "ا": "a", "ب": "b", "ت": "t", "ث": "th", "ج": "j", "ح": "h", "خ": "kh", "د": "d",
+    "ذ": "dh", "ر": "r", "ز": "z", "س": "s", "ش": "sh", "ص": "s", "ض": "d", "ط": "t",
+    "ظ": "z", "ع": None, "غ": "gh", "ف": "f", "ق": "q", "ك": "k", "ل": "l", "م": "m",
+    "ن": "n", "ه": "h", "و": "w", "ي": "y",
+})
+_SKELETON = str.maketrans({"c": "k", "q": "k", "a": None, "e": None, "i": None, "o": None,
+                           "u": None, "y": None, "'": None})
+
+def normalize_name(text):
+    """
+    Fold a place name for matching: NFKD drops tashkeel and splits the hamza off
+    أ/إ/آ/ؤ/ئ, then ٱ→ا, ى→ي, ة→ه, tatweel removed; Latin is accent-stripped and casefolded.
+    """
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).translate(_AR_FOLD).casefold()
+    return " ".join("".join(ch if ch.isalnum() else " " for ch in text).split())
+
+def _has_arabic(text):
+    return any("؀" <= ch <= "ۿ" for ch in text)
+
+def _strip_article(word):
+    for article in ("ال", "al", "el"):
+        if word.startswith(article) and len(word) > len(article) + 1:
+            return word[len(article):]
+    return word
+
+def _skeleton(word):
+    """Consonant skeleton of a Latin word ("qahira" → "khr"), repeated letters collapsed."""
+    out = []
+    for ch in _strip_article(word).translate(_SKELETON):
+        if not out or out[-1] != ch:
+            out.append(ch)
+    return "".join(out)
+
+def _name_keys(name, aliases=()):
+    """(key, tier) pairs to index a name under; lower tier ranks first."""
+    for text in (name, *aliases):
+        n = normalize_name(text)
+        yield n, 0
+        for word in n.split():
+            yield word, 1
+            yield _strip_article(word), 1
+            if _has_arabic(word):
+                word = word.translate(_AR_TRANSLIT)
+                yield _strip_article(word), 2
+            yield _skeleton(word), 3
+
+class NameSearchIndex:
+    """
+    Search-as-you-type over place names: every name is expanded into normalized keys
+    (full name, each word, word without the article, Latin transliteration and its
+    consonant skeleton) kept in one sorted list, so a query is a few bisects plus a
+    short scan — no pass over the whole gazetteer per keystroke.
+    """
+    def __init__(self, items):
+        # items: iterable of name or (name, aliases)
+        self.names = []
+        keys = []
+        for item in items:
+            name, aliases = (item, ()) if isinstance(item, str) else item
+            i = len(self.names)
+            self.names.append(name)
+            keys.extend((key, tier, i) for key, tier in set(_name_keys(name, aliases)) if key)
+        keys.sort()
+        self._keys = [k for k, _, _ in keys]
+        self._hits = [(tier, i) for _, tier, i in keys]
+
+    @classmethod
+    def for_cities(cls, cities):
+        return cls((name, entry.get("aliases", ())) for name, entry in cities.items())
+
+    @classmethod
+    def for_countries(cls, mapping):
+        return cls((country, COUNTRY_ALIASES.get(country, ())) for country in mapping)
+
+    def search(self, query, limit=SEARCH_PAGE_SIZE):
+        """Best `limit` names for `query`; an empty query gives the first page in file order."""
+        q = normalize_name(query or "")
+        if not q:
+            return self.names[:limit]
+        probes = [(q, 0), (_strip_article(q), 0)]
+        skeleton = "" if _has_arabic(q) else _skeleton(q.replace(" ", ""))
+        if len(skeleton) > 1:   # one consonant matches half the gazetteer
+            probes.append((skeleton, 2))
+        best = {}
+        for probe, penalty in probes:
+            pos, scanned = bisect_left(self._keys, probe), 0
+            while pos < len(self._keys) and scanned < limit * 16 and self._keys[pos].startswith(probe):
+                tier, i = self._hits[pos]
+                score = (tier + penalty, len(self._keys[pos]) - len(probe), i)
+                if i not in best or score < best[i]:
+                    best[i] = score
+                pos += 1
+                scanned += 1
+        return [self.names[i] for i in sorted(best, key=best.__getitem__)[:limit]]
+
+# ------------------ جلب مواقيت الصلاة باستخدام mapping ------------------
+def load_cities_mapping():
+    """
+    cities.json as a read-only mapping. Served from the compiled mmap CityDB (rebuilt
+    automatically when the JSON changes); plain JSON parsing is the fallback.
+    """
+    if os.path.exists(LOCAL_CITIES):
+        try:
+            db = CityDB.open_for(LOCAL_CITIES)
+            if db is not None:
+                return db
+        except Exception as e:
+            print("CityDB error:", e)
+    doc = safe_load_json(LOCAL_CITIES)
+    if not isinstance(doc, dict):
+        return {}
+    return doc
+
+def _city_date(tz):
+    """Today's date in the city's timezone (falls back to the machine clock)."""
+    try:
+        if tz:
+            return datetime.now(ZoneInfo(tz)).date()
+    except Exception:
+        pass
+    return datetime.now().date()
+
+def fetch_prayer_times_from_api(entry, d=None):
+    """Ask Aladhan for one day's timings. Only used as an optional cross-check."""
+    tz = entry.get("tz", "")
+    d = d or _city_date(tz)
+    params = {
+        "latitude": entry.get("lat"),
+        "longitude": entry.get("lon"),
+        "method": entry.get("method", DEFAULT_METHOD),
+        "school": entry.get("school", 0),
+        "timezonestring": tz,
+        "date": d.strftime("%d-%m-%Y")
+    }
+    try:
+        r = HTTP.get(ALADHAN_API, params=params)
+        r.raise_for_status()
+        data = r.json()
+        if data.get("code") == 200 and "data" in data:
+            return data["data"]["timings"]
+    except Exception as e:
+        print("fetch_prayer_times_from_api error:", e)
+    return None
+
+def _timings_diff_minutes(a, b, keys=("Fajr", "Dhuhr", "Asr", "Maghrib", "Isha")):
+    """Largest absolute difference in minutes between two timings dicts."""
+    worst = 0
+    for k in keys:
+        try:
+            ha, ma = map(int, a[k].split(" ")[0].split(":"))
+            hb, mb = map(int, b[k].split(" ")[0].split(":"))
+        except Exception:
+            continue
+        diff = abs((ha * 60 + ma) - (hb * 60 + mb))
+        worst = max(worst, min(diff, 1440 - diff))
+    return worst
+
+def _entry_method(entry):
+    return int(entry.get("method", DEFAULT_METHOD))
+
+def compute_prayer_times_for_entry(entry, d):
+    """Local calculation for one cities.json entry ({lat, lon, tz, method?, school?})."""
+    return compute_prayer_times(
+        entry.get("lat"), entry.get("lon"), entry.get("tz", ""), d,
+        method=_entry_method(entry),
+        school=entry.get("school", 0),
+        high_lat=entry.get("latitude_adjustment", DEFAULT_HIGH_LAT),
+        elevation=entry.get("elevation", 0),
+    )
+
+def fetch_prayer_times_for(city_name, country_key, mapping, d=None, cross_check=False, cache=None, use_site=True):
+    """
+    Timings for a mapped city, computed locally (no network).
+    With a PrayerCache, a cached day is returned as-is and new results are stored.
+    With cross_check=True the Aladhan API is also queried and any disagreement printed.
+    In client mode (SITE_SERVER) a cache miss asks the site server first, unless use_site=False
+    (the app passes False: it never waits on the site server, see AdhanCore.sync_from_site).
+    """
+    t0 = time.perf_counter()
+    timings, outcome = _fetch_prayer_times_for(city_name, country_key, mapping, d, cross_check, cache, use_site)
+    METRICS.observe("adhan_fetch_seconds", time.perf_counter() - t0, outcome=outcome)
+    return timings
+
+def _fetch_prayer_times_for(city_name, country_key, mapping, d, cross_check, cache, use_site):
+    """fetch_prayer_times_for() body; returns (timings, outcome) for the metrics."""
+    entry = mapping.get(country_key, {}).get(city_name)
+    if not entry:
+        return None, "unknown_city"
+    d = d or _city_date(entry.get("tz", ""))
+    method = _entry_method(entry)
+    if cache is not None and not cross_check:
+        cached = cache.get(city_name, country_key, method, d)
+        if cached:
+            return cached, "cache"
+    if SITE_SERVER and use_site and not cross_check:
+        remote = fetch_prayer_times_from_site(city_name, country_key, d, method)
+        if remote:
+            if cache is not None:
+                cache.put(city_name, country_key, method, d, remote, source="site")
+            return remote, "site"
+    source = "local"
+    try:
+        timings = compute_prayer_times_for_entry(entry, d)
+    except Exception as e:
+        print("fetch_prayer_times_for error:", e)
+        timings = None
+    if cross_check:
+        remote = fetch_prayer_times_from_api(entry, d)
+        if remote and timings:
+            diff = _timings_diff_minutes(timings, remote)
+            if diff > 1:
+                print(f"cross-check {city_name}: local vs API differ by {diff} min")
+        elif remote:
+            timings, source = remote, "api"
+    if not timings:
+        stale = cache.get(city_name, country_key, method, d) if cache is not None else None
+        return stale, ("cache_fallback" if stale else "failed")
+    if cache is not None:
+        cache.put(city_name, country_key, method, d, timings, source=source)
+    return timings, source
+
+def fetch_prayer_times_from_site(city, country, d, method):
+    """One day's timings from the LAN site server (client mode); None if unset, unreachable or unknown there."""
+    if not SITE_SERVER:
+        return None
+    try:
+        r = HTTP.get(f"{SITE_SERVER}/v1/timings", retries=0, params={
+            "city": city, "country": country, "date": d.isoformat(), "method": int(method)})
+        if r.status_code == 200:
+            timings = r.json().get("timings")
+            if isinstance(timings, dict) and timings:
+                return timings
+    except Exception as e:
+        print("fetch_prayer_times_from_site error:", e)
+    return None
+
+def prefetch_from_site(cache, city, country, mapping, days=PREFETCH_DAYS):
+    """Client mode: fill the next `days` not already from the site server (missing or computed
+    locally) from its /v1/schedule, in one request; returns the number of days stored."""
+    entry = mapping.get(country, {}).get(city)
+    if not SITE_SERVER or not entry:
+        return 0
+    start = _city_date(entry.get("tz", ""))
+    method = _entry_method(entry)
+    missing = [start + timedelta(days=i) for i in range(days)
+               if (cache.info(city, country, method, start + timedelta(days=i)) or {}).get("source") != "site"]
+    if not missing:
+        return 0
+    try:
+        r = HTTP.get(f"{SITE_SERVER}/v1/schedule", retries=0, params={
+            "city": city, "country": country, "start": missing[0].isoformat(),
+            "days": (missing[-1] - missing[0]).days + 1, "method": method})
+        if r.status_code != 200:
+            return 0
+        wanted = set(missing)
+        items = [(city, country, method, date.fromisoformat(day["date"]), day["timings"])
+                 for day in r.json().get("days", []) if date.fromisoformat(day["date"]) in wanted]
+    except Exception as e:
+        print("prefetch_from_site error:", e)
+        return 0
+    if items:
+        cache.put_many(items, source="site")
+    return len(items)
+
+class Revalidator:
+    """
+    Stale-while-revalidate: callers serve what they already have and submit() the
+    network refresh here. One daemon worker runs the jobs in order; a key that is
+    already queued or running is not queued again, so repeated clicks cost one request.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._keys = set()
+        self._thread = None
+
+    def submit(self, key, fn):
+        with self._cond:
+            if key in self._keys:
+                return False
+            self._keys.add(key)
+            self._queue.append((key, fn))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="revalidate", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+            return True
+
+    def pending(self, key):
+        with self._cond:
+            return key in self._keys
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                key, fn = self._queue.popleft()
+            profile_checkpoint()
+            try:
+                fn()
+            except Exception as e:
+                print("revalidate error:", e)
+            finally:
+                with self._cond:
+                    self._keys.discard(key)
+
+# ------------------ فهرس مكاني لأقرب مدينة (KD-tree) ------------------
+EARTH_RADIUS_KM = 6371.0088
+
+def _unit_vector(lat, lon):
+    la, lo = math.radians(lat), math.radians(lon)
+    return math.cos(la) * math.cos(lo), math.cos(la) * math.sin(lo), math.sin(la)
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+class CityIndex:
+    """
+    Nearest-place lookup over a cities mapping ({country: {city: {lat, lon, tz}}}).
+    Points are unit vectors on the sphere stored as an implicit (array-ordered) KD-tree:
+    the median of every sub-range is its node, split axis = depth % 3. Chord distance is
+    monotonic in great-circle distance, so results are exact haversine nearest neighbours.
+    Persisted to LOCAL_CITY_INDEX and rebuilt when the source file hash changes.
+    """
+    MAGIC = b"ADHNKDT1"
+
+    def __init__(self, names, xs, ys, zs, source_hash=""):
+        self.names = names          # [(country, city, lat, lon, tz)] in tree order
+        self.xs, self.ys, self.zs = xs, ys, zs
+        self.source_hash = source_hash
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def build(cls, mapping, source_hash=""):
+        pts = []
+        for country, cities in (mapping or {}).items():
+            for city, entry in cities.items():
+                try:
+                    lat, lon = float(entry["lat"]), float(entry["lon"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                pts.append((_unit_vector(lat, lon), (country, city, lat, lon, entry.get("tz", ""))))
+        order = [None] * len(pts)
+
+        # place the median of each sub-range at its middle slot
+        stack = [(0, len(pts), 0, pts)]
+        while stack:
+            lo, hi, depth, sub = stack.pop()
+            if not sub:
+                continue
+            sub.sort(key=lambda p: p[0][depth % 3])
+            mid = len(sub) // 2
+            order[lo + mid] = sub[mid]
+            stack.append((lo, lo + mid, depth + 1, sub[:mid]))
+            stack.append((lo + mid + 1, hi, depth + 1, sub[mid + 1:]))
+        xs = array("d", (p[0][0] for p in order))
+        ys = array("d", (p[0][1] for p in order))
+        zs = array("d", (p[0][2] for p in order))
+        return cls([p[1] for p in order], xs, ys, zs, source_hash)
+
+    def nearest(self, lat, lon, k=1):
+        """[(distance_km, country, city, {"lat", "lon", "tz"})] for the k closest places."""
+        n = len(self.names)
+        if n == 0 or k <= 0:
+            return []
+        q = _unit_vector(lat, lon)
+        coords = (self.xs, self.ys, self.zs)
+        best = []  # max-heap of (-chord2, index)
+        stack = [(0, n, 0)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            dx = q[0] - self.xs[mid]
+            dy = q[1] - self.ys[mid]
+            dz = q[2] - self.zs[mid]
+            d2 = dx * dx + dy * dy + dz * dz
+            if len(best) < k:
+                heapq.heappush(best, (-d2, mid))
+            elif d2 < -best[0][0]:
+                heapq.heapreplace(best, (-d2, mid))
+            diff = q[depth % 3] - coords[depth % 3][mid]
+            near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+            # far side only if the splitting plane is closer than the current k-th best
+            if len(best) < k or diff * diff < -best[0][0]:
+                stack.append((far[0], far[1], depth + 1))
+            stack.append((near[0], near[1], depth + 1))
+        out = []
+        for neg_d2, i in sorted(best, reverse=True):
+            chord = math.sqrt(-neg_d2)
+            country, city, plat, plon, tz = self.names[i]
+            out.append((2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2)), country, city,
+                        {"lat": plat, "lon": plon, "tz": tz}))
+        return out
+
+    def save(self, path=None):
+        path = path or LOCAL_CITY_INDEX
+        header = json.dumps({"n": len(self.names), "source_hash": self.source_hash,
+                             "names": self.names}, ensure_ascii=False).encode("utf-8")
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack("<I", len(header)))
+            f.write(header)
+            for arr in (self.xs, self.ys, self.zs):
+                arr.tofile(f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or LOCAL_CITY_INDEX
+        with open(path, "rb") as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError("not a city index")
+            (size,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(size).decode("utf-8"))
+            arrays = []
+            for _ in range(3):
+                arr = array("d")
+                arr.fromfile(f, header["n"])
+                arrays.append(arr)
+        names = [tuple(x) for x in header["names"]]
+        return cls(names, *arrays, source_hash=header.get("source_hash", ""))
+
+    @classmethod
+    def load_or_build(cls, source=None, path=None, mapping=None):
+        """Persisted index for `source` (cities.json), rebuilt if the file's sha256 changed."""
+        source = source or LOCAL_CITIES
+        path = path or LOCAL_CITY_INDEX
+        try:
+            digest = file_sha256(source)
+        except OSError:
+            return cls.build(mapping or {})
+        try:
+            idx = cls.load(path)
+            if idx.source_hash == digest:
+                return idx
+        except Exception:
+            pass
+        if mapping is None:
+            mapping = safe_load_json(source) or {}
+        idx = cls.build(mapping, source_hash=digest)
+        try:
+            idx.save(path)
+        except Exception as e:
+            print("CityIndex.save error:", e)
+        return idx
+
+_CITY_INDEX = None
+_CITY_INDEX_LOCK = threading.Lock()
+
+def nearest(lat, lon, k=1, mapping=None):
+    """
+    k nearest places to (lat, lon) from cities.json: [(km, country, city, {lat, lon, tz})].
+    The index is loaded (or built and persisted) once per process.
+    """
+    global _CITY_INDEX
+    with _CITY_INDEX_LOCK:
+        if _CITY_INDEX is None:
+            _CITY_INDEX = CityIndex.load_or_build(mapping=mapping)
+        idx = _CITY_INDEX
+    return idx.nearest(lat, lon, k)
+
+def reset_city_index():
+    """Forget the in-process index (call after cities.json changes)."""
+    global _CITY_INDEX
+    with _CITY_INDEX_LOCK:
+        _CITY_INDEX = None
+
+# ------------------ جلب جماعي لتقويم شهري (كل المدن) ------------------
+class RateLimiter:
+    """Token bucket per host: at most `rate` requests/second, bursts of `burst`. rate <= 0 = unlimited."""
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, self.rate))
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def acquire(self, host):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                tokens, last = self._buckets.get(host, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+                if tokens >= 1:
+                    self._buckets[host] = (tokens - 1, now)
+                    return
+                self._buckets[host] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
+
+def fetch_month_calendar(entry, year, month, api=ALADHAN_CALENDAR_API, limiter=None):
+    """One Aladhan calendar request -> {date: timings} for a whole month (raises on failure)."""
+    url = f"{api.rstrip('/')}/{year}/{month}"
+    params = {
+        "latitude": entry.get("lat"),
+        "longitude": entry.get("lon"),
+        "method": _entry_method(entry),
+        "school": entry.get("school", 0),
+        "timezonestring": entry.get("tz", ""),
+    }
+    if limiter:
+        limiter.acquire(urlsplit(url).hostname)
+    r = HTTP.get(url, params=params)
+    r.raise_for_status()
+    data = r.json()
+    if data.get("code") != 200 or not isinstance(data.get("data"), list):
+        raise ValueError(f"unexpected calendar response: {data.get('code')}")
+    out = {}
+    for day in data["data"]:
+        d = datetime.strptime(day["date"]["gregorian"]["date"], "%d-%m-%Y").date()
+        # "05:12 (EET)" -> "05:12", same shape as compute_prayer_times()
+        out[d] = {k: v.split(" ")[0] for k, v in day["timings"].items()}
+    return out
+
+def _month_days(year, month):
+    d = datetime(year, month, 1).date()
+    while d.month == month:
+        yield d
+        d += timedelta(days=1)
+
+def bulk_prefetch(mapping, months, cache, countries=None, workers=BULK_WORKERS, rate=BULK_RATE,
+                  api=ALADHAN_CALENDAR_API, local=False, progress=print):
+    """
+    Stage whole months for every city in `mapping` (optionally only `countries`).
+    months: [(year, month)]. Online mode issues one calendar request per city-month on a
+    bounded thread pool with per-host rate limiting; local=True computes them instead.
+    Everything is written to `cache` in a single put_many + flush, raising cache.max_entries
+    when it would not fit (the caller persists the new cap). Returns a report dict.
+    """
+    jobs = [(city, country, entry, y, m)
+            for country, cities in mapping.items() if not countries or country in countries
+            for city, entry in cities.items()
+            for (y, m) in months]
+    t0 = time.perf_counter()
+    items, failed = [], []
+    done = 0
+    last_report = t0
+
+    def _report(force=False):
+        nonlocal last_report
+        now = time.perf_counter()
+        if progress and (force or now - last_report >= 1.0):
+            last_report = now
+            elapsed = max(now - t0, 1e-9)
+            progress(f"[{done}/{len(jobs)}] {done / elapsed:.1f} req/s, {len(items)} days, {len(failed)} failed")
+
+    def _collect(job, days):
+        city, country, entry, _, _ = job
+        method = _entry_method(entry)
+        items.extend((city, country, method, d, t) for d, t in days.items())
+
+    if local:
+        for job in jobs:
+            city, country, entry, y, m = job
+            _collect(job, {d: compute_prayer_times_for_entry(entry, d) for d in _month_days(y, m)})
+            done += 1
+            _report()
+    else:
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        limiter = RateLimiter(rate)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = {pool.submit(fetch_month_calendar, job[2], job[3], job[4], api, limiter): job for job in jobs}
+            for fut in as_completed(futures):
+                job = futures[fut]
+                try:
+                    _collect(job, fut.result())
+                except Exception as e:
+                    failed.append({"city": job[0], "country": job[1], "month": f"{job[3]}-{job[4]:02d}", "error": str(e)})
+                done += 1
+                _report()
+
+    if len(cache) + len(items) > cache.max_entries:
+        if progress:
+            progress(f"cache capacity raised to {len(cache) + len(items)}")
+        cache.max_entries = len(cache) + len(items)
+    cache.put_many(items, source="local" if local else "api")
+    cache.flush()
+    _report(force=True)
+    seconds = time.perf_counter() - t0
+    return {
+        "cities": len({(j[0], j[1]) for j in jobs}),
+        "months": [f"{y}-{m:02d}" for y, m in months],
+        "requests": 0 if local else len(jobs),
+        "ok": len(jobs) - len(failed),
+        "failed": failed,
+        "entries": len(items),
+        "seconds": round(seconds, 3),
+        "jobs_per_s": round(len(jobs) / seconds, 1) if seconds else None,
+        "entries_per_s": round(len(items) / seconds, 1) if seconds else None,
+    }
+
+# ------------------ مشغّل الأذان ------------------
+_MP3_BITRATES = {  # kbps by bitrate index, Layer III
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),   # MPEG-1
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),       # MPEG-2 / 2.5
+}
+
+def _audio_seconds(path):
+    """Rough duration of an audio file from its size (first MP3 frame bitrate, or WAV PCM); None if unknown."""
+    try:
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            head = f.read(10)
+            if head[:4] == b"RIFF":
+                f.seek(22)
+                channels, rate = struct.unpack("<HI", f.read(6))
+                f.seek(34)
+                bits = struct.unpack("<H", f.read(2))[0]
+                return size / (rate * channels * bits / 8.0)
+            skip = 0
+            if head[:3] == b"ID3":
+                skip = 10 + ((head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9])
+            f.seek(skip)
+            buf = f.read(4096)
+        for i in range(len(buf) - 3):
+            if buf[i] == 0xFF and buf[i + 1] & 0xE0 == 0xE0 and (buf[i + 1] >> 1) & 3 == 1:
+                kbps = _MP3_BITRATES[1 if (buf[i + 1] >> 3) & 3 == 3 else 2][buf[i + 2] >> 4 & 0xF] \
+                    if buf[i + 2] >> 4 != 0xF else 0
+                if kbps:
+                    return (size - skip) * 8.0 / (kbps * 1000)
+    except Exception:
+        pass
+    return None
+
+class AudioLibrary:
+    """
+    Recordings by prayer and site (config "audio_library": {key: path}) and an LRU of
+    decoded pygame Sounds limited to `budget` bytes. resolve(prayer, site, kind) tries
+    "<site>/<name>", "<site>/<generic>", "<name>", "<generic>" where name is the prayer
+    ("Fajr") or "<prayer>_<kind>" ("Fajr_reminder") and generic is "default" or the kind;
+    adhans end at `default`. A file whose decoded size would exceed the budget is never
+    decoded — sound() returns None and the player streams it instead.
+    """
+    def __init__(self, entries=None, default="adhan.mp3", budget=64 << 20):
+        self.entries = entries or {}
+        self.default = default
+        self.budget = budget
+        self._lock = threading.RLock()
+        self._sounds = OrderedDict()   # (path, mtime) -> (Sound, bytes)
+        self.used = 0
+
+    @staticmethod
+    def _path(p):
+        return p if os.path.exists(p) else resource_path(p)
+
+    def resolve(self, prayer=None, site=None, kind="adhan"):
+        """File for a prayer (or reminder) at a site; None when nothing is configured for it."""
+        name = prayer if kind == "adhan" else f"{prayer}_{kind}"
+        generic = "default" if kind == "adhan" else kind
+        keys = [f"{site}/{name}", f"{site}/{generic}"] if site else []
+        for key in keys + [name, generic]:
+            p = self.entries.get(key) if key else None
+            if p and os.path.exists(self._path(p)):
+                return self._path(p)
+        return self._path(self.default) if kind == "adhan" else None
+
+    def decoded_size(self, path):
+        """Estimated bytes of a decoded Sound at the mixer's output format."""
+        freq, fmt, channels = (pygame.mixer.get_init() if pygame.loaded else None) or (44100, -16, 2)
+        seconds = _audio_seconds(path)
+        if seconds is None:
+            seconds = os.path.getsize(path) / 16000.0   # ~128 kbps
+        return int(seconds * freq * channels * (abs(fmt) // 8))
+
+    def sound(self, path):
+        """Decoded Sound for `path` (the mixer must be open), or None if it should be streamed."""
+        try:
+            key = (path, os.stat(path).st_mtime_ns)
+        except OSError:
+            return None
+        with self._lock:
+            hit = self._sounds.get(key)
+            if hit:
+                self._sounds.move_to_end(key)
+                METRICS.inc("adhan_sound_cache_total", result="hit")
+                return hit[0]
+            size = self.decoded_size(path)
+            if size > self.budget:
+                METRICS.inc("adhan_sound_cache_total", result="stream")
+                return None
+            for old in [k for k in self._sounds if k[0] == path]:   # file replaced on disk
+                self.used -= self._sounds.pop(old)[1]
+            while self._sounds and self.used + size > self.budget:
+                self.used -= self._sounds.popitem(last=False)[1][1]
+            snd = pygame.mixer.Sound(path)
+            freq, fmt, channels = pygame.mixer.get_init()
+            size = int(snd.get_length() * freq * channels * (abs(fmt) // 8))
+            self._sounds[key] = (snd, size)
+            self.used += size
+            METRICS.inc("adhan_sound_cache_total", result="miss")
+            return snd
+
+    def clear(self):
+        """Forget every decoded Sound (they die with the mixer)."""
+        with self._lock:
+            self._sounds.clear()
+            self.used = 0
+
+class AdhanPlayer:
+    """
+    Plays the adhan for `duration` seconds with a fade-out at the cutoff.
+    streaming=True (default): the MP3 is decoded in chunks by pygame.mixer.music and the
+    audio device is only open around playback — prepare() opens it ahead of a scheduled
+    prayer, and it is released after play() or after AUDIO_IDLE_RELEASE unused seconds.
+    streaming=False keeps the device open and plays decoded Sounds from the AudioLibrary
+    cache (budgeted; files too big for it are streamed anyway). play(path=...) picks
+    another recording than the default `mp3_path`.
+    device: output device name (None = system default). pygame has one mixer per
+    process, so every player shares the playback and device locks below: outputs take
+    turns, and the mixer is re-opened when the next player uses another device.
+    """
+    _play_lock = threading.Lock()    # one playback at a time (whole process)
+    _mixer_lock = threading.RLock()  # audio device open/close
+    _device = None                   # device the mixer is currently open on
+
+    def __init__(self, mp3_path="adhan.mp3", volume=0.8, streaming=True, fade_ms=ADHAN_FADE_MS, library=None, device=None):
+        self.mp3 = mp3_path if os.path.exists(mp3_path) else resource_path(mp3_path)
+        self.volume = volume
+        self.streaming = streaming
+        self.fade_ms = fade_ms
+        self.library = library or AudioLibrary(default=self.mp3)
+        self.device = device or None
+        self._lock = self._play_lock
+        self._dev_lock = self._mixer_lock
+        self._stops = set()                  # one Event per pending/active play()
+        self._release_timer = None
+        self.sound = None                    # Sound being played, None while streaming
+        self.playing = False
+
+    def _open(self, switch=True):
+        """Open the audio device; with switch=False a mixer busy on another device is left alone."""
+        with self._dev_lock:
+            if not pygame:
+                return False
+            if pygame.mixer.get_init() and AdhanPlayer._device != self.device:
+                if not switch and self._lock.locked():
+                    return False   # another output is playing; play() switches once it gets the lock
+                pygame.mixer.quit()
+                self.library.clear()
+            if not pygame.mixer.get_init():
+                if self.device:
+                    pygame.mixer.init(devicename=self.device)
+                else:
+                    pygame.mixer.init()
+                AdhanPlayer._device = self.device
+            return True
+
+    def _sound_for(self, path):
+        return None if self.streaming else self.library.sound(path)
+
+    def _cancel_release_timer(self):
+        if self._release_timer:
+            self._release_timer.cancel()
+            self._release_timer = None
+
+    def release(self):
+        """Close the audio device unless something (on any player) is playing."""
+        with self._dev_lock:
+            self._cancel_release_timer()
+            if self.playing or self._lock.locked():
+                return
+            self.sound = None
+            self.library.clear()
+            try:
+                if pygame.loaded and pygame.mixer.get_init():
+                    pygame.mixer.quit()
+            except Exception as e:
+                print("AdhanPlayer.release error:", e)
+
+    def prepare(self, release_after=AUDIO_IDLE_RELEASE, path=None):
+        """Open the device shortly before a prayer (and decode `path` ahead); closed again if play() never comes."""
+        try:
+            if not self._open(switch=False):
+                return False
+            with self._dev_lock:
+                self._sound_for(path or self.mp3)
+        except Exception as e:
+            print("AdhanPlayer.prepare error:", e)
+            return False
+        with self._dev_lock:
+            self._cancel_release_timer()
+            if self.streaming and release_after:
+                self._release_timer = threading.Timer(release_after, self.release)
+                self._release_timer.daemon = True
+                self._release_timer.start()
+        return True
+
+    def set_source(self, mp3_path):
+        """Use another default file from the next play() (a replaced file is re-decoded on use)."""
+        with self._dev_lock:
+            self.mp3 = mp3_path if os.path.exists(mp3_path) else resource_path(mp3_path)
+            self.library.default = self.mp3
+
+    def set_volume(self, v):
+        self.volume = max(0.0, min(1.0, v))
+        try:
+            # never import/open pygame just for a slider move
+            if self.playing and pygame.loaded and pygame.mixer.get_init():
+                if self.sound:
+                    self.sound.set_volume(self.volume)
+                else:
+                    pygame.mixer.music.set_volume(self.volume)
+        except:
+            pass
+
+    def play(self, duration=ADHAN_DURATION, scheduled=None, path=None, volume=None):
+        """
+        Play `path` (default mp3_path) for `duration` s at `volume` (default self.volume);
+        `scheduled` (epoch) records how late playback actually started.
+        """
+        path = path or self.mp3
+        vol = self.volume if volume is None else max(0.0, min(1.0, volume))
+        # per playback, so a stop() before the worker gets the lock is not lost
+        stop = threading.Event()
+        with self._dev_lock:
+            self._stops.add(stop)
+
+        def _worker():
+            with self._lock:
+                try:
+                    if stop.is_set() or not self._open():
+                        return
+                    with self._dev_lock:
+                        self._cancel_release_timer()
+                        self.playing = True
+                        self.sound = self._sound_for(path)
+                    fade = min(self.fade_ms, int(duration * 1000))
+                    if self.sound is None:
+                        pygame.mixer.music.load(path)
+                        pygame.mixer.music.set_volume(vol)
+                        pygame.mixer.music.play(-1)
+                    else:
+                        self.sound.set_volume(vol)
+                        self.sound.play(-1)
+                    if scheduled is not None:
+                        METRICS.observe("adhan_play_delay_seconds", max(0.0, time.time() - scheduled))
+                    if not stop.wait(max(0.0, duration - fade / 1000.0)):
+                        if self.sound is None:
+                            pygame.mixer.music.fadeout(fade)
+                        else:
+                            self.sound.fadeout(fade)
+                        stop.wait(fade / 1000.0)
+                    self._halt()
+                except Exception as e:
+                    print("AdhanPlayer.play error:", e)
+                finally:
+                    with self._dev_lock:
+                        self._stops.discard(stop)
+                    self.playing = False
+                    self.sound = None
+            if self.streaming:
+                self.release()
+        t = threading.Thread(target=_worker, daemon=True)
+        t.start()
+
+    def _halt(self):
+        with self._dev_lock:
+            try:
+                if pygame.loaded and pygame.mixer.get_init():
+                    pygame.mixer.music.stop()
+                    pygame.mixer.stop()
+            except:
+                pass
+
+    def stop(self):
+        # doesn't wait for the playback lock: the worker sees the event and finishes at once
+        with self._dev_lock:
+            for stop in self._stops:
+                stop.set()
+        self._halt()
+
+    def close(self, timeout=2.0):
+        """stop(), wait for the worker to let go of the device, then release it (before exit:
+        a daemon worker frozen mid-playback makes pygame's atexit Mix_CloseAudio hang)."""
+        self.stop()
+        if self._lock.acquire(timeout=timeout):
+            self._lock.release()
+        self.release()
+
+class AudioPool:
+    """
+    One AdhanPlayer per output device, created on first use, all sharing one
+    AudioLibrary (and so one decoded-sound budget) and the process-wide playback lock.
+    """
+    def __init__(self, library, volume=0.8, streaming=True):
+        self.library = library
+        self.volume = volume
+        self.streaming = streaming
+        self._lock = threading.Lock()
+        self._players = {}
+
+    def get(self, device=None):
+        with self._lock:
+            player = self._players.get(device or None)
+            if player is None:
+                player = self._players[device or None] = AdhanPlayer(
+                    self.library.default, volume=self.volume, streaming=self.streaming,
+                    library=self.library, device=device)
+            return player
+
+    @property
+    def playing(self):
+        with self._lock:
+            return any(p.playing for p in self._players.values())
+
+    def set_source(self, mp3_path):
+        with self._lock:
+            players = list(self._players.values())
+        for p in players:
+            p.set_source(mp3_path)
+
+    def close(self, timeout=2.0):
+        with self._lock:
+            players = list(self._players.values())
+        for p in players:
+            p.close(timeout)
+
+# ------------------ جدولة الأذان (بالأحداث بدل الفحص كل ثانية) ------------------
+PRAYER_NAMES = ["Fajr", "Dhuhr", "Asr", "Maghrib", "Isha"]
+
+def _tzinfo(tz):
+    """ZoneInfo for a tz name, or the machine's local timezone."""
+    try:
+        if tz:
+            return ZoneInfo(tz)
+    except Exception:
+        pass
+    return datetime.now().astimezone().tzinfo
+
+def _parse_hhmm(value):
+    """'05:12' or '05:12 (EET)' -> (5, 12); None if not a time."""
+    try:
+        h, m = value.split(" ")[0].strip().split(":")
+        return int(h), int(m)
+    except Exception:
+        return None
+
+def compile_timings(timings, tz, d, names=PRAYER_NAMES):
+    """Turn a timings dict for date `d` into sorted [(aware datetime, name)]."""
+    tzinfo = _tzinfo(tz)
+    out = []
+    for name in names:
+        hm = _parse_hhmm(timings.get(name, "")) if timings else None
+        if hm is None:
+            continue
+        out.append((datetime(d.year, d.month, d.day, hm[0], hm[1], tzinfo=tzinfo), name))
+    out.sort()
+    return out
+
+class PrayerScheduler:
+    """
+    Fires actions at absolute times. Events live in a heap of UTC timestamps and the
+    worker sleeps on a condition variable until the next one (or until events change).
+    Wakeups are capped at SCHEDULER_MAX_SLEEP so suspend/resume and wall-clock jumps
+    are noticed; on_clock_jump(drift_seconds) is called when one is detected.
+
+    Events found late by more than `grace` seconds follow `catch_up`:
+      "skip"   — never play a missed event
+      "latest" — play only the most recent missed event, if missed by < `window` seconds
+      "all"    — play every missed event within `window`
+    Skipped events are passed to on_missed(name, when, late, group).
+    """
+    def __init__(self, catch_up=CATCH_UP_POLICY, window=CATCH_UP_WINDOW, grace=SCHEDULER_GRACE,
+                 on_clock_jump=None, on_missed=None):
+        self.catch_up = catch_up
+        self.window = window
+        self.grace = grace
+        self.on_clock_jump = on_clock_jump
+        self.on_missed = on_missed
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = 0
+        self._running = False
+        self._thread = None
+        self.wakeups = 0
+
+    def set_group(self, group, events):
+        """Replace every event of `group` with events [(aware datetime, name, action)]."""
+        with self._cond:
+            self._heap = [e for e in self._heap if e[2] != group]
+            for when, name, action in events:
+                self._seq += 1
+                self._heap.append((when.timestamp(), self._seq, group, name, when, action))
+            heapq.heapify(self._heap)
+            self._cond.notify()
+
+    def clear(self):
+        with self._cond:
+            self._heap = []
+            self._cond.notify()
+
+    def next_event(self, housekeeping=False):
+        """(when, name) of the next pending event (prayers only unless housekeeping=True), or None."""
+        with self._cond:
+            pending = [e for e in self._heap if housekeeping or not e[3].startswith("_")]
+            if not pending:
+                return None
+            e = min(pending)
+            return e[4], e[3]
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def _collect_due(self, now):
+        """Pop everything due by `now`; return (to_fire, missed) lists."""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap))
+        # housekeeping events ("_rollover" ...) always run, however late
+        late = [e for e in due if now - e[0] > self.grace and not e[3].startswith("_")]
+        fire = [e for e in due if e not in late]
+        if late:
+            in_window = [e for e in late if now - e[0] <= self.window]
+            if self.catch_up == "all":
+                fire = in_window + fire
+            elif self.catch_up == "latest" and in_window and not any(not e[3].startswith("_") for e in fire):
+                # only an on-time prayer supersedes the replay, not housekeeping due alongside it
+                fire = sorted([in_window[-1]] + fire)
+        missed = [e for e in late if e not in fire]
+        return fire, missed
+
+    def _run(self):
+        last_wall, last_mono = time.time(), time.monotonic()
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                now = time.time()
+                delay = self._heap[0][0] - now if self._heap else SCHEDULER_MAX_SLEEP
+                if delay > 0:
+                    self._cond.wait(min(delay, SCHEDULER_MAX_SLEEP))
+                    if not self._running:
+                        return
+                self.wakeups += 1
+                METRICS.inc("adhan_loop_wakeups_total", loop="scheduler")
+                wall, mono = time.time(), time.monotonic()
+                drift = (wall - last_wall) - (mono - last_mono)
+                last_wall, last_mono = wall, mono
+                fire, missed = self._collect_due(wall)
+            profile_checkpoint()
+            if abs(drift) > CLOCK_JUMP_THRESHOLD and self.on_clock_jump:
+                try:
+                    self.on_clock_jump(drift)
+                except Exception as e:
+                    print("PrayerScheduler.on_clock_jump error:", e)
+            for e in missed:
+                if self.on_missed:
+                    try:
+                        self.on_missed(e[3], e[4], wall - e[0], e[2])
+                    except Exception as ex:
+                        print("PrayerScheduler.on_missed error:", ex)
+            for e in fire:
+                try:
+                    e[5](e[3], e[4], max(0.0, wall - e[0]))
+                except Exception as ex:
+                    print("PrayerScheduler action error:", ex)
+
+# ------------------ خادم الموقع (جهاز واحد يجلب للشبكة المحلية كلها) ------------------
+def serve_site(port, mapping, cache, host=SITE_BIND):
+    """
+    LAN schedule server on a daemon thread; returns the server. Installations with
+    config "site_server" pointing here take timings and schedules from this node instead
+    of Aladhan, and use it as a mirror for assets they check against the GitHub manifest.
+    Listens on `host` (127.0.0.1 unless config "site_server_bind" names a LAN address).
+    Every 200 carries an ETag and a matching If-None-Match gets 304.
+      GET /v1/files/<name>                   one of FILES_TO_UPDATE except SITE_NEVER_MIRROR
+      GET /v1/timings?city=&country=[&date=YYYY-MM-DD&method=]
+      GET /v1/schedule?city=&country=[&start=YYYY-MM-DD&days=7&method=]
+    `mapping` is a callable returning the current cities mapping; `cache` is the shared PrayerCache.
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import parse_qs
+    served = set(FILES_TO_UPDATE) - set(SITE_NEVER_MIRROR)
+    root = os.path.abspath(".")   # the app directory at start, whatever the cwd is later
+    digests = {}            # name -> _local_digest info (hash reused while size/mtime hold)
+    digest_lock = threading.Lock()
+
+    def digest(name):
+        with digest_lock:
+            return _local_digest(os.path.join(root, name), digests.setdefault(name, {}))
+
+    def schedule(q, single):
+        """Timings document for /v1/timings or /v1/schedule; None for an unknown city."""
+        city, country = q.get("city"), q.get("country")
+        entry = mapping().get(country, {}).get(city)
+        if entry is None:
+            return None
+        if q.get("method") not in (None, ""):
+            entry = dict(entry, method=int(q["method"]))
+        first = q.get("date" if single else "start")
+        first = date.fromisoformat(first) if first else _city_date(entry.get("tz", ""))
+        days = 1 if single else max(1, min(SITE_MAX_DAYS, int(q.get("days", 7))))
+        out = []
+        for i in range(days):
+            d = first + timedelta(days=i)
+            # never use_site here: a node that is both server and client would ask itself
+            timings = fetch_prayer_times_for(city, country, {country: {city: entry}}, d=d, cache=cache, use_site=False)
+            out.append({"date": d.isoformat(), "timings": timings})
+        meta = {"city": city, "country": country, "method": _entry_method(entry)}
+        return dict(meta, **out[0]) if single else dict(meta, days=out)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            q = {k: v[0] for k, v in parse_qs(parts.query).items()}
+            try:
+                if parts.path.startswith("/v1/files/"):
+                    name = parts.path[len("/v1/files/"):]
+                    if name not in served or digest(name) is None:
+                        return self.send_error(404)
+                    return self._send_file(name, f'"{digest(name)}"')
+                if parts.path in ("/v1/timings", "/v1/schedule"):
+                    doc = schedule(q, parts.path == "/v1/timings")
+                    if doc is None:
+                        return self.send_error(404, "unknown city")
+                    body, ctype = self._json(doc)
+                else:
+                    return self.send_error(404)
+            except (ValueError, TypeError) as e:
+                return self.send_error(400, str(e))
+            METRICS.inc("adhan_site_requests_total", endpoint=parts.path.rsplit("/", 1)[-1])
+            self._send(body, ctype, '"%s"' % hashlib.sha1(body).hexdigest())
+
+        @staticmethod
+        def _json(doc):
+            return json.dumps(doc, ensure_ascii=False, sort_keys=True).encode("utf-8"), "application/json"
+
+        def _not_modified(self, etag):
+            if etag in [t.strip() for t in (self.headers.get("If-None-Match") or "").split(",")]:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return True
+            return False
+
+        def _send(self, body, ctype, etag):
+            if self._not_modified(etag):
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_file(self, name, etag):
+            METRICS.inc("adhan_site_requests_total", endpoint="files")
+            if self._not_modified(etag):
+                return
+            with open(os.path.join(root, name), "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(size))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                for chunk in iter(lambda: f.read(1 << 16), b""):
+                    self.wfile.write(chunk)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="site-http", daemon=True).start()
+    return server
+
+# ------------------ المناطق (عدة مواقع في نفس البرنامج) ------------------
+MAIN_ZONE = "main"   # المنطقة الأساسية = city_country في الإعدادات
+
+def apply_offsets(timings, offsets):
+    """Copy of a timings dict with per-prayer minute offsets ({"Fajr": 2, "Isha": -5}) applied."""
+    if not timings or not offsets:
+        return timings
+    out = dict(timings)
+    for name, minutes in offsets.items():
+        hm = _parse_hhmm(out.get(name, ""))
+        if hm is None or not minutes:
+            continue
+        total = (hm[0] * 60 + hm[1] + int(minutes)) % 1440
+        out[name] = f"{total // 60:02d}:{total % 60:02d}"
+    return out
+
+class Zone:
+    """
+    One scheduled location. The main zone follows the top-level config (city_country,
+    audio_device); extra ones come from cfg["zones"], each with an optional calculation
+    method, per-prayer offsets in minutes, volume (0-100) and output device.
+    `triggered` holds the "YYYY-MM-DD|Prayer" keys already played for this zone.
+    """
+    def __init__(self, name, city, country, method=None, offsets=None, volume=None, device=None):
+        self.name = name
+        self.city = city
+        self.country = country
+        self.method = None if method is None else int(method)
+        self.offsets = {k: int(v) for k, v in (offsets or {}).items()}
+        self.volume = None if volume is None else float(volume)
+        self.device = device or None
+        self.triggered = set()
+
+    @classmethod
+    def from_config(cls, doc):
+        city, country = doc["city_country"]
+        return cls(doc.get("name") or city, city, country, method=doc.get("method"),
+                   offsets=doc.get("offsets"), volume=doc.get("volume"), device=doc.get("device"))
+
+    @property
+    def group(self):
+        """Scheduler group holding this zone's events."""
+        return "prayers" if self.name == MAIN_ZONE else f"zone:{self.name}"
+
+    def entry(self, mapping):
+        """The city's cities.json entry, with this zone's method override."""
+        entry = mapping.get(self.country, {}).get(self.city)
+        if entry is not None and self.method is not None:
+            entry = dict(entry, method=self.method)
+        return entry
+
+    def timings_for(self, mapping, d=None, cache=None):
+        """Timings for day `d` (shared PrayerCache; the method is part of its key), offsets applied."""
+        entry = self.entry(mapping)
+        if entry is None:
+            return None
+        timings = fetch_prayer_times_for(self.city, self.country, {self.country: {self.city: entry}},
+                                         d=d, cache=cache, use_site=False)
+        return apply_offsets(timings, self.offsets)
+
+# ------------------ قياس زمن بدء التشغيل ------------------
+class StartupTimer:
+    """Per-phase startup timings (ms since process start), saved to STARTUP_REPORT."""
+    def __init__(self, start=None):
+        self.start = _PROCESS_START if start is None else start
+        self._last = self.start
+        self._lock = threading.Lock()
+        self.phases = []
+        self.saved = False
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        with self._lock:
+            self.phases.append({"phase": phase,
+                                "at_ms": round((now - self.start) * 1000, 1),
+                                "took_ms": round((now - self._last) * 1000, 1)})
+            self._last = now
+
+    def elapsed_ms(self, phase):
+        for p in self.phases:
+            if p["phase"] == phase:
+                return p["at_ms"]
+        return None
+
+    def report(self):
+        with self._lock:
+            return {"started": datetime.now().isoformat(timespec="seconds"),
+                    "version": get_local_version(),
+                    "phases": list(self.phases)}
+
+    def save(self, path=STARTUP_REPORT):
+        """Append this run to the report file (keeps the last STARTUP_REPORT_KEEP runs)."""
+        if self.saved:
+            return
+        self.saved = True
+        doc = safe_load_json(path)
+        runs = doc.get("runs", []) if isinstance(doc, dict) else []
+        runs.append(self.report())
+        try:
+            safe_write_json(path, {"runs": runs[-STARTUP_REPORT_KEEP:]})
+        except Exception as e:
+            print("StartupTimer.save error:", e)
+
+# ------------------ مخطط التحديثات (حسب الأحداث بدل الفحص كل 30 دقيقة) ------------------
+class RefreshPlanner:
+    """
+    Runs background refresh tasks when something calls for them instead of on a fixed
+    poll. A task may have an interval (jittered by ±REFRESH_JITTER); its last run is
+    persisted to `path`, so a restart only runs what is actually due. trigger() makes
+    tasks due now (or after `delay`, which coalesces bursts). A task whose fn() returns
+    False is retried with backoff from REFRESH_RETRY_MIN up to REFRESH_RETRY_MAX, and
+    recovered() re-runs every task whose last run failed. The worker sleeps on a
+    condition variable until the earliest due time (at most REFRESH_MAX_SLEEP).
+    """
+    def __init__(self, path=REFRESH_STATE, jitter=REFRESH_JITTER):
+        self.path = path
+        self.jitter = jitter
+        self.state = safe_load_json(path) or {}   # name -> {"at": epoch, "ok": bool}
+        self.tasks = {}                            # name -> {"fn", "interval", "due", "failures"}
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self.wakeups = 0
+
+    def _jittered(self, seconds):
+        return seconds * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def add(self, name, fn, interval=None):
+        """Register fn() (False = failed). interval=None: the task only runs when triggered."""
+        last = self.state.get(name) or {}
+        if interval is None:
+            due = None
+        elif last.get("ok") and last.get("at"):
+            due = last["at"] + self._jittered(interval)
+        else:
+            due = time.time()   # never ran, or the last run failed
+        with self._cond:
+            self.tasks[name] = {"fn": fn, "interval": interval, "due": due, "failures": 0 if last.get("ok", True) else 1}
+            self._cond.notify()
+
+    def trigger(self, *names, delay=0.0):
+        when = time.time() + delay
+        with self._cond:
+            for name in names:
+                task = self.tasks.get(name)
+                if task is not None and (task["due"] is None or task["due"] > when):
+                    task["due"] = when
+            self._cond.notify()
+
+    def recovered(self):
+        """The network is back: run whatever failed while it was down."""
+        with self._cond:
+            failed = [name for name, task in self.tasks.items() if task["failures"]]
+        self.trigger(*failed)
+
+    def next_due(self):
+        """(epoch, name) of the next task due, or None."""
+        with self._cond:
+            pending = [(task["due"], name) for name, task in self.tasks.items() if task["due"] is not None]
+            return min(pending) if pending else None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    nxt = self.next_due()
+                    wait = REFRESH_MAX_SLEEP if nxt is None else nxt[0] - time.time()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(min(wait, REFRESH_MAX_SLEEP))
+                if not self._running:
+                    return
+                now = time.time()
+                due = [name for name, task in self.tasks.items() if task["due"] is not None and task["due"] <= now]
+                for name in due:
+                    self.tasks[name]["due"] = None   # claimed; a trigger during the run sets it again
+            self.wakeups += 1
+            METRICS.inc("adhan_loop_wakeups_total", loop="refresh")
+            profile_checkpoint()
+            for name in due:
+                self._run_task(name)
+
+    def _run_task(self, name):
+        task = self.tasks[name]
+        try:
+            ok = task["fn"]() is not False
+        except Exception as e:
+            print(f"refresh {name} error:", e)
+            ok = False
+        now = time.time()
+        METRICS.inc("adhan_refresh_runs_total", task=name, result="ok" if ok else "failed")
+        with self._cond:
+            task["failures"] = 0 if ok else task["failures"] + 1
+            if not ok:
+                due = now + self._jittered(min(REFRESH_RETRY_MAX, REFRESH_RETRY_MIN * 2 ** (task["failures"] - 1)))
+            else:
+                due = now + self._jittered(task["interval"]) if task["interval"] else None
+            if task["due"] is not None:
+                due = task["due"] if due is None else min(due, task["due"])
+            task["due"] = due
+            self.state[name] = {"at": now, "ok": ok}
+            state = dict(self.state)
+        try:
+            safe_write_json(self.path, state)
+        except Exception as e:
+            print("RefreshPlanner state write error:", e)
+
+# ------------------ تحليل الأداء عند الطلب (cProfile + tracemalloc) ------------------
+DIAG_COMMANDS = ("profile", "profile-start", "profile-stop", "memory", "memory-stop", "stacks", "dump")
+
+_PROFILE_ATTACH = None   # Diagnostics.attach while a session runs on Python < 3.12
+
+def profile_checkpoint():
+    """Called by long-lived worker loops on each wake-up: join a running profiling session."""
+    attach = _PROFILE_ATTACH
+    if attach is not None:
+        attach()
+
+class _ThreadProfiler:
+    """
+    Python-level profiler for one thread, used before 3.12 where a cProfile can only be
+    switched off from its own thread: this one unhooks itself on the first event after
+    its session ends. create_stats() / stats make it a pstats.Stats source.
+    """
+    def __init__(self, diag, session):
+        self.diag = diag
+        self.session = session
+        self.name = threading.current_thread().name
+        self.stack = []    # [key, start, time spent in callees]
+        self.active = {}   # key -> frames of it on the stack (recursion)
+        self.rows = {}     # key -> [primitive calls, calls, tottime, cumtime, {caller: calls}]
+
+    def __call__(self, frame, event, arg):
+        if self.diag._session is not self.session:
+            sys.setprofile(None)
+            return
+        now = time.perf_counter()
+        if event == "call" or event == "c_call":
+            if event == "call":
+                code = frame.f_code
+                key = (code.co_filename, code.co_firstlineno, code.co_name)
+            else:
+                key = ("~", 0, f"<built-in method {getattr(arg, '__qualname__', arg)}>")
+            self.stack.append([key, now, 0.0])
+            self.active[key] = self.active.get(key, 0) + 1
+        elif self.stack:   # frames entered before this thread joined are not on the stack
+            key, start, inner = self.stack.pop()
+            self.active[key] -= 1
+            elapsed = now - start
+            row = self.rows.get(key)
+            if row is None:
+                row = self.rows[key] = [0, 0, 0.0, 0.0, {}]
+            row[1] += 1
+            row[2] += elapsed - inner
+            if not self.active[key]:   # outermost call of a recursion: counted once in cumtime
+                row[0] += 1
+                row[3] += elapsed
+            if self.stack:
+                self.stack[-1][2] += elapsed
+                caller = self.stack[-1][0]
+                row[4][caller] = row[4].get(caller, 0) + 1
+
+    def create_stats(self):
+        self.stats = {key: (cc, nc, tt, ct, {c: (n, n, 0.0, 0.0) for c, n in callers.items()})
+                      for key, (cc, nc, tt, ct, callers) in list(self.rows.items())}
+
+class Diagnostics:
+    """
+    Profiling a live process without restarting it. Commands (run(name) -> report paths):
+    profile toggles the profiler (profile-start / profile-stop), memory takes a tracemalloc
+    snapshot and diffs it with the previous one (memory-stop ends tracing), stacks dumps
+    every thread's stack, dump = stacks + memory. Reports go to `directory`.
+    Nothing is imported or hooked until a command runs, and a stopped session leaves no
+    hook behind. On Python 3.12+ one cProfile sees every thread. Older interpreters can't
+    hook a running thread from outside, so each thread gets a _ThreadProfiler when it
+    starts the session, starts during it, or passes profile_checkpoint(); the report
+    lists the threads that were covered.
+    """
+    def __init__(self, directory=DIAGNOSTICS_DIR, top=DIAG_TOP_N, frames=DIAG_TRACE_FRAMES):
+        self.directory = directory
+        self.top = top
+        self.frames = frames
+        self._lock = threading.Lock()
+        self._session = None     # token of the running profiling session
+        self._cprofile = None    # 3.12+: the one cProfile.Profile
+        self._profiles = []      # before 3.12: a _ThreadProfiler per covered thread
+        self._profile_started = None
+        self._snapshot = None    # previous tracemalloc snapshot
+
+    @property
+    def profiling(self):
+        return self._session is not None
+
+    def run(self, command):
+        if command == "profile":
+            command = "profile-stop" if self.profiling else "profile-start"
+        if command == "profile-start":
+            self.start_profile()
+            return []
+        if command == "profile-stop":
+            return self.stop_profile()
+        if command == "memory":
+            return [self.memory_snapshot()]
+        if command == "memory-stop":
+            self.stop_memory()
+            return []
+        if command == "stacks":
+            return [self.dump_stacks()]
+        if command == "dump":
+            return [self.dump_stacks(), self.memory_snapshot()]
+        raise ValueError(f"unknown diagnostics command: {command}")
+
+    def _path(self, kind, ext="txt"):
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"{kind}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')[:-3]}.{ext}")
+
+    # profiler
+    def start_profile(self):
+        global _PROFILE_ATTACH
+        with self._lock:
+            if self.profiling:
+                return False
+            self._session = object()
+            self._profile_started = datetime.now()
+            if sys.version_info >= (3, 12):
+                # cProfile is built on sys.monitoring there: one profiler sees all threads
+                import cProfile
+                self._cprofile = cProfile.Profile()
+                self._cprofile.enable()
+                return True
+            threading.setprofile(self._attach_new)   # threads started from now on
+            _PROFILE_ATTACH = self.attach            # worker loops, on their next wake-up
+        self.attach()                                # and this one
+        return True
+
+    def attach(self):
+        """Cover the calling thread in the running session (before 3.12; no-op otherwise)."""
+        with self._lock:
+            if self._session is None or self._cprofile is not None:
+                return None
+            current = sys.getprofile()
+            if isinstance(current, _ThreadProfiler) and current.session is self._session:
+                return current
+            profiler = _ThreadProfiler(self, self._session)
+            self._profiles.append(profiler)
+        sys.setprofile(profiler)
+        return profiler
+
+    def _attach_new(self, frame, event, arg):
+        """threading.setprofile() hook: hand the new thread its own _ThreadProfiler."""
+        profiler = self.attach()
+        if profiler is None:
+            sys.setprofile(None)
+        else:
+            profiler(frame, event, arg)
+
+    def stop_profile(self):
+        global _PROFILE_ATTACH
+        import pstats
+        import io
+        with self._lock:
+            if not self.profiling:
+                return []
+            threading.setprofile(None)
+            _PROFILE_ATTACH = None
+            self._session = None   # every _ThreadProfiler unhooks itself on its next event
+            started = self._profile_started
+            cprofile, self._cprofile = self._cprofile, None
+            profiles, self._profiles = self._profiles, []
+        if cprofile is not None:
+            cprofile.disable()
+            sources, threads = [cprofile], "all (cProfile)"
+        else:
+            if isinstance(sys.getprofile(), _ThreadProfiler):
+                sys.setprofile(None)
+            sources = [p for p in profiles if p.rows]
+            threads = ", ".join(sorted(p.name for p in sources)) or "-"
+            threads += " (before Python 3.12 only threads that ran code after joining the session)"
+        stats = pstats.Stats(*sources, stream=io.StringIO())
+        raw = self._path("profile", "prof")
+        stats.dump_stats(raw)   # for snakeviz / python -m pstats
+        out = io.StringIO()
+        stats.stream = out
+        out.write(f"started {started.isoformat(timespec='seconds')}, "
+                  f"{(datetime.now() - started).total_seconds():.1f}s\n")
+        out.write(f"threads: {threads}\n\n")
+        stats.sort_stats("cumulative").print_stats(self.top)
+        stats.sort_stats("tottime").print_stats(self.top)
+        path = self._path("profile")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(out.getvalue())
+        return [path, raw]
+
+    # tracemalloc
+    def memory_snapshot(self):
+        """First call starts tracing; each later one reports the top allocations and the diff."""
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        snap = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"traced: {current / 1048576:.1f} MB (peak {peak / 1048576:.1f} MB)", "",
+                 f"top {self.top} by line:"]
+        lines += [str(stat) for stat in snap.statistics("lineno")[:self.top]]
+        with self._lock:
+            prev, self._snapshot = self._snapshot, snap
+        if prev is None:
+            lines += ["", "tracing started; the next snapshot shows what grew since this one"]
+        else:
+            lines += ["", f"top {self.top} changes since the previous snapshot:"]
+            lines += [str(stat) for stat in snap.compare_to(prev, "lineno")[:self.top]]
+            biggest = snap.compare_to(prev, "traceback")[:1]
+            if biggest and biggest[0].size_diff > 0:
+                lines += ["", "largest growth, traceback:"] + biggest[0].traceback.format()
+        path = self._path("memory")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    def stop_memory(self):
+        import tracemalloc
+        with self._lock:
+            self._snapshot = None
+        tracemalloc.stop()
+
+    # thread stacks
+    def dump_stacks(self):
+        import traceback
+        threads = {t.ident: t for t in threading.enumerate()}
+        lines = []
+        for ident, frame in sys._current_frames().items():
+            t = threads.get(ident)
+            name = t.name if t else "?"
+            daemon = " daemon" if t and t.daemon else ""
+            lines.append(f"--- {name} ({ident}){daemon}")
+            lines += [line.rstrip("\n") for line in traceback.format_stack(frame)]
+            lines.append("")
+        path = self._path("stacks")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+        return path
+
+def install_diagnostic_signals(on_command):
+    """Map DIAG_SIGNALS to on_command(name) (POSIX only; call from the main thread)."""
+    import signal
+    for sig, command in DIAG_SIGNALS.items():
+        if hasattr(signal, sig):
+            signal.signal(getattr(signal, sig), lambda *a, command=command: on_command(command))
+
+# ------------------ نواة البرنامج (بدون واجهة) ------------------
+class AdhanCore:
+    """
+    Everything except the window: config, cities_map, prayer-times cache, timings,
+    zones, scheduler and the audio pool. Every zone shares the one scheduler, cache and
+    AudioPool, so extra locations cost only their scheduled events.
+    Runs on its own as the headless daemon (--headless); PrayerApp builds the Tk GUI
+    on top of it and overrides log/show_timings.
+    """
+    def __init__(self, instance=None, startup=None):
+        self.startup = startup or StartupTimer()
+        self.cfg = ConfigStore()
+        set_site_server(self.cfg.get("site_server"))
+        self.cities_map = load_cities_mapping()
+        self.resolve_gps_position()
+        self.cache = PrayerCache(max_entries=int(self.cfg.get("cache_max_entries", CACHE_MAX_ENTRIES)))
+        self.audio = AudioLibrary(self.cfg.get("audio_library") or {},
+                                  budget=int(self.cfg.get("audio_cache_mb", 64)) << 20)
+        self.players = AudioPool(self.audio, volume=self.cfg.get("volume", 80)/100.0,
+                                 streaming=self.cfg.get("audio_streaming", True))
+        self.ad_player = self.players.get(self.cfg.get("audio_device"))   # main zone's output
+        self.timings = {}        # main zone, today
+        self.timings_info = {}   # source/freshness of self.timings (see describe_timings)
+        self.revalidator = Revalidator()
+        self.zones = {}          # name -> Zone, rebuilt from the config by load_zones()
+        self.running = True
+        self.instance = instance   # InstanceLock held for the process lifetime
+        self._restart_pending = False
+        self._startup_saved = False
+        self.planner = RefreshPlanner()
+        self.diag = Diagnostics()
+        self._stopped = threading.Event()
+        self.scheduler = PrayerScheduler(
+            catch_up=self.cfg.get("missed_adhan_policy", CATCH_UP_POLICY),
+            window=self.cfg.get("missed_adhan_window", CATCH_UP_WINDOW),
+            on_clock_jump=lambda drift: self.update_prayer_times(),
+            on_missed=self.on_prayer_missed)
+
+    def log(self, s):
+        ts = datetime.now().strftime("%H:%M:%S")
+        print(f"[{ts}] {s}")
+
+    def resolve_gps_position(self):
+        """If the device has a configured gps_position, select the nearest mapped city."""
+        pos = self.cfg.get("gps_position")
+        if not pos:
+            return
+        try:
+            hits = nearest(float(pos[0]), float(pos[1]), 1)
+            if hits:
+                _, country, city, _ = hits[0]
+                self.cfg["city_country"] = [city, country]
+        except Exception as e:
+            print("resolve_gps_position error:", e)
+
+    def show_timings(self):
+        """Hook for front-ends; the daemon has nothing to render."""
+        pass
+
+    def apply_synced_assets(self, results):
+        """Called by the refresh tasks with sync_assets() / update results; applied in-process."""
+        if results.get("adhan.mp3") == "updated":
+            self.reload_audio()
+        if results.get("cities.json") == "updated":
+            self.reload_cities()
+        if results.get("adhan.py") == "updated":
+            self.request_restart()
+
+    def reload_cities(self):
+        reset_city_index()
+        self.cities_map = load_cities_mapping()
+        self.resolve_gps_position()
+        self.update_prayer_times(network=False)
+
+    def reload_audio(self):
+        self.players.set_source("adhan.mp3")
+        self.log("تم تحديث ملف الأذان")
+
+    def busy(self):
+        """True while the adhan plays or a prayer is due within RESTART_QUIET_WINDOW seconds."""
+        if self.players.playing:
+            return True
+        nxt = self.scheduler.next_event()
+        return bool(nxt) and nxt[0].timestamp() - time.time() < RESTART_QUIET_WINDOW
+
+    def request_restart(self):
+        """A new adhan.py is installed: restart once busy() clears (checked every RESTART_POLL s)."""
+        if self._restart_pending:
+            return
+        self._restart_pending = True
+        self.log("تم تنزيل إصدار جديد — سيُعاد التشغيل بعد انتهاء أي أذان قريب")
+
+        def wait():
+            while self.busy():
+                if self._stopped.wait(RESTART_POLL):
+                    return
+            self.restart()
+        threading.Thread(target=wait, name="restart-wait", daemon=True).start()
+
+    def restart(self):
+        """Clean shutdown (config flush, audio device, instance lock), then exec the new code."""
+        self.shutdown()
+        python = sys.executable
+        os.execv(python, [python] + sys.argv)
+
+    def update_prayer_times(self, network=True):
+        city, country = self.cfg.get("city_country", DEFAULT_CONFIG["city_country"])
+        # local astronomical calculation (or cache hit) — served at once, never waits on the network;
+        # the Aladhan cross-check and the site server's timings come in the background and update
+        # timings_info when they land
+        times = fetch_prayer_times_for(city, country, self.cities_map, cache=self.cache, use_site=False)
+        revalidate = network and self.cfg.get("api_cross_check", False)
+        if revalidate:
+            self.revalidator.submit(("api", city, country), lambda: self.revalidate_timings(city, country))
+        self.timings_info = self.describe_timings(city, country, revalidating=revalidate)
+        if times:
+            self.timings = times
+            self.show_timings()
+            self.log(f"تم حساب المواقيت لـ {city} - {country}")
+        else:
+            self.timings = {}
+            self.show_timings()
+            self.log("لا توجد مواقيت متاحة حالياً")
+        days = int(self.cfg.get("prefetch_days", PREFETCH_DAYS))
+        try:
+            self.cache.prefetch(city, country, self.cities_map, days=days)
+            self.cache.flush()
+        except Exception as e:
+            print("prefetch error:", e)
+        self.reschedule()
+        if network and SITE_SERVER:
+            self.revalidator.submit(("site",), lambda: self.sync_from_site(days))
+
+    def sync_from_site(self, days):
+        """Background half of update_prayer_times() in client mode: the next `days` of every
+        zone from the site server (one /v1/schedule request each), then reschedule."""
+        stored = 0
+        for zone in list(self.zones.values()):
+            entry = zone.entry(self.cities_map)
+            if entry is not None:
+                stored += prefetch_from_site(self.cache, zone.city, zone.country, {zone.country: {zone.city: entry}}, days)
+        if not stored:
+            return
+        self.cache.flush()
+        city, country = self.cfg.get("city_country", DEFAULT_CONFIG["city_country"])
+        times = fetch_prayer_times_for(city, country, self.cities_map, cache=self.cache, use_site=False)
+        if times:
+            self.timings = times
+        self.timings_info = self.describe_timings(city, country)
+        self.show_timings()
+        self.reschedule()
+
+    def describe_timings(self, city, country, revalidating=False):
+        """Where the current timings came from and how fresh they are, for the front-ends."""
+        entry = self.cities_map.get(country, {}).get(city) or {}
+        d = _city_date(entry.get("tz", ""))
+        info = self.cache.info(city, country, _entry_method(entry), d) or {}
+        api = HTTP.breaker(ALADHAN_API)
+        return {
+            "date": d.isoformat(),
+            "source": info.get("source", "local"),
+            "fetched_at": info.get("fetched_at"),
+            "verified_at": info.get("verified_at"),
+            "api_diff": info.get("api_diff"),
+            "api_error": info.get("api_error"),
+            "api_retry_in": api.retry_in(),
+            "revalidating": revalidating or self.revalidator.pending(("api", city, country)),
+        }
+
+    def revalidate_timings(self, city, country):
+        """Background half of update_prayer_times(): compare (or fill) today's timings with Aladhan."""
+        entry = self.cities_map.get(country, {}).get(city)
+        if not entry:
+            return
+        d = _city_date(entry.get("tz", ""))
+        method = _entry_method(entry)
+        now = datetime.now().isoformat(timespec="seconds")
+        remote = fetch_prayer_times_from_api(entry, d)   # fails fast while the API circuit is open
+        METRICS.inc("adhan_revalidations_total", result="ok" if remote else "failed")
+        current = self.cfg.get("city_country") == [city, country]
+        if remote:
+            local = self.cache.get(city, country, method, d)
+            if local:
+                diff = _timings_diff_minutes(local, remote)
+                self.cache.annotate(city, country, method, d, verified_at=now, api_diff=diff, api_error=None)
+                if diff > 1:
+                    self.log(f"تنبيه: فرق {diff} دقيقة بين الحساب المحلي و Aladhan لـ {city}")
+            else:
+                self.cache.put(city, country, method, d, remote, source="api")
+                if current:
+                    self.timings = remote
+                    self.reschedule()
+        else:
+            self.cache.annotate(city, country, method, d, api_error=now)
+        self.cache.flush()
+        if current:
+            self.timings_info = self.describe_timings(city, country)
+            self.show_timings()
+
+    def load_zones(self):
+        """(Re)build self.zones from the config, keeping what each zone has already played."""
+        city, country = self.cfg.get("city_country", DEFAULT_CONFIG["city_country"])
+        zones = [Zone(MAIN_ZONE, city, country, device=self.cfg.get("audio_device"))]
+        for doc in self.cfg.get("zones") or []:
+            try:
+                zones.append(Zone.from_config(doc))
+            except Exception as e:
+                print("zone config error:", e)
+        new = {}
+        for zone in zones:
+            if zone.name in new:
+                print(f"zone {zone.name}: duplicate name, ignored")
+                continue
+            if zone.name in self.zones:
+                zone.triggered = self.zones[zone.name].triggered
+            new[zone.name] = zone
+        for name, old in self.zones.items():
+            if name not in new:
+                self.scheduler.set_group(old.group, [])
+        if len(new) > 1 and set(new) != set(self.zones):
+            self.log(f"المناطق: {', '.join(new)}")
+        self.zones = new
+
+    def reschedule(self):
+        """Load today's and tomorrow's prayers of every zone into the shared scheduler."""
+        self.load_zones()
+        for zone in self.zones.values():
+            self.reschedule_zone(zone, self.timings if zone.name == MAIN_ZONE else None)
+
+    def reschedule_zone(self, zone, today_timings=None):
+        """One zone's prayers for today and tomorrow in its own scheduler group, plus its midnight refresh."""
+        entry = zone.entry(self.cities_map)
+        if entry is None:
+            self.scheduler.set_group(zone.group, [])
+            return
+        tz = entry.get("tz", "")
+        today = _city_date(tz)
+        reminder = float(self.cfg.get("reminder_minutes") or 0)
+        events = []
+        for i, timings in enumerate((today_timings, None)):
+            d = today + timedelta(days=i)
+            if timings is None:
+                timings = zone.timings_for(self.cities_map, d=d, cache=self.cache)
+            for when, name in compile_timings(timings or {}, tz, d):
+                events.append((when, name, lambda n, w, late, z=zone: self.on_prayer_time(n, w, late, zone=z)))
+                # housekeeping events carry the prayer they belong to, for its recording
+                events.append((when - timedelta(seconds=AUDIO_PREPARE_LEAD), "_prepare_audio",
+                               lambda _, w, late, prayer=name, z=zone: self.on_prepare_audio(prayer, w, late, zone=z)))
+                if reminder and self.sound_for(name, "reminder", zone):
+                    events.append((when - timedelta(minutes=reminder), "_reminder",
+                                   lambda _, w, late, prayer=name, z=zone: self.on_reminder(prayer, w, late, zone=z)))
+        tomorrow = today + timedelta(days=1)
+        midnight = datetime(tomorrow.year, tomorrow.month, tomorrow.day, 0, 0, 1, tzinfo=_tzinfo(tz))
+        if zone.name == MAIN_ZONE:
+            events.append((midnight, "_rollover", lambda name, when, late: self.update_prayer_times()))
+        else:
+            events.append((midnight, "_rollover", lambda name, when, late, z=zone: self.reschedule_zone(z)))
+        # drop events that already passed (re-scheduling must not replay them)
+        now = datetime.now().astimezone()
+        self.scheduler.set_group(zone.group, [e for e in events if e[0] > now])
+        today_key = today.isoformat()
+        zone.triggered = {k for k in zone.triggered if k.split("|", 1)[0] >= today_key}
+
+    def _zone(self, zone):
+        return zone or self.zones.get(MAIN_ZONE) or Zone(MAIN_ZONE, *self.cfg.get("city_country", DEFAULT_CONFIG["city_country"]))
+
+    def on_prayer_time(self, name, when, late, zone=None):
+        zone = self._zone(zone)
+        key = f"{when.date().isoformat()}|{name}"
+        if key in zone.triggered:
+            return
+        zone.triggered.add(key)
+        where = "" if zone.name == MAIN_ZONE else f" ({zone.name})"
+        if self.cfg.get("adhan_enabled", True):
+            METRICS.inc("adhan_prayers_total", prayer=name, zone=zone.name,
+                        result="late" if late > SCHEDULER_GRACE else "played")
+            self.log(f"موعد صلاة {name}{where} الآن — تشغيل الأذان لمدة {ADHAN_DURATION} ثانية")
+            self.players.get(zone.device).play(duration=ADHAN_DURATION, scheduled=when.timestamp(),
+                                               path=self.sound_for(name, zone=zone), volume=self.zone_volume(zone))
+        else:
+            METRICS.inc("adhan_prayers_total", prayer=name, zone=zone.name, result="disabled")
+
+    def zone_volume(self, zone):
+        """0..1, or None for the output's own volume (the slider, for the main device)."""
+        return None if zone.volume is None else zone.volume / 100.0
+
+    def sound_for(self, prayer, kind="adhan", zone=None):
+        """Recording for a prayer in a zone (site = zone name, or the city for the main zone)."""
+        self.audio.entries = self.cfg.get("audio_library") or {}
+        zone = self._zone(zone)
+        site = zone.city if zone.name == MAIN_ZONE else zone.name
+        return self.audio.resolve(prayer, site=site, kind=kind)
+
+    def on_prepare_audio(self, name, when, late, zone=None):
+        # `name` is the upcoming prayer: its recording is decoded now (non-streaming mode)
+        if self.cfg.get("adhan_enabled", True):
+            zone = self._zone(zone)
+            self.players.get(zone.device).prepare(release_after=AUDIO_PREPARE_LEAD + AUDIO_IDLE_RELEASE,
+                                                  path=self.sound_for(name, zone=zone))
+
+    def on_reminder(self, name, when, late, zone=None):
+        zone = self._zone(zone)
+        path = self.sound_for(name, "reminder", zone)
+        if path and self.cfg.get("adhan_enabled", True) and late <= SCHEDULER_GRACE:
+            where = "" if zone.name == MAIN_ZONE else f" ({zone.name})"
+            self.log(f"تذكير: صلاة {name}{where} بعد {self.cfg.get('reminder_minutes')} دقيقة")
+            self.players.get(zone.device).play(duration=REMINDER_DURATION, path=path, volume=self.zone_volume(zone))
+
+    def on_prayer_missed(self, name, when, late, group=None):
+        zone = self._zone(next((z for z in self.zones.values() if z.group == group), None))
+        where = "" if zone.name == MAIN_ZONE else f" ({zone.name})"
+        METRICS.inc("adhan_prayers_total", prayer=name, zone=zone.name, result="missed")
+        self.log(f"فات موعد صلاة {name}{where} ({when.strftime('%H:%M')}) بـ {int(late // 60)} دقيقة — لم يتم تشغيل الأذان")
+
+    def refresh_assets(self):
+        """Refresh task: sync cities/theme/adhan.mp3 and apply what changed."""
+        results = ensure_local_data_once()
+        self.apply_synced_assets(results)
+        return bool(results) and "failed" not in results.values()
+
+    def refresh_update(self):
+        """Refresh task: silent update check — staged, swapped when no adhan is playing, applied in-process."""
+        self.cfg.flush()
+        installed = perform_silent_update_if_needed(busy=lambda: self.players.playing)
+        if installed:
+            self.apply_synced_assets(dict.fromkeys(installed, "updated"))
+        return HTTP.is_online()
+
+    def refresh_timings(self):
+        """Refresh task (config change, network recovery, start): recompute, revalidate, reschedule."""
+        self.update_prayer_times()
+        if not self._startup_saved:
+            self._startup_saved = True
+            self.startup.save()
+
+    def on_config_changed(self, key):
+        if key in REFRESH_CONFIG_KEYS:
+            self.planner.trigger("timings", delay=REFRESH_DEBOUNCE)
 
-def safe_write_json(path, obj):
-    tmp = path + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
-    os.replace(tmp, path)
+    def on_network_recovered(self):
+        self.log("عاد الاتصال بالشبكة")
+        self.planner.recovered()
+        self.planner.trigger("timings")
 
-# ------------------ فحص نسخة واحدة قيد التشغيل (مُحسّن) ------------------
-def check_single_instance():
-    """
-    Return a tuple (status, payload)
-    - If we obtain a socket (no other instance) -> ("socket", socket_object)
-    - If another process found via psutil -> ("exists", pid)
-    - If socket bind fails (port in use) but psutil not conclusive -> ("exists", True)
-    """
-    # Prefer psutil-based detection if available
-    try:
-        current_pid = os.getpid()
-        script_basename = os.path.basename(sys.argv[0]).lower()
-        if psutil:
-            for proc in psutil.process_iter(['pid', 'exe', 'cmdline', 'name']):
-                try:
-                    pid = proc.info['pid']
-                    if pid == current_pid:
-                        continue
-                    # check exe path or cmdline or process name for our script/exe basename
-                    exe = (proc.info.get('exe') or "").lower()
-                    name = (proc.info.get('name') or "").lower()
-                    cmdline = " ".join(proc.info.get('cmdline') or []).lower()
-                    if script_basename in name or script_basename in exe or script_basename in cmdline:
-                        return ("exists", pid)
-                except (psutil.NoSuchProcess, psutil.AccessDenied):
-                    continue
-    except Exception:
-        pass
+    def toggle_adhan(self):
+        self.cfg["adhan_enabled"] = not self.cfg.get("adhan_enabled", True)
+        status = "مفعل" if self.cfg["adhan_enabled"] else "موقوف"
+        self.log(f"تم تحويل الأذان إلى: {status}")
 
-    # fallback: try to bind to a localhost port (atomic)
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    try:
-        s.bind(('127.0.0.1', SINGLETON_PORT))
-        # success -> keep socket open to reserve port
-        return ("socket", s)
-    except socket.error:
-        # port busy -> assume another instance exists
+    def on_instance_message(self, msg):
+        """A second launch forwarded `msg` (IPC thread): "diag:<command>" or just a note."""
+        if msg.startswith("diag:"):
+            self.diagnose(msg[5:])
+            return
+        self.log(f"محاولة تشغيل نسخة أخرى ({msg}) — البرنامج يعمل بالفعل")
+
+    def diagnose(self, command):
+        """Run a Diagnostics command (tray, --diag, DIAG_SIGNALS) and log where the report went."""
         try:
-            s.close()
-        except:
-            pass
-        return ("exists", True)
+            paths = self.diag.run(command)
+        except Exception as e:
+            print("diagnose error:", e)
+            return
+        METRICS.inc("adhan_diagnostics_total", command=command)
+        if command in ("profile", "profile-start", "profile-stop") and not paths:
+            self.log("تحليل الأداء: " + ("بدأ" if self.diag.profiling else "متوقف"))
+        for path in paths:
+            self.log(f"تقرير التشخيص: {path}")
 
-# ------------------ إدارة config محلي ------------------
-def load_config():
-    cfg = DEFAULT_CONFIG.copy()
-    doc = safe_load_json(CONFIG_FILE)
-    if isinstance(doc, dict):
-        cfg.update(doc)
-    # ensure keys
-    if "city_country" not in cfg:
-        cfg["city_country"] = DEFAULT_CONFIG["city_country"]
-    if "volume" not in cfg:
-        cfg["volume"] = DEFAULT_CONFIG["volume"]
-    if "adhan_enabled" not in cfg:
-        cfg["adhan_enabled"] = DEFAULT_CONFIG["adhan_enabled"]
-    return cfg
+    def save_metrics(self):
+        try:
+            safe_write_json(METRICS_SNAPSHOT, METRICS.snapshot())
+        except Exception as e:
+            print("save_metrics error:", e)
 
-def save_config(cfg):
-    safe_write_json(CONFIG_FILE, cfg)
+    def metrics_loop(self):
+        while not self._stopped.wait(METRICS_SNAPSHOT_INTERVAL):
+            self.save_metrics()
 
-# ------------------ التحديث التلقائي من GitHub ------------------
-def get_remote_version():
-    try:
-        r = requests.get(REMOTE_VERSION_URL, timeout=6)
-        if r.status_code == 200:
-            return r.text.strip()
-    except:
-        pass
-    return None
+    def start_background_loops(self):
+        if self.instance:
+            self.instance.serve(self.on_instance_message)
+        self.scheduler.start()
+        # refreshes run when something changed (midnight is the scheduler's _rollover event)
+        self.planner.add("assets", self.refresh_assets, ASSET_SYNC_INTERVAL)
+        self.planner.add("update", self.refresh_update, UPDATE_CHECK_INTERVAL)
+        self.planner.add("timings", self.refresh_timings)
+        self.planner.trigger("timings", delay=REFRESH_DEBOUNCE)   # revalidate/prefetch once, after first paint
+        self.cfg.listeners.append(self.on_config_changed)
+        HTTP.on_recovery.append(self.on_network_recovered)
+        self.planner.start()
+        threading.Thread(target=self.metrics_loop, name="metrics-snapshot", daemon=True).start()
+        port = int(self.cfg.get("metrics_port") or 0)
+        if port:
+            try:
+                self.metrics_server = serve_metrics(port)
+                self.log(f"المقاييس متاحة على http://127.0.0.1:{port}/metrics")
+            except OSError as e:
+                print("serve_metrics error:", e)
+        port = int(self.cfg.get("site_server_port") or 0)
+        if port:
+            try:
+                host = self.cfg.get("site_server_bind") or SITE_BIND
+                self.site_server = serve_site(port, lambda: self.cities_map, self.cache, host=host)
+                self.log(f"خادم الموقع يعمل على {host}:{port}")
+            except OSError as e:
+                print("serve_site error:", e)
 
-def get_local_version():
-    try:
-        with open(LOCAL_VERSION_FILE, "r", encoding="utf-8") as f:
-            return f.read().strip()
-    except:
-        return "0"
+    def shutdown(self):
+        self.running = False
+        self.scheduler.stop()
+        self.planner.stop()
+        self.cfg.flush()
+        try:
+            self.players.close()
+        except:
+            pass
+        if self.instance:
+            self.instance.release()
+        self.save_metrics()
+        self._stopped.set()
 
-def download_file(url, dest):
-    try:
-        r = requests.get(url, stream=True, timeout=20)
-        r.raise_for_status()
-        tmp = dest + ".tmp"
-        with open(tmp, "wb") as fw:
-            for chunk in r.iter_content(8192):
-                if chunk:
-                    fw.write(chunk)
-        os.replace(tmp, dest)
-        return True
-    except Exception as e:
-        print(f"download_file error {url} -> {e}")
-        return False
+    def run_forever(self):
+        """Headless main loop: compute, schedule, and sleep until shutdown()."""
+        self.update_prayer_times(network=False)
+        self.startup.mark("cached_timings")
+        self.start_background_loops()
+        nxt = self.scheduler.next_event()
+        self.log(f"headless: next prayer {nxt[1] + ' ' + nxt[0].strftime('%Y-%m-%d %H:%M') if nxt else '-'}")
+        while not self._stopped.wait(3600):
+            pass
 
-def perform_silent_update_if_needed():
+# ------------------ الواجهة الرئيسية والتشغيل ------------------
+class UiDispatcher:
     """
-    If remote version higher than local, download ALL FILES_TO_UPDATE and restart the process.
-    Silent: does not show dialogs (user asked no visible 'updating' message).
+    Tk widgets may only be touched from the thread running mainloop. Background
+    threads post() callables here and the Tk thread runs them in batches every
+    UI_DRAIN_MS via root.after; posts sharing a `key` coalesce while still queued.
     """
-    try:
-        remote = get_remote_version()
-        local = get_local_version()
-        if not remote or remote == local:
-            return False
-        # download files; for adhan.py download too then restart
-        for name, url in FILES_TO_UPDATE.items():
-            dest = os.path.abspath(name)
-            ok = download_file(url, dest)
-            if not ok:
-                print(f"Warning: failed to download {name}")
-        # write local version
-        with open(LOCAL_VERSION_FILE, "w", encoding="utf-8") as f:
-            f.write(remote)
-        # restart program so new adhan.py takes effect
-        python = sys.executable
-        os.execv(python, [python] + sys.argv)
-        return True
-    except Exception as e:
-        print("perform_silent_update_if_needed error:", e)
-        return False
+    def __init__(self, root, interval_ms=UI_DRAIN_MS, batch=UI_BATCH_MAX):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.batch = batch
+        self._queue = deque()
+        self._keys = set()
+        self._lock = threading.Lock()
+        self._tk_thread = threading.get_ident()
+        self.running = False
 
-def ensure_local_data_once():
-    """Try to download cities/theme/adhan.mp3 if online (non-forcing)."""
-    if not is_online():
-        return
-    for name, url in FILES_TO_UPDATE.items():
-        if name == "adhan.py":
-            continue
-        try:
-            download_file(url, os.path.abspath(name))
-        except:
-            pass
+    def post(self, fn, *args, key=None):
+        with self._lock:
+            if key is not None:
+                if key in self._keys:
+                    return
+                self._keys.add(key)
+            self._queue.append((key, fn, args))
 
-# ------------------ جلب مواقيت الصلاة باستخدام mapping ------------------
-def load_cities_mapping():
-    doc = safe_load_json(LOCAL_CITIES)
-    if not isinstance(doc, dict):
-        return {}
-    return doc
+    def call(self, fn, *args, key=None):
+        """Run fn now when already on the Tk thread, otherwise post() it."""
+        if threading.get_ident() == self._tk_thread:
+            fn(*args)
+        else:
+            self.post(fn, *args, key=key)
 
-def fetch_prayer_times_for(city_name, country_key, mapping):
-    entry = mapping.get(country_key, {}).get(city_name)
-    if not entry:
-        return None
-    lat = entry.get("lat")
-    lon = entry.get("lon")
-    tz = entry.get("tz", "")
-    method = entry.get("method", 2)
-    params = {
-        "latitude": lat,
-        "longitude": lon,
-        "method": method,
-        "timezonestring": tz,
-        "date": datetime.now().strftime("%d-%m-%Y")
-    }
-    try:
-        r = requests.get(ALADHAN_API, params=params, timeout=10)
-        r.raise_for_status()
-        data = r.json()
-        if data.get("code") == 200 and "data" in data:
-            timings = data["data"]["timings"]
-            safe_write_json(LOCAL_PRAYER_CACHE, {
-                "fetched_at": datetime.now().isoformat(),
-                "city": city_name,
-                "country": country_key,
-                "timings": timings
-            })
-            return timings
-    except Exception as e:
-        print("fetch_prayer_times_for error:", e)
-    # fallback to cache
-    cached = safe_load_json(LOCAL_PRAYER_CACHE)
-    if cached and cached.get("city") == city_name:
-        return cached.get("timings")
-    return None
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.root.after(self.interval_ms, self._drain)
 
-# ------------------ مشغّل الأذان ------------------
-class AdhanPlayer:
-    def __init__(self, mp3_path="adhan.mp3", volume=0.8):
-        self.mp3 = mp3_path if os.path.exists(mp3_path) else resource_path(mp3_path)
-        self.volume = volume
-        self._lock = threading.Lock()
-        if pygame:
+    def stop(self):
+        self.running = False
+
+    def _drain(self):
+        if not self.running:
+            return
+        for _ in range(self.batch):
+            with self._lock:
+                if not self._queue:
+                    break
+                key, fn, args = self._queue.popleft()
+                self._keys.discard(key)
             try:
-                pygame.mixer.init()
-                self.sound = pygame.mixer.Sound(self.mp3)
-                self.sound.set_volume(self.volume)
+                fn(*args)
+            except SystemExit:
+                raise
             except Exception as e:
-                print("pygame sound load error:", e)
-                self.sound = None
+                print("ui dispatch error:", e)
+        self.root.after(self.interval_ms, self._drain)
+
+class SearchPicker:
+    """
+    Entry + results list replacing the readonly comboboxes: typing filters through a
+    NameSearchIndex and the list holds at most one page of names, however many cities
+    the country has. `variable` only changes when a name is picked (click/Enter).
+    """
+    def __init__(self, parent, variable, index=None, on_select=None, page=SEARCH_PAGE_SIZE, font=None):
+        self.variable = variable
+        self.index = index
+        self.on_select = on_select
+        self.page = page
+        self.frame = tb.Frame(parent) if tb else tk.Frame(parent)
+        self.query = tk.StringVar(value=variable.get())
+        opts = {"font": font} if font else {}
+        if tb:
+            self.entry = tb.Entry(self.frame, textvariable=self.query, bootstyle="info", **opts)
         else:
-            self.sound = None
+            self.entry = tk.Entry(self.frame, textvariable=self.query, **opts)
+        self.entry.pack(fill="x")
+        self.results = tk.Listbox(self.frame, height=page, exportselection=False, **opts)
+        self._shown = False
+        self.entry.bind("<KeyRelease>", self._on_key)
+        self.entry.bind("<FocusIn>", lambda e: self.refresh(""))
+        self.entry.bind("<FocusOut>", lambda e: self.frame.after(150, self._maybe_close))
+        self.entry.bind("<Return>", lambda e: self._pick(0))
+        self.entry.bind("<Down>", self._focus_results)
+        self.entry.bind("<Escape>", lambda e: self.close())
+        self.results.bind("<ButtonRelease-1>", lambda e: self._pick(self.results.nearest(e.y)))
+        self.results.bind("<Return>", lambda e: self._pick(self._selected()))
+        self.results.bind("<Escape>", lambda e: (self.close(), self.entry.focus_set()))
+        self.results.bind("<FocusOut>", lambda e: self.frame.after(150, self._maybe_close))
+        variable.trace_add("write", lambda *a: self.query.set(variable.get()))
 
-    def set_volume(self, v):
-        self.volume = max(0.0, min(1.0, v))
-        if self.sound:
-            try:
-                self.sound.set_volume(self.volume)
-            except:
-                pass
+    def pack(self, **kw):
+        self.frame.pack(**kw)
 
-    def play(self, duration=ADHAN_DURATION):
-        def _worker():
-            with self._lock:
-                try:
-                    if self.sound:
-                        self.sound.play(-1)
-                        time.sleep(duration)
-                        pygame.mixer.stop()
-                except Exception as e:
-                    print("AdhanPlayer.play error:", e)
-        t = threading.Thread(target=_worker, daemon=True)
-        t.start()
+    def set_index(self, index):
+        self.index = index
+        if self._shown:
+            self.refresh(self.query.get())
 
-    def stop(self):
-        with self._lock:
-            try:
-                if pygame:
-                    pygame.mixer.stop()
-            except:
-                pass
+    def refresh(self, query):
+        names = self.index.search(query, self.page) if self.index else []
+        self.results.delete(0, "end")
+        for name in names:
+            self.results.insert("end", name)
+        self.results.configure(height=max(1, min(self.page, len(names))))
+        if not self._shown:
+            self.results.pack(fill="x")
+            self._shown = True
 
-# ------------------ الواجهة الرئيسية والتشغيل ------------------
-class PrayerApp:
-    def __init__(self, singleton_socket=None):
-        self.cfg = load_config()
-        self.cities_map = load_cities_mapping()
-        self.ad_player = AdhanPlayer(mp3_path="adhan.mp3", volume=self.cfg.get("volume", 80)/100.0)
-        self.timings = {}
-        self.triggered = set()
-        self.running = True
-        self.singleton_socket = singleton_socket
+    def close(self):
+        if self._shown:
+            self.results.pack_forget()
+            self._shown = False
+        self.query.set(self.variable.get())   # drop a half-typed query
+
+    def _on_key(self, e):
+        if e.keysym not in ("Return", "Down", "Up", "Escape", "Tab"):
+            self.refresh(self.query.get())
+
+    def _focus_results(self, e=None):
+        if self._shown and self.results.size():
+            self.results.focus_set()
+            self.results.selection_clear(0, "end")
+            self.results.selection_set(0)
+            self.results.activate(0)
+
+    def _selected(self):
+        sel = self.results.curselection()
+        return sel[0] if sel else 0
+
+    def _maybe_close(self):
+        try:
+            focus = self.frame.focus_get()
+        except Exception:   # focus moved to another toplevel (e.g. a messagebox)
+            focus = None
+        if focus not in (self.entry, self.results):
+            self.close()
+
+    def _pick(self, i):
+        if not self.results.size():
+            return "break"
+        name = self.results.get(i)
+        self.close()
+        changed = name != self.variable.get()
+        self.variable.set(name)
+        if changed and self.on_select:
+            self.on_select()
+        return "break"
+
+class PrayerApp(AdhanCore):
+    def __init__(self, instance=None, startup=None):
+        AdhanCore.__init__(self, instance=instance, startup=startup)
 
         # GUI (ttkbootstrap) — لو مش مثبت هيعمل استعمال محدود لتكينتر
         if tb:
@@ -356,6 +3863,10 @@ class PrayerApp:
         else:
             self.root = tk.Tk()
         self.root.title("مواقيت الصلاة - By SMRH")
+        self.ui = UiDispatcher(self.root)
+        self._log_pending = deque(maxlen=LOG_MAX_LINES)
+        self._log_lines = 0
+        self._timings_text = None
         self.root.geometry("480x580")
         try:
             ico = resource_path("icon.ico")
@@ -366,10 +3877,13 @@ class PrayerApp:
         self.root.protocol("WM_DELETE_WINDOW", self.minimize_to_tray)
 
         # theme
+        self.fonts = {}
         self.load_theme()
 
         # widgets
         self.create_widgets()
+        self.ui.start()
+        self.startup.mark("window")
 
         # add to startup if configured
         if self.cfg.get("auto_start", True):
@@ -378,17 +3892,10 @@ class PrayerApp:
             except Exception as e:
                 print("add_to_startup error:", e)
 
-        # ensure local data (try to pull theme/cities/adhan.mp3)
-        ensure_local_data_once()
-
-        # silent update check (may restart)
-        try:
-            perform_silent_update_if_needed()
-        except Exception:
-            pass
-
-        # initial fetch of prayer times
-        self.update_prayer_times()
+        # initial prayer times from the cache / local calculation only;
+        # asset sync and the update check are RefreshPlanner tasks, run when due after first paint
+        self.update_prayer_times(network=False)
+        self.startup.mark("cached_timings")
 
         # start background threads
         self.start_background_loops()
@@ -402,12 +3909,32 @@ class PrayerApp:
             "text": "#2c3e50",
             "highlight": "#007bff"
         })
+        footer = theme.get("footer_font", {})
+        # widgets use these named fonts, so reconfiguring them restyles the window in place
+        specs = {
+            "base": (self.font_family, self.font_size, "normal", "roman"),
+            "heading": (self.font_family, self.font_size + 1, "bold", "roman"),
+            "title": (self.font_family, self.font_size + 2, "bold", "roman"),
+            "small": (self.font_family, 10, "normal", "roman"),
+            "footer": (footer.get("family", self.font_family), footer.get("size", 10), "normal", "italic"),
+        }
+        tkfont = importlib.import_module("tkinter.font")
+        for name, (family, size, weight, slant) in specs.items():
+            if name in self.fonts:
+                self.fonts[name].configure(family=family, size=size, weight=weight, slant=slant)
+            else:
+                self.fonts[name] = tkfont.Font(root=self.root, family=family, size=size, weight=weight, slant=slant)
+        if tb and theme.get("theme_name"):
+            try:
+                self.root.style.theme_use(theme["theme_name"])
+            except Exception as e:
+                print("theme_use error:", e)
 
     def create_widgets(self):
         frm = tb.Frame(self.root, padding=12) if tb else tk.Frame(self.root)
         frm.pack(fill="both", expand=True)
 
-        lab1 = tb.Label(frm, text="اختر دولتك:", font=(self.font_family, self.font_size+2, "bold")) if tb else tk.Label(frm, text="اختر دولتك:")
+        lab1 = tb.Label(frm, text="اختر دولتك:", font=self.fonts["title"]) if tb else tk.Label(frm, text="اختر دولتك:")
         lab1.pack(anchor="w", pady=(2,6))
 
         self.country_var = tk.StringVar()
@@ -417,23 +3944,27 @@ class PrayerApp:
         if not country_keys:
             country_keys = ["Egypt"]
 
+        # search-as-you-type pickers (same widget with ttkbootstrap and plain tkinter)
+        self.city_indexes = {}
+        self.country_picker = SearchPicker(frm, self.country_var, NameSearchIndex.for_countries(country_keys),
+                                           on_select=self.on_country_changed, font=self.fonts["base"])
+        self.country_picker.pack(fill="x")
         if tb:
-            self.country_combo = tb.Combobox(frm, values=country_keys, textvariable=self.country_var, state="readonly", bootstyle="info")
-            self.country_combo.pack(fill="x")
-            self.country_combo.bind("<<ComboboxSelected>>", self.on_country_changed)
-
-            tb.Label(frm, text="المدينة:", font=(self.font_family, self.font_size)).pack(anchor="w", pady=(10,0))
-            self.city_combo = tb.Combobox(frm, values=[], textvariable=self.city_var, state="readonly", bootstyle="info")
-            self.city_combo.pack(fill="x")
-            self.city_combo.bind("<<ComboboxSelected>>", self.on_city_changed)
+            tb.Label(frm, text="المدينة:", font=self.fonts["base"]).pack(anchor="w", pady=(10,0))
+        else:
+            tk.Label(frm, text="المدينة:").pack(anchor="w")
+        self.city_picker = SearchPicker(frm, self.city_var, on_select=self.on_city_changed,
+                                        font=self.fonts["base"])
+        self.city_picker.pack(fill="x")
 
+        if tb:
             tb.Button(frm, text="تحديث المواقيت الآن", command=self.update_prayer_times, bootstyle="success-outline").pack(fill="x", pady=8)
 
-            tb.Label(frm, text="مواقيت الصلاة:", font=(self.font_family, self.font_size+1, "bold")).pack(anchor="w", pady=(8,4))
-            self.times_box = tb.Text(frm, height=8, state="disabled", font=(self.font_family, self.font_size))
+            tb.Label(frm, text="مواقيت الصلاة:", font=self.fonts["heading"]).pack(anchor="w", pady=(8,4))
+            self.times_box = tb.Text(frm, height=8, state="disabled", font=self.fonts["base"])
             self.times_box.pack(fill="both", pady=4)
 
-            tb.Label(frm, text="مستوى الصوت:", font=(self.font_family, self.font_size)).pack(anchor="w", pady=(8,2))
+            tb.Label(frm, text="مستوى الصوت:", font=self.fonts["base"]).pack(anchor="w", pady=(8,2))
             self.vol = tb.Scale(frm, from_=0, to=100, orient="horizontal", command=self.on_volume_change, bootstyle="info")
             self.vol.set(int(self.cfg.get("volume", 80)))
             self.vol.pack(fill="x")
@@ -443,17 +3974,12 @@ class PrayerApp:
             tb.Button(btns, text="تشغيل الأذان", command=lambda: self.ad_player.play(), bootstyle="primary").pack(side="left", expand=True, fill="x", padx=4)
             tb.Button(btns, text="إيقاف الأذان", command=self.ad_player.stop, bootstyle="danger").pack(side="left", expand=True, fill="x", padx=4)
 
-            self.log_box = tb.Text(frm, height=6, state="disabled", font=(self.font_family, 10))
+            self.log_box = tb.Text(frm, height=6, state="disabled", font=self.fonts["small"])
             self.log_box.pack(fill="both", pady=6)
 
-            tb.Label(frm, text="By SMRH", font=(self.font_family, 10, "italic")).pack(anchor="e")
+            tb.Label(frm, text="By SMRH", font=self.fonts["footer"]).pack(anchor="e")
         else:
             # fallback plain tkinter layout (less pretty)
-            self.country_combo = tk.OptionMenu(frm, self.country_var, *country_keys, command=lambda e: self.on_country_changed())
-            self.country_combo.pack(fill="x")
-            tk.Label(frm, text="المدينة:").pack(anchor="w")
-            self.city_combo = tk.OptionMenu(frm, self.city_var, "")  # we will populate
-            self.city_combo.pack(fill="x")
             tk.Button(frm, text="تحديث المواقيت الآن", command=self.update_prayer_times).pack(fill="x", pady=8)
             self.times_box = tk.Text(frm, height=8)
             self.times_box.pack(fill="both", pady=4)
@@ -476,128 +4002,150 @@ class PrayerApp:
         else:
             self.country_var.set(country_keys[0])
             self.populate_cities(country_keys[0])
-            first_city = list(self.cities_map.get(country_keys[0], {}).keys())[0] if self.cities_map else ""
-            self.city_var.set(first_city)
-            self.cfg["city_country"] = [first_city, country_keys[0]]
-            save_config(self.cfg)
+            self.cfg["city_country"] = [self.city_var.get(), country_keys[0]]
+
+    def apply_synced_assets(self, results):
+        if results.get("adhan.mp3") == "updated":
+            self.reload_audio()
+        # widgets must be touched from the Tk thread
+        if results.get("cities.json") == "updated":
+            self.ui.post(self.reload_cities, key="reload_cities")
+        if results.get("theme.json") == "updated":
+            self.ui.post(self.reload_theme, key="reload_theme")
+        if results.get("adhan.py") == "updated":
+            self.request_restart()
+
+    def restart(self):
+        # from the Tk thread, so the tray icon is taken down before the process image is replaced
+        self.ui.post(self._restart_now, key="restart")
+
+    def _restart_now(self):
+        try:
+            if getattr(self, "tray", None):
+                self.tray.stop()
+        except:
+            pass
+        AdhanCore.restart(self)
+
+    def reload_theme(self):
+        """Apply a freshly synced theme.json to the open window (named fonts + ttk theme)."""
+        self.load_theme()
+        self.log("تم تحديث المظهر")
+
+    def reload_cities(self):
+        """Apply a freshly synced cities.json without restarting."""
+        reset_city_index()
+        self.cities_map = load_cities_mapping()
+        self.resolve_gps_position()
+        country_keys = list(self.cities_map.keys()) or ["Egypt"]
+        self.country_picker.set_index(NameSearchIndex.for_countries(country_keys))
+        self.city_indexes.clear()
+        country = self.country_var.get()
+        if country not in country_keys:
+            country = country_keys[0]
+            self.country_var.set(country)
+        self.populate_cities(country)
+        self.cfg["city_country"] = [self.city_var.get(), country]
+        self.update_prayer_times(network=False)
+        self.log("تم تحديث قائمة المدن")
 
     def populate_cities(self, country_key):
-        cities = list(self.cities_map.get(country_key, {}).keys()) if self.cities_map else []
-        if tb:
-            self.city_combo.configure(values=cities)
-            if cities:
-                if self.city_var.get() not in cities:
-                    self.city_var.set(cities[0])
-        else:
-            # tkinter OptionMenu replacement
-            menu = self.city_combo["menu"]
-            menu.delete(0, "end")
-            for c in cities:
-                menu.add_command(label=c, command=lambda value=c: self.city_var.set(value))
-            if cities:
-                self.city_var.set(cities[0])
+        cities = self.cities_map.get(country_key, {}) if self.cities_map else {}
+        if country_key not in self.city_indexes:   # built once per country, dropped on reload
+            self.city_indexes[country_key] = NameSearchIndex.for_cities(cities)
+        index = self.city_indexes[country_key]
+        self.city_picker.set_index(index)
+        if index.names and self.city_var.get() not in cities:
+            self.city_var.set(index.names[0])
 
     def on_country_changed(self, e=None):
         c = self.country_var.get()
         self.populate_cities(c)
         self.cfg["city_country"] = [self.city_var.get(), c]
-        save_config(self.cfg)
         self.update_prayer_times()
 
     def on_city_changed(self, e=None):
         c = self.country_var.get()
         self.cfg["city_country"] = [self.city_var.get(), c]
-        save_config(self.cfg)
         self.update_prayer_times()
 
     def log(self, s):
+        # any thread: queue the line, the Tk thread appends queued lines in one go
         ts = datetime.now().strftime("%H:%M:%S")
+        if not hasattr(self, "ui"):
+            print(f"[{ts}] {s}")
+            return
+        self._log_pending.append(f"[{ts}] {s}")
+        self.ui.post(self._render_log, key="log")
+
+    def _render_log(self):
+        lines = []
+        while self._log_pending:
+            lines.append(self._log_pending.popleft())
+        if not lines:
+            return
         try:
             self.log_box.configure(state="normal")
-            self.log_box.insert("end", f"[{ts}] {s}\n")
+            self.log_box.insert("end", "\n".join(lines) + "\n")
+            self._log_lines += len(lines)
+            excess = self._log_lines - LOG_MAX_LINES
+            if excess > 0:   # ring buffer: drop the oldest lines
+                self.log_box.delete("1.0", f"{excess + 1}.0")
+                self._log_lines -= excess
             self.log_box.configure(state="disabled")
             self.log_box.see("end")
         except:
-            print(f"[{ts}] {s}")
+            print("\n".join(lines))
 
     def on_volume_change(self, val):
         vol = float(val) / 100.0
         self.ad_player.set_volume(vol)
-        self.cfg["volume"] = int(float(val))
-        save_config(self.cfg)
-
-    def update_prayer_times(self):
-        city, country = self.cfg.get("city_country", DEFAULT_CONFIG["city_country"])
-        if is_online():
-            self.log("جاري جلب مواقيت الصلاة من الإنترنت...")
-            times = fetch_prayer_times_for(city, country, self.cities_map)
-            if times:
-                self.timings = times
-                self.show_timings()
-                self.log(f"تم تحديث المواقيت لـ {city} - {country}")
-                self.triggered.clear()
-                return
-            else:
-                self.log("فشل جلب المواقيت من API — المحاولة بالنسخة المحلية")
-        # offline fallback
-        cached = safe_load_json(LOCAL_PRAYER_CACHE)
-        if cached and cached.get("city") == city:
-            self.timings = cached.get("timings", {})
-            self.show_timings()
-            self.log("استخدام المواقيت المخزنة محليًا")
-        else:
-            self.timings = {}
-            self.show_timings()
-            self.log("لا توجد مواقيت متاحة حالياً")
+        self.cfg["volume"] = int(float(val))   # written by ConfigStore once the drag settles
 
     def show_timings(self):
+        self.ui.call(self._render_timings, key="timings")
+
+    @staticmethod
+    def _freshness_text(info):
+        """One line under the timings: source, when it was computed, and the Aladhan check state."""
+        def at(iso):
+            if not iso:
+                return "-"
+            return iso[11:16] if iso[:10] == datetime.now().date().isoformat() else iso[:16].replace("T", " ")
+        src = {"local": "حساب محلي", "api": "Aladhan", "site": "خادم الموقع"}.get(info.get("source"), info.get("source", "-"))
+        parts = [f"المصدر: {src} ({at(info.get('fetched_at'))})"]
+        if info.get("revalidating"):
+            parts.append("جاري التحقق من Aladhan…")
+        elif info.get("verified_at"):
+            diff = info.get("api_diff") or 0
+            parts.append(f"تم التحقق {at(info['verified_at'])}" + (f"، فرق {diff} د" if diff > 1 else ""))
+        elif info.get("api_retry_in"):
+            parts.append(f"Aladhan غير متاح، محاولة بعد {math.ceil(info['api_retry_in'] / 60)} د")
+        elif info.get("api_error"):
+            parts.append(f"فشل التحقق {at(info['api_error'])}")
+        return " • ".join(parts)
+
+    def _render_timings(self):
         ar = {"Fajr":"الفجر","Dhuhr":"الظهر","Asr":"العصر","Maghrib":"المغرب","Isha":"العشاء","Sunrise":"الشروق"}
+        timings = self.timings
+        text = "".join(f"{ar.get(key,key)} : {timings.get(key, 'غير متوفر')}\n"
+                       for key in ["Fajr","Dhuhr","Asr","Maghrib","Isha"])
+        if timings:
+            text += "\n" + self._freshness_text(self.timings_info)
+        if text == self._timings_text:
+            return   # nothing changed, leave the widget alone
         try:
             self.times_box.configure(state="normal")
             self.times_box.delete("1.0", "end")
-            for key in ["Fajr","Dhuhr","Asr","Maghrib","Isha"]:
-                val = self.timings.get(key, "غير متوفر")
-                self.times_box.insert("end", f"{ar.get(key,key)} : {val}\n")
+            self.times_box.insert("end", text)
             self.times_box.configure(state="disabled")
+            self._timings_text = text
         except:
             pass
 
-    def prayer_check_loop(self):
-        while self.running:
-            if not self.timings:
-                time.sleep(CHECK_INTERVAL)
-                continue
-            now = datetime.now().strftime("%H:%M")
-            for name, t in self.timings.items():
-                if name.lower() == "sunrise":
-                    continue
-                t_clean = t.split(" ")[0].strip()
-                if t_clean == now and name not in self.triggered:
-                    self.triggered.add(name)
-                    if self.cfg.get("adhan_enabled", True):
-                        self.log(f"موعد صلاة {name} الآن — تشغيل الأذان لمدة {ADHAN_DURATION} ثانية")
-                        self.ad_player.play(duration=ADHAN_DURATION)
-            time.sleep(1)
-
-    def periodic_update_loop(self):
-        while self.running:
-            try:
-                # silent check for updates (may cause restart)
-                perform_silent_update_if_needed()
-                # ensure local copies of data
-                ensure_local_data_once()
-                # update prayer times
-                self.update_prayer_times()
-            except Exception as e:
-                print("periodic_update_loop:", e)
-            for _ in range(int(UPDATE_INTERVAL/5)):
-                if not self.running:
-                    break
-                time.sleep(5)
-
     # tray icon
     def create_tray_icon(self):
-        if pystray is None or Image is None:
+        if not pystray or not Image:
             return
         def _img():
             img = Image.new('RGB', (64,64), color=(52,152,219))
@@ -605,9 +4153,16 @@ class PrayerApp:
             d.text((18,14), "ص", fill="white")
             return img
         menu = pystray.Menu(
-            pystray.MenuItem("إظهار البرنامج", lambda icon, item: self.show_window()),
+            # menu callbacks run on the tray thread; hand them to the Tk thread
+            pystray.MenuItem("إظهار البرنامج", lambda icon, item: self.ui.post(self.show_window)),
             pystray.MenuItem("تشغيل/إيقاف الأذان", lambda icon, item: self.toggle_adhan()),
-            pystray.MenuItem("خروج", lambda icon, item: self.exit_app())
+            pystray.MenuItem("تشخيص الأداء", pystray.Menu(
+                pystray.MenuItem("بدء/إيقاف تحليل المعالج (cProfile)", lambda icon, item: self.diagnose("profile"),
+                                 checked=lambda item: self.diag.profiling),
+                pystray.MenuItem("لقطة الذاكرة (tracemalloc)", lambda icon, item: self.diagnose("memory")),
+                pystray.MenuItem("إيقاف تتبع الذاكرة", lambda icon, item: self.diagnose("memory-stop")),
+                pystray.MenuItem("حالة الـ threads", lambda icon, item: self.diagnose("stacks")))),
+            pystray.MenuItem("خروج", lambda icon, item: self.ui.post(self.exit_app))
         )
         self.tray = pystray.Icon("adhan_app", _img(), "مواقيت الصلاة", menu=menu)
         threading.Thread(target=self.tray.run, daemon=True).start()
@@ -620,9 +4175,21 @@ class PrayerApp:
         if not hasattr(self, "tray") or self.tray is None:
             self.create_tray_icon()
 
+    def on_instance_message(self, msg):
+        if msg == "show":
+            self.ui.post(self.show_window)
+        else:
+            super().on_instance_message(msg)
+
+    def diagnose(self, command):
+        # on the Tk thread, so the profiler (before 3.12) also covers the UI
+        self.ui.call(super().diagnose, command)
+
     def show_window(self):
         try:
             self.root.deiconify()
+            self.root.lift()
+            self.root.focus_force()
             if hasattr(self, "tray") and self.tray:
                 try:
                     self.tray.stop()
@@ -632,45 +4199,27 @@ class PrayerApp:
         except:
             pass
 
-    def toggle_adhan(self):
-        self.cfg["adhan_enabled"] = not self.cfg.get("adhan_enabled", True)
-        save_config(self.cfg)
-        status = "مفعل" if self.cfg["adhan_enabled"] else "موقوف"
-        self.log(f"تم تحويل الأذان إلى: {status}")
-
     def exit_app(self):
-        self.running = False
         try:
             if hasattr(self, "tray") and self.tray:
                 self.tray.stop()
         except:
             pass
-        try:
-            self.ad_player.stop()
-        except:
-            pass
+        self.shutdown()
+        self.ui.stop()
         try:
             self.root.destroy()
         except:
             pass
-        try:
-            if self.singleton_socket:
-                self.singleton_socket.close()
-        except:
-            pass
         sys.exit(0)
 
-    def start_background_loops(self):
-        t1 = threading.Thread(target=self.prayer_check_loop, daemon=True)
-        t2 = threading.Thread(target=self.periodic_update_loop, daemon=True)
-        t1.start(); t2.start()
-
     def run(self):
-        # UI periodic tick
-        def ui_tick():
-            self.show_timings()
-            self.root.after(60000, ui_tick)
-        self.root.after(1000, ui_tick)
+        # no periodic redraw: background threads post changes through self.ui
+        def first_paint():
+            self.root.update_idletasks()
+            self.startup.mark("first_paint")
+            self.log(f"زمن بدء التشغيل: {self.startup.elapsed_ms('first_paint'):.0f} ms")
+        self.root.after(0, first_paint)
         self.root.mainloop()
 
 # ------------------ Windows startup helper ------------------
@@ -685,30 +4234,195 @@ def add_to_startup():
     except Exception as e:
         print("add_to_startup error:", e)
 
-# ------------------ Main ------------------
-def main():
-    # ensure local copies of theme/cities/adhan.mp3 if possible
-    ensure_local_data_once()
-    # silent update check (may restart)
+# ------------------ سطر الأوامر (CLI) ------------------
+def find_city(mapping, city=None, country=None, cfg=None):
+    """Resolve (city, country, entry); the country is optional when the city name is unique."""
+    if not city:
+        city, country = (cfg or load_config()).get("city_country", DEFAULT_CONFIG["city_country"])
+    if country and country not in mapping:
+        country = (NameSearchIndex.for_countries(mapping).search(country, 1) or [country])[0]
+    scope = [country] if country else list(mapping)
+    for country_key in scope:
+        cities = mapping.get(country_key, {})
+        if city in cities:
+            return city, country_key, cities[city]
+    # not an exact name: "cairo", "القاهره", "qahira" ... take the best search hit
+    for country_key in scope:
+        cities = mapping.get(country_key, {})
+        hits = NameSearchIndex.for_cities(cities).search(city, 1)
+        if hits:
+            return hits[0], country_key, cities[hits[0]]
+    return city, country, None
+
+def cli_times(args):
+    mapping = load_cities_mapping()
+    city, country, entry = find_city(mapping, args.city, args.country)
+    if not entry:
+        print(f"unknown city: {city}", file=sys.stderr)
+        return 2
+    start = datetime.strptime(args.date, "%Y-%m-%d").date() if args.date else _city_date(entry.get("tz", ""))
+    days = []
+    for i in range(max(1, args.days)):
+        d = start + timedelta(days=i)
+        days.append({"date": d.isoformat(), "timings": compute_prayer_times_for_entry(entry, d)})
+    if args.json:
+        print(json.dumps({"city": city, "country": country, "tz": entry.get("tz", ""),
+                          "method": _entry_method(entry), "days": days}, ensure_ascii=False, indent=2))
+        return 0
+    cols = ["Fajr", "Sunrise", "Dhuhr", "Asr", "Maghrib", "Isha"]
+    print(f"{city} - {country} ({entry.get('tz', '')}, method {_entry_method(entry)})")
+    print("date        " + " ".join(f"{c:>7}" for c in cols))
+    for day in days:
+        print(f"{day['date']}  " + " ".join(f"{day['timings'][c]:>7}" for c in cols))
+    return 0
+
+def cli_next(args):
+    mapping = load_cities_mapping()
+    city, country, entry = find_city(mapping, args.city, args.country)
+    if not entry:
+        print(f"unknown city: {city}", file=sys.stderr)
+        return 2
+    tz = entry.get("tz", "")
+    today = _city_date(tz)
+    now = datetime.now().astimezone()
+    for i in range(2):
+        d = today + timedelta(days=i)
+        for when, name in compile_timings(compute_prayer_times_for_entry(entry, d), tz, d):
+            if when <= now:
+                continue
+            minutes = int((when - now).total_seconds() // 60)
+            if args.json:
+                print(json.dumps({"city": city, "country": country, "prayer": name,
+                                  "at": when.isoformat(), "in_minutes": minutes}, ensure_ascii=False))
+            else:
+                print(f"{name} {when.strftime('%Y-%m-%d %H:%M')} ({city}) — in {minutes // 60}h {minutes % 60:02d}m")
+            return 0
+    print("no upcoming prayer", file=sys.stderr)
+    return 1
+
+def cli_nearest(args):
+    t0 = time.perf_counter()
+    hits = nearest(args.lat, args.lon, args.k)
+    took_ms = (time.perf_counter() - t0) * 1000
+    if args.json:
+        print(json.dumps([{"km": round(km, 3), "country": country, "city": city, **entry}
+                          for km, country, city, entry in hits], ensure_ascii=False, indent=2))
+    else:
+        for km, country, city, entry in hits:
+            print(f"{km:9.2f} km  {city} - {country} ({entry['tz']})")
+        print(f"({took_ms:.2f} ms incl. index load)", file=sys.stderr)
+    return 0 if hits else 1
+
+def cli_prefetch(args):
+    cfg = ConfigStore()
     try:
-        perform_silent_update_if_needed()
-    except:
-        pass
-    # check single-instance and either obtain socket or exit politely
+        y, m = map(int, (args.month or datetime.now().strftime("%Y-%m")).split("-"))
+    except ValueError:
+        print("--month must be YYYY-MM", file=sys.stderr)
+        return 2
+    months = []
+    for _ in range(max(1, args.months)):
+        months.append((y, m))
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    cap = int(cfg.get("cache_max_entries", CACHE_MAX_ENTRIES))
+    cache = PrayerCache(max_entries=cap)
+    report = bulk_prefetch(load_cities_mapping(), months, cache, countries=args.country,
+                           workers=args.workers, rate=args.rate, api=args.api, local=args.local,
+                           progress=lambda msg: print(msg, file=sys.stderr))
+    if cache.max_entries > cap:
+        # persisted, or the next start would load the cache with the old cap and evict the prefetch
+        cfg["cache_max_entries"] = cache.max_entries
+        cfg.flush()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if not report["failed"] else 1
+
+def build_arg_parser():
+    import argparse
+    ap = argparse.ArgumentParser(prog="adhan", description="مواقيت الصلاة والأذان — By SMRH")
+    ap.add_argument("--headless", action="store_true", help="run scheduler + adhan without a window (daemon)")
+    ap.add_argument("--build-manifest", action="store_true", help="write manifest.json for the asset files")
+    ap.add_argument("--diag", choices=DIAG_COMMANDS,
+                    help=f"ask the running instance for a report in {DIAGNOSTICS_DIR}/ (profile toggles cProfile)")
+    sub = ap.add_subparsers(dest="command")
+    t = sub.add_parser("times", help="print prayer times")
+    t.add_argument("--city")
+    t.add_argument("--country")
+    t.add_argument("--date", help="YYYY-MM-DD (default: today in the city's timezone)")
+    t.add_argument("--days", type=int, default=1)
+    t.add_argument("--json", action="store_true")
+    n = sub.add_parser("next", help="print the next prayer")
+    n.add_argument("--city")
+    n.add_argument("--country")
+    n.add_argument("--json", action="store_true")
+    nr = sub.add_parser("nearest", help="nearest places in cities.json to a lat/lon")
+    nr.add_argument("lat", type=float)
+    nr.add_argument("lon", type=float)
+    nr.add_argument("-k", type=int, default=1)
+    nr.add_argument("--json", action="store_true")
+    pf = sub.add_parser("prefetch", help="stage whole months for every city in cities.json")
+    pf.add_argument("--month", help="first month YYYY-MM (default: this month)")
+    pf.add_argument("--months", type=int, default=1)
+    pf.add_argument("--country", action="append", help="limit to a country (repeatable)")
+    pf.add_argument("--workers", type=int, default=BULK_WORKERS)
+    pf.add_argument("--rate", type=float, default=BULK_RATE, help="max requests/second per host")
+    pf.add_argument("--api", default=ALADHAN_CALENDAR_API)
+    pf.add_argument("--local", action="store_true", help="compute locally instead of calling the API")
+    return ap
+
+def run_headless(startup):
     status, payload = check_single_instance()
+    startup.mark("instance_check")
     if status == "exists":
-        # show notification/information and exit
-        try:
-            messagebox.showinfo("تنبيه", "البرنامج يعمل بالفعل على هذا الجهاز. إذا كنت ترغب في فتح النافذة، تأكد من إغلاق النسخة الأخرى أو البحث عنها في شريط المهام.")
-        except:
+        print("البرنامج يعمل بالفعل.")
+        return 0
+    core = AdhanCore(instance=payload, startup=startup)
+    import signal
+    for sig in ("SIGINT", "SIGTERM"):
+        if hasattr(signal, sig):
+            signal.signal(getattr(signal, sig), lambda *a: core.shutdown())
+    install_diagnostic_signals(core.diagnose)
+    core.run_forever()
+    return 0
+
+# ------------------ Main ------------------
+def main():
+    args = build_arg_parser().parse_args()
+    if args.build_manifest:
+        doc = build_manifest()
+        print(json.dumps(doc, ensure_ascii=False, indent=2))
+        return
+    if args.diag:
+        status, payload = check_single_instance("diag:" + args.diag)
+        if status == "lock":
+            payload.release()
+            print("البرنامج مش شغال.")
+            sys.exit(1)
+        print(f"تم الطلب؛ التقرير في {DIAGNOSTICS_DIR}/" if payload else "تعذر الوصول للنسخة الشغالة.")
+        sys.exit(0 if payload else 1)
+    if args.command == "times":
+        sys.exit(cli_times(args))
+    if args.command == "next":
+        sys.exit(cli_next(args))
+    if args.command == "prefetch":
+        sys.exit(cli_prefetch(args))
+    if args.command == "nearest":
+        sys.exit(cli_nearest(args))
+    # staged startup: instance check -> config + cached timings -> first paint.
+    # Network work (asset sync, update check) only starts after the window is up.
+    startup = StartupTimer()
+    startup.mark("imports")
+    if args.headless:
+        sys.exit(run_headless(startup))
+    # single instance: a second launch asks the running one to show its window and exits
+    status, payload = check_single_instance("show")
+    startup.mark("instance_check")
+    if status == "exists":
+        if not payload:
             print("البرنامج يعمل بالفعل.")
         sys.exit(0)
-    elif status == "socket":
-        singleton_socket = payload
-    else:
-        singleton_socket = None
 
-    app = PrayerApp(singleton_socket=singleton_socket)
+    app = PrayerApp(instance=payload, startup=startup)
+    install_diagnostic_signals(app.diagnose)
     app.run()
 
 if __name__ == "__main__":
@@ -0,0 +1,695 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks and offline checks for adhan.py — kept out of the app so self-update never ships them.
+  python bench_adhan.py [--quick] [--only NAME] [--save-baseline] [--json]   suite vs bench_baseline.json
+  python bench_adhan.py --import-time                                          import-time budget of adhan
+  python bench_adhan.py --config-writes                                        config writes during a slider drag
+Every scenario runs in its own process inside a temp dir; GitHub/Aladhan are replaced by a local stub.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import adhan
+from adhan import (
+    CONFIG_FILE, DEFAULT_CONFIG, DEFAULT_METHOD, FILES_TO_UPDATE, HTTP, LOCAL_CITIES, LOCAL_MANIFEST,
+    LOCAL_PRAYER_CACHE, LOCAL_SYNC_STATE, LOCAL_THEME, LOCAL_VERSION_FILE, SITE_NEVER_MIRROR,
+    UPDATE_STAGING_DIR, AdhanCore, AdhanPlayer, ConfigStore, PrayerApp, PrayerCache, PrayerScheduler,
+    StartupTimer, compute_prayer_times_for_entry, fetch_prayer_times_for, file_sha256, get_local_version,
+    load_cities_mapping, prefetch_from_site, safe_load_json, safe_write_json, serve_site, set_site_server,
+    sync_assets, _city_date, _entry_method,
+)
+
+IMPORT_TIME_BUDGET_MS = 60   # حد زمن استيراد الموديول (python bench_adhan.py --import-time)
+BENCH_BASELINE = "bench_baseline.json"   # python bench_adhan.py --save-baseline
+BENCH_DEFAULT_THRESHOLD = 1.5            # أبطأ من الـ baseline بـ 50% = regression
+BENCH_THRESHOLDS = {"mb": 1.25}          # حسب الوحدة (آخر جزء من اسم المقياس)
+BENCH_MIN_DELTA = {"ms": 5.0, "mb": 2.0} # فروق أصغر من كده تعتبر ضوضاء
+# ------------------ قياس زمن الاستيراد (import-time benchmark) ------------------
+HEAVY_MODULES = ("requests", "pygame", "pystray", "PIL", "ttkbootstrap", "psutil", "tkinter")
+
+def benchmark_import_time(runs=5, threshold_ms=IMPORT_TIME_BUDGET_MS):
+    """
+    Import this module in fresh interpreters under `-X importtime`.
+    Fails (returns False) if the best cumulative time exceeds `threshold_ms`
+    or if any HEAVY_MODULES gets imported eagerly.
+    """
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+    module = adhan.__name__
+    best_us, heavy, slowest = None, set(), []
+    for _ in range(max(1, runs)):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              cwd=here, capture_output=True, text=True)
+        rows = []
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            try:
+                self_us, cum_us, name = [x.strip() for x in line[len("import time:"):].split("|")]
+                rows.append((int(self_us), int(cum_us), name))
+            except ValueError:
+                continue
+        total = next((cum for _, cum, name in rows if name == module), None)
+        if total is None:
+            print(proc.stderr[-2000:])
+            return False
+        heavy.update(name for _, _, name in rows if name.split(".")[0] in HEAVY_MODULES)
+        if best_us is None or total < best_us:
+            best_us = total
+            slowest = sorted(rows, reverse=True)[:10]
+    best_ms = best_us / 1000.0
+    print(f"import {module}: best of {runs} = {best_ms:.1f} ms (budget {threshold_ms} ms)")
+    for self_us, cum_us, name in slowest:
+        print(f"  {self_us / 1000.0:7.2f} ms self  {cum_us / 1000.0:7.2f} ms cum  {name}")
+    ok = best_ms <= threshold_ms and not heavy
+    if heavy:
+        print("eagerly imported heavy modules:", ", ".join(sorted(heavy)))
+    print("OK" if ok else "REGRESSION")
+    return ok
+
+# ------------------ قياس كتابة الإعدادات أثناء سحب الـ slider ------------------
+def benchmark_config_writes(events=120, hz=60):
+    """
+    Replay a volume-slider drag (`events` motion events at `hz`) against the old
+    save-on-every-event path and against ConfigStore, in a temp dir. Prints the number
+    of config.json writes and the per-event latency seen by the Tk thread.
+    """
+    import tempfile
+
+    def drag(on_event):
+        lat = []
+        for i in range(events):
+            t0 = time.perf_counter()
+            on_event(int(100 * i / max(1, events - 1)))
+            lat.append((time.perf_counter() - t0) * 1000.0)
+            time.sleep(1.0 / hz)
+        lat.sort()
+        return lat
+
+    def line(label, writes, lat):
+        p50, p99 = lat[len(lat) // 2], lat[min(len(lat) - 1, int(len(lat) * 0.99))]
+        print(f"{label:<12} writes={writes:<4} p50={p50:.3f} ms  p99={p99:.3f} ms  max={lat[-1]:.3f} ms")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, CONFIG_FILE)
+        cfg, writes = DEFAULT_CONFIG.copy(), [0]
+
+        def save_each(v):
+            cfg["volume"] = v
+            safe_write_json(path, cfg)
+            writes[0] += 1
+        lat = drag(save_each)
+        line("sync", writes[0], lat)
+
+        store = ConfigStore(path, data=DEFAULT_CONFIG)
+        lat = drag(lambda v: store.__setitem__("volume", v))
+        time.sleep(store.delay + 0.2)
+        line("write-behind", store.writes, lat)
+        saved = safe_load_json(path) or {}
+        # one write per max_delay of continuous dragging, plus the final one
+        ok = saved.get("volume") == 100 and store.writes <= int(events / hz / store.max_delay) + 1
+        print("OK" if ok else "REGRESSION")
+        return ok
+
+# ------------------ حزمة قياس الأداء (offline benchmarks) ------------------
+# python bench_adhan.py: كل سيناريو في process منفصل داخل مجلد مؤقت، والشبكة (GitHub + Aladhan)
+# بديلها سيرفر محلي، فالنتائج ممكن تتقارن بـ bench_baseline.json قبل نشر نسخة جديدة.
+BENCH_SCENARIOS = ("startup", "update", "scheduler", "player", "cities", "sync", "site")
+
+def _rss_mb():
+    """Resident memory of this process in MB (None if the platform gives no cheap answer)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except Exception:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2 ** 20
+    except Exception:
+        return None
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else None
+
+def _bench_stub(root):
+    """
+    Local stand-in for GitHub raw (files in `root`, with ETag and Range/If-Range) and
+    Aladhan's /v1/timings; returns (server, base_url). server.requests logs (path, Range, status).
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import parse_qs
+    served = set(FILES_TO_UPDATE) | {LOCAL_VERSION_FILE, LOCAL_MANIFEST}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            etag = None
+            if parts.path.startswith("/v1/timings"):
+                q = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                entry = {"lat": float(q["latitude"]), "lon": float(q["longitude"]), "tz": q.get("timezonestring", ""),
+                         "method": int(q.get("method", DEFAULT_METHOD)), "school": int(q.get("school", 0))}
+                d = datetime.strptime(q["date"], "%d-%m-%Y").date()
+                body = json.dumps({"code": 200, "data": {"timings": compute_prayer_times_for_entry(entry, d)}}).encode()
+                ctype = "application/json"
+                self.send_response(200)
+            else:
+                name = parts.path.rsplit("/", 1)[-1]
+                path = os.path.join(root, name)
+                if name not in served or not os.path.isfile(path):
+                    self.send_error(404)
+                    return
+                with open(path, "rb") as f:
+                    body = f.read()
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()
+                if self.headers.get("If-None-Match") == etag:
+                    return self._status(304)
+                ctype = "application/octet-stream"
+                rng = self.headers.get("Range") or ""
+                if rng.startswith("bytes=") and self.headers.get("If-Range") in (None, etag):
+                    start = int(rng[6:].split("-")[0])
+                    if start >= len(body):
+                        return self._status(416, {"Content-Range": f"bytes */{len(body)}"})
+                    self.server.requests.append((parts.path, rng, 206))
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+                    body = body[start:]
+                else:
+                    self.server.requests.append((parts.path, None, 200))
+                    self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            if etag:
+                self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _status(self, code, headers=None):
+            self.server.requests.append((self.path, self.headers.get("Range"), code))
+            self.send_response(code)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.requests = []
+    threading.Thread(target=server.serve_forever, name="bench-stub", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def _bench_point_at(base):
+    """Send every remote URL (version, manifest, assets, Aladhan) to the local stub."""
+    adhan.REMOTE_VERSION_URL = f"{base}/{LOCAL_VERSION_FILE}"
+    adhan.REMOTE_MANIFEST_URL = f"{base}/{LOCAL_MANIFEST}"
+    adhan.ALADHAN_API = f"{base}/v1/timings"
+    for name in FILES_TO_UPDATE:
+        FILES_TO_UPDATE[name] = f"{base}/{name}"
+
+def _bench_gazetteer(n, per_country=1000):
+    rnd = random.Random(n)
+    mapping = {}
+    for i in range(n):
+        country = mapping.setdefault(f"Country {i // per_country:03d}", {})
+        country[f"City {i:06d}"] = {"lat": round(rnd.uniform(-60, 65), 4), "lon": round(rnd.uniform(-180, 180), 4),
+                                    "tz": "UTC"}
+    return mapping
+
+def _bench_workdir(tmp, name, src):
+    import shutil
+    wd = os.path.join(tmp, name)
+    os.makedirs(wd, exist_ok=True)
+    for f in (LOCAL_CITIES, LOCAL_THEME, "adhan.mp3", LOCAL_VERSION_FILE):
+        if os.path.exists(os.path.join(src, f)):
+            shutil.copy(os.path.join(src, f), wd)
+    safe_write_json(os.path.join(wd, CONFIG_FILE), {"auto_start": False})
+    return wd
+
+# ---- children (run inside the work dir: python bench_adhan.py --child <name>) ----
+def _bench_child_startup():
+    startup = StartupTimer()
+    startup.mark("imports")
+    gui = os.name == "nt" or sys.platform == "darwin" or bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+    if gui:
+        app = PrayerApp(startup=startup)
+
+        def wait_for_paint():
+            if startup.elapsed_ms("first_paint") is None:
+                app.root.after(5, wait_for_paint)
+            else:
+                app.root.quit()
+        app.root.after(0, wait_for_paint)
+        app.run()
+        app.shutdown()
+        app.root.destroy()
+        phase = "first_paint"
+    else:
+        core = AdhanCore(startup=startup)
+        core.update_prayer_times(network=False)
+        startup.mark("cached_timings")
+        core.shutdown()
+        phase = "cached_timings"
+    ready_at = time.time() - (time.perf_counter() - startup.start) + startup.elapsed_ms(phase) / 1000.0
+    return {"ready_at": ready_at, "phase": phase, "gui": gui, "phases": startup.phases}
+
+def _bench_child_update(runs):
+    core = AdhanCore()
+
+    def timed(fn):
+        t0 = time.perf_counter()
+        fn()
+        return (time.perf_counter() - t0) * 1000.0
+
+    def cold(network):
+        core.cache.clear()
+        return timed(lambda: core.update_prayer_times(network=network))
+
+    out = {"offline_ms": _median([cold(False) for _ in range(runs)])}
+    out["cache_hit_ms"] = _median([timed(lambda: core.update_prayer_times(network=False)) for _ in range(runs)])
+    core.cfg["api_cross_check"] = True
+    out["online_ms"] = _median([cold(True) for _ in range(runs)])
+    core.shutdown()
+    return out
+
+def _bench_child_player(mode):
+    rss0 = _rss_mb()
+    player = AdhanPlayer("adhan.mp3", volume=0.0, streaming=(mode == "stream"))
+    t0 = time.perf_counter()
+    player.play(duration=2)
+    while not player.playing and time.perf_counter() - t0 < 30:
+        time.sleep(0.001)
+    load_ms = (time.perf_counter() - t0) * 1000.0
+    time.sleep(0.5)
+    rss1 = _rss_mb()
+    player.close()
+    return {"load_ms": load_ms, "rss_mb": (rss1 - rss0) if rss0 is not None and rss1 is not None else None}
+
+def _bench_child_cities():
+    t0 = time.perf_counter()
+    mapping = load_cities_mapping()
+    country = next(iter(mapping))
+    mapping[country][next(iter(mapping[country]))]
+    return {"ms": (time.perf_counter() - t0) * 1000.0, "type": type(mapping).__name__}
+
+def _bench_child_sync():
+    """
+    sync_assets() against its own stub: full download, no-op re-sync, a resumed .part,
+    a 416 for a leftover .part with no manifest entry, and an error page served with no
+    manifest entry (must not replace the live file). Returns timings + "failed" checks.
+    """
+    import shutil
+    remote = os.path.abspath("bench_remote")
+    os.makedirs(remote, exist_ok=True)
+    names = [n for n in FILES_TO_UPDATE if n != "adhan.py" and os.path.exists(n)]
+    for n in names:
+        shutil.move(n, os.path.join(remote, n))
+
+    def publish(manifest=True):
+        files = {n: {"sha256": file_sha256(os.path.join(remote, n)), "size": os.path.getsize(os.path.join(remote, n))}
+                 for n in names} if manifest else {}
+        safe_write_json(os.path.join(remote, LOCAL_MANIFEST), {"version": "bench", "files": files})
+
+    def same(n):
+        return os.path.exists(n) and file_sha256(n) == file_sha256(os.path.join(remote, n))
+
+    def leave_part(n, data):
+        """Simulate an interrupted download of `n`: `data` in its .part, with the remote ETag recorded."""
+        with open(os.path.join(remote, n), "rb") as f:
+            etag = '"%s"' % hashlib.sha1(f.read()).hexdigest()
+        os.remove(n)
+        os.makedirs(UPDATE_STAGING_DIR, exist_ok=True)
+        with open(os.path.join(UPDATE_STAGING_DIR, n + ".part"), "wb") as f:
+            f.write(data)
+        state = safe_load_json(LOCAL_SYNC_STATE) or {}
+        state.setdefault(n, {})["part_etag"] = etag
+        safe_write_json(LOCAL_SYNC_STATE, state)
+
+    def timed(label, fn):
+        t0 = time.perf_counter()
+        r = fn()
+        out[f"{label}_ms"] = (time.perf_counter() - t0) * 1000.0
+        return r
+
+    publish()
+    server, base = _bench_stub(remote)
+    _bench_point_at(base)
+    out, failed = {}, []
+    try:
+        r = timed("full", lambda: sync_assets(names))
+        if not all(r.get(n) == "updated" and same(n) for n in names):
+            failed.append(f"sync: full download {r}")
+        r = timed("unchanged", lambda: sync_assets(names))
+        if any(v != "unchanged" for v in r.values()):
+            failed.append(f"sync: re-sync with the manifest matching {r}")
+
+        big = max(names, key=lambda n: os.path.getsize(n))
+        with open(big, "rb") as f:
+            data = f.read()
+        leave_part(big, data[:len(data) // 2])
+        del server.requests[:]
+        r = timed("resume", lambda: sync_assets([big]))
+        ranged = [req for req in server.requests if req[2] == 206]
+        if r.get(big) != "updated" or not same(big) or not ranged:
+            failed.append(f"sync: resume of a half-downloaded {big} {r} {server.requests}")
+
+        publish(manifest=False)
+        leave_part(big, b"\0" * len(data))   # full length but wrong: the server answers 416
+        del server.requests[:]
+        r = sync_assets([big])
+        if r.get(big) != "updated" or not same(big) or 416 not in [req[2] for req in server.requests]:
+            failed.append(f"sync: 416 without a manifest entry must refetch {big} {r} {server.requests}")
+
+        for n in names:   # no manifest entry and an HTML error page where the file should be
+            live = file_sha256(n)
+            with open(os.path.join(remote, n), "wb") as f:
+                f.write(b"<html><body>502 Bad Gateway</body></html>")
+            r = sync_assets([n])
+            if r.get(n) != "failed" or file_sha256(n) != live:
+                failed.append(f"sync: an error page replaced the live {n} {r}")
+    finally:
+        server.shutdown()
+    out["failed"] = failed
+    return out
+
+def _bench_child_site():
+    """
+    A site server and a client in one process, all on localhost: 304 for If-None-Match,
+    a client whose upstream file URLs are unreachable served by the site server (checked
+    against the upstream manifest, so a tampered copy is refused), the app taking the site's
+    timings in the background without waiting on a hung site server, and local results once
+    the site server is down. Returns timings + "failed" checks.
+    """
+    import shutil
+    import socket
+    here = os.path.abspath(".")
+    remote, client = os.path.join(here, "bench_remote"), os.path.join(here, "bench_client")
+    os.makedirs(remote, exist_ok=True)
+    os.makedirs(client, exist_ok=True)
+    names = [n for n in FILES_TO_UPDATE if n not in SITE_NEVER_MIRROR and os.path.exists(n)]
+    for n in names:
+        shutil.copy(n, remote)
+    safe_write_json(os.path.join(remote, LOCAL_MANIFEST), {"version": "bench", "files": {
+        n: {"sha256": file_sha256(n), "size": os.path.getsize(n)} for n in names}})
+    tampered = names[-1]
+    with open(tampered, "ab") as f:   # the site's copy no longer matches the manifest
+        f.write(b"\n")
+
+    mapping = load_cities_mapping()
+    country = next(iter(mapping))
+    city = next(iter(mapping[country]))
+    entry = mapping[country][city]
+    method, today = _entry_method(entry), _city_date(entry.get("tz", ""))
+    site = serve_site(0, lambda: mapping, PrayerCache(path=os.path.join(here, LOCAL_PRAYER_CACHE)))
+    site_url = f"http://127.0.0.1:{site.server_port}"
+    upstream, base = _bench_stub(remote)
+    _bench_point_at(base)   # the manifest stays reachable: it is what the mirror is checked against
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        dead = f"http://127.0.0.1:{sock.getsockname()[1]}"   # closed again: connection refused
+    adhan.ALADHAN_API = f"{dead}/v1/timings"
+    for n in FILES_TO_UPDATE:
+        FILES_TO_UPDATE[n] = f"{dead}/{n}"
+
+    def same(n):
+        return os.path.exists(n) and file_sha256(n) == file_sha256(os.path.join(remote, n))
+
+    def source(d):
+        return (cache.info(city, country, method, d) or {}).get("source")
+
+    def timed(label, fn):
+        t0 = time.perf_counter()
+        r = fn()
+        out[f"{label}_ms"] = (time.perf_counter() - t0) * 1000.0
+        return r
+
+    out, failed = {}, []
+    try:
+        for path, params in (("/v1/timings", {"city": city, "country": country}),
+                             ("/v1/schedule", {"city": city, "country": country, "days": 7}),
+                             (f"/v1/files/{names[0]}", None)):
+            first = HTTP.get(site_url + path, params=params)
+            again = HTTP.get(site_url + path, params=params, headers={"If-None-Match": first.headers.get("ETag", "")})
+            if first.status_code != 200 or not first.headers.get("ETag") or again.status_code != 304:
+                failed.append(f"site: {path} gave {first.status_code} then {again.status_code} for If-None-Match")
+        for name in SITE_NEVER_MIRROR:
+            if HTTP.get(f"{site_url}/v1/files/{name}").status_code != 404:
+                failed.append(f"site: serves {name}")
+
+        os.chdir(client)
+        set_site_server(site_url)
+        cache = PrayerCache(path=os.path.join(client, LOCAL_PRAYER_CACHE))
+        r = timed("mirror_sync", lambda: sync_assets(names))
+        if any(r.get(n) != "updated" or not same(n) for n in names if n != tampered):
+            failed.append(f"site: assets not mirrored while upstream is unreachable {r}")
+        if r.get(tampered) != "failed" or os.path.exists(tampered):
+            failed.append(f"site: a copy that does not match the manifest was accepted {r}")
+        timings = timed("timings", lambda: fetch_prayer_times_for(city, country, mapping, d=today, cache=cache))
+        if not timings or source(today) != "site":
+            failed.append(f"site: timings not served by the site server ({source(today)})")
+        if prefetch_from_site(cache, city, country, mapping, days=7) != 6:
+            failed.append("site: /v1/schedule prefetch did not fill the next 6 days")
+
+        core = AdhanCore()
+        core.cfg["city_country"] = [city, country]
+        set_site_server(site_url)
+        core.cache.clear()
+        core.update_prayer_times(network=True)
+        deadline = time.time() + 10
+        while core.revalidator.pending(("site",)) and time.time() < deadline:
+            time.sleep(0.01)
+        if (core.cache.info(city, country, method, today) or {}).get("source") != "site":
+            failed.append("site: the app did not take the site server's timings in the background")
+        with socket.socket() as hung:   # accepts connections, never answers
+            hung.bind(("127.0.0.1", 0))
+            hung.listen()
+            set_site_server(f"http://127.0.0.1:{hung.getsockname()[1]}")
+            core.cache.clear()
+            timed("app_hung_site", lambda: core.update_prayer_times(network=True))
+            if out["app_hung_site_ms"] > 1000 or not core.timings:
+                failed.append(f"site: update_prayer_times waited on a hung site server ({out['app_hung_site_ms']:.0f} ms)")
+            core.update_prayer_times(network=False)
+        core.shutdown()
+        set_site_server(site_url)
+
+        site.shutdown()
+        site.server_close()
+        later = today + timedelta(days=30)
+        timings = timed("down_fallback", lambda: fetch_prayer_times_for(city, country, mapping, d=later, cache=cache))
+        if timings != compute_prayer_times_for_entry(entry, later) or source(later) != "local":
+            failed.append(f"site: no local fallback with the site server down ({source(later)})")
+        if prefetch_from_site(cache, city, country, mapping, days=40) != 0:
+            failed.append("site: prefetch reported days with the site server down")
+    finally:
+        os.chdir(here)
+        set_site_server(None)
+        upstream.shutdown()
+        site.shutdown()
+    out["failed"] = failed
+    return out
+
+def _bench_child(name, stub=None, arg=None):
+    if stub:
+        _bench_point_at(stub)
+    if name == "startup":
+        return _bench_child_startup()
+    if name == "update":
+        return _bench_child_update(int(arg or 5))
+    if name == "player":
+        return _bench_child_player(arg)
+    if name == "cities":
+        return _bench_child_cities()
+    if name == "sync":
+        return _bench_child_sync()
+    if name == "site":
+        return _bench_child_site()
+    raise ValueError(name)
+
+# ---- orchestration ----
+def _bench_scheduler(n=40, spacing=0.025):
+    """Lateness (ms) of PrayerScheduler callbacks against their scheduled wall time."""
+    sched = PrayerScheduler()
+    late, done = [], threading.Event()
+
+    def fired(name, when, lateness):
+        late.append((time.time() - when.timestamp()) * 1000.0)
+        if len(late) >= n:
+            done.set()
+    base = datetime.now().astimezone() + timedelta(seconds=0.3)
+    sched.set_group("bench", [(base + timedelta(seconds=spacing * i), f"bench{i}", fired) for i in range(n)])
+    sched.start()
+    done.wait(5 + n * spacing)
+    sched.stop()
+    late.sort()
+    if not late:
+        return {}
+    return {"scheduler_late_p50_ms": late[len(late) // 2], "scheduler_late_p95_ms": late[int(len(late) * 0.95) - 1]}
+
+def _bench_catch_up():
+    """Failed checks for the missed-prayer policies after a suspend that overslept a
+    prayer together with its housekeeping (_prepare_audio at T-30s)."""
+    failed = []
+    now = datetime.now().astimezone()
+    noop = lambda name, when, late: None
+    for policy, want_fire, want_missed in (("latest", ["_prepare_audio", "Fajr"], []),
+                                           ("skip", ["_prepare_audio"], ["Fajr"])):
+        sched = PrayerScheduler(catch_up=policy)
+        sched.set_group("bench", [(now - timedelta(seconds=150), "_prepare_audio", noop),
+                                  (now - timedelta(seconds=120), "Fajr", noop)])
+        with sched._cond:
+            fire, missed = sched._collect_due(time.time())
+        got = (sorted(e[3] for e in fire), [e[3] for e in missed])
+        if got != (sorted(want_fire), want_missed):
+            failed.append(f"catch_up={policy} after suspend: fire {got[0]} missed {got[1]}")
+    return failed
+
+def run_benchmarks(quick=False, only=None):
+    """Run the suite; returns (metrics {name: value}, info {...})."""
+    import subprocess
+    import tempfile
+    here = os.path.dirname(os.path.abspath(__file__))
+    script = os.path.abspath(__file__)
+    runs = 3 if quick else 5
+    want = lambda s: not only or s in only
+    metrics, info = {}, {"python": sys.version.split()[0], "platform": sys.platform, "quick": quick}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server, base = _bench_stub(here)
+
+        def child(name, cwd, arg=None):
+            env = dict(os.environ, SDL_AUDIODRIVER=os.environ.get("SDL_AUDIODRIVER", "dummy"))
+            cmd = [sys.executable, script, "--child", name, "--stub", base] + (["--arg", str(arg)] if arg else [])
+            proc = subprocess.run(cmd, cwd=cwd, env=env, capture_output=True, text=True, timeout=300)
+            for line in reversed(proc.stdout.splitlines()):
+                if line.startswith("BENCH_RESULT "):
+                    return json.loads(line[len("BENCH_RESULT "):])
+            raise RuntimeError(f"bench child {name} failed:\n{proc.stderr[-2000:]}")
+
+        try:
+            if want("startup"):
+                wd = _bench_workdir(tmp, "startup", here)
+                for label in ("cold", "warm"):
+                    samples = []
+                    for _ in range(1 if label == "cold" else runs):
+                        t0 = time.time()
+                        r = child("startup", wd)
+                        samples.append((r["ready_at"] - t0) * 1000.0)
+                    metrics[f"startup_{label}_ms"] = _median(samples)
+                info["startup_until"] = r["phase"]
+            if want("update"):
+                r = child("update", _bench_workdir(tmp, "update", here), runs)
+                for k, v in r.items():
+                    metrics[f"update_prayer_times_{k}"] = v
+            if want("scheduler"):
+                metrics.update(_bench_scheduler())
+                info.setdefault("failed", []).extend(_bench_catch_up())
+            if want("player"):
+                for mode in ("stream", "decoded"):
+                    r = child("player", _bench_workdir(tmp, "player", here), mode)
+                    metrics[f"player_{mode}_load_ms"] = r["load_ms"]
+                    if r["rss_mb"] is not None:
+                        metrics[f"player_{mode}_rss_mb"] = r["rss_mb"]
+            if want("cities"):
+                for n in ((1000, 10000) if quick else (1000, 10000, 100000)):
+                    wd = os.path.join(tmp, f"cities{n}")
+                    os.makedirs(wd)
+                    with open(os.path.join(wd, LOCAL_CITIES), "w", encoding="utf-8") as f:
+                        json.dump(_bench_gazetteer(n), f)
+                    metrics[f"load_cities_{n}_cold_ms"] = child("cities", wd)["ms"]
+                    metrics[f"load_cities_{n}_warm_ms"] = _median([child("cities", wd)["ms"] for _ in range(runs)])
+            if want("sync"):
+                r = child("sync", _bench_workdir(tmp, "sync", here))
+                info.setdefault("failed", []).extend(r.pop("failed"))
+                for k, v in r.items():
+                    metrics[f"sync_{k}"] = v
+            if want("site"):
+                r = child("site", _bench_workdir(tmp, "site", here))
+                info.setdefault("failed", []).extend(r.pop("failed"))
+                for k, v in r.items():
+                    metrics[f"site_{k}"] = v
+        finally:
+            server.shutdown()
+    return metrics, info
+
+def compare_to_baseline(metrics, baseline):
+    """Rows (name, value, base, status); a metric regresses when it is over base*threshold
+    and also over base + BENCH_MIN_DELTA for its unit (so tiny timings don't flap)."""
+    rows = []
+    base_metrics = (baseline or {}).get("metrics", {})
+    thresholds = (baseline or {}).get("thresholds", {})
+    for name, value in metrics.items():
+        base = base_metrics.get(name)
+        unit = name.rsplit("_", 1)[-1]
+        limit = thresholds.get(name, BENCH_THRESHOLDS.get(unit, BENCH_DEFAULT_THRESHOLD))
+        if base is None:
+            status = "new"
+        elif value > base * limit and value - base > BENCH_MIN_DELTA.get(unit, 0):
+            status = "REGRESSION"
+        else:
+            status = "ok"
+        rows.append((name, value, base, status))
+    return rows
+
+def cli_bench(args):
+    if args.child:
+        print("BENCH_RESULT " + json.dumps(_bench_child(args.child, args.stub, args.arg)))
+        return 0
+    metrics, info = run_benchmarks(quick=args.quick, only=args.only)
+    baseline = safe_load_json(args.baseline)
+    rows = compare_to_baseline(metrics, baseline)
+    if args.json:
+        print(json.dumps({"info": info, "metrics": metrics,
+                          "status": {name: status for name, _, _, status in rows}}, indent=2))
+    else:
+        print(f"{'metric':<36}{'value':>12}{'baseline':>12}  status")
+        for name, value, base, status in rows:
+            print(f"{name:<36}{value:>12.2f}{(f'{base:.2f}' if base is not None else '-'):>12}  {status}")
+        print("startup measured until:", info.get("startup_until", "-"))
+        for what in info.get("failed", []):
+            print("FAILED:", what)
+    if args.save_baseline:
+        doc = {"created": datetime.now().isoformat(timespec="seconds"), "version": get_local_version(),
+               "info": info, "metrics": {**(baseline or {}).get("metrics", {}), **metrics},
+               "thresholds": (baseline or {}).get("thresholds", {})}
+        safe_write_json(args.baseline, doc)
+        print("baseline saved:", args.baseline)
+        return 0
+    return 1 if info.get("failed") or any(status == "REGRESSION" for *_, status in rows) else 0
+
+def build_arg_parser():
+    import argparse
+    ap = argparse.ArgumentParser(prog="bench_adhan", description="offline benchmark suite for adhan.py (local HTTP stub) "
+                                                                "compared to a saved baseline")
+    ap.add_argument("--import-time", action="store_true", help="import-time regression check")
+    ap.add_argument("--config-writes", action="store_true", help="config writes / UI latency during a slider drag")
+    ap.add_argument("--quick", action="store_true", help="fewer runs, gazetteers up to 10k places")
+    ap.add_argument("--only", action="append", choices=BENCH_SCENARIOS, help="run one scenario (repeatable)")
+    ap.add_argument("--baseline", default=BENCH_BASELINE)
+    ap.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    ap.add_argument("--json", action="store_true")
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    ap.add_argument("--stub", help=argparse.SUPPRESS)
+    ap.add_argument("--arg", help=argparse.SUPPRESS)
+    return ap
+
+def main():
+    args = build_arg_parser().parse_args()
+    if args.import_time:
+        sys.exit(0 if benchmark_import_time() else 1)
+    if args.config_writes:
+        sys.exit(0 if benchmark_config_writes() else 1)
+    sys.exit(cli_bench(args))
+
+if __name__ == "__main__":
+    main()